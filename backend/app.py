@@ -2,6 +2,7 @@ from flask import Flask, request, jsonify, send_from_directory, session
 from flask_cors import CORS
 import chess
 import chess.pgn
+import chess.polyglot
 import io
 import re
 from typing import Dict, List, Any, Optional
@@ -10,8 +11,18 @@ import sqlite3
 import json
 from datetime import datetime, timedelta
 import threading
+import atexit
+import calendar
+import click
 import hashlib
+import gzip
 import secrets
+import struct
+import array
+import random
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 from functools import wraps
 
 app = Flask(__name__)
@@ -25,8 +36,454 @@ app.config['SESSION_COOKIE_HTTPONLY'] = False  # 改为False以便JavaScript访
 app.config['SESSION_COOKIE_DOMAIN'] = None  # 不限制域名
 
 # 数据库配置
-DATABASE_PATH = 'chess_pgn.db'
-db_lock = threading.Lock()
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'chess_pgn.db')
+DB_JOURNAL_MODE = os.environ.get('DB_JOURNAL_MODE', 'WAL')  # WAL模式下读不阻塞写，写不阻塞读
+# SQLite自带的忙等待在C代码里sleep，gevent下会卡住整个hub，所以只保留很短的忙等待，
+# 更长的等待由db_write在Python里退避重试（gevent打补丁后time.sleep会让出执行权）
+DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 50))  # SQLite忙等待毫秒数
+DB_WRITE_TIMEOUT = int(os.environ.get('DB_WRITE_TIMEOUT', 10000))  # 获取数据库写锁的总等待毫秒数
+DB_WRITE_RETRY_BASE_DELAY = int(os.environ.get('DB_WRITE_RETRY_BASE_DELAY', 5))  # 首次重试前等待毫秒数
+DB_WRITE_RETRY_MAX_DELAY = int(os.environ.get('DB_WRITE_RETRY_MAX_DELAY', 200))  # 单次重试最长等待毫秒数
+# 组提交：窗口内到达的进度写入合并为一个事务、一次提交，0表示关闭（每次写入单独提交）
+DB_GROUP_COMMIT_WINDOW_MS = float(os.environ.get('DB_GROUP_COMMIT_WINDOW_MS', 0))
+DB_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('DB_GROUP_COMMIT_MAX_BATCH', 64))  # 单个组提交最多合并的写入数
+
+# 连接管理配置
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))  # 空闲连接池大小，0表示每次用完即关闭
+DB_CONNECTION_MAX_AGE = int(os.environ.get('DB_CONNECTION_MAX_AGE', 300))  # 连接最长存活时间（秒）
+DB_CONNECTION_MAX_USES = int(os.environ.get('DB_CONNECTION_MAX_USES', 1000))  # 连接最多借出次数
+DB_HEALTH_CHECK_INTERVAL = int(os.environ.get('DB_HEALTH_CHECK_INTERVAL', 30))  # 空闲超过该秒数借出前做健康检查
+DB_PRAGMAS = {
+    'journal_mode': DB_JOURNAL_MODE,
+    'synchronous': 'NORMAL' if DB_JOURNAL_MODE.upper() == 'WAL' else 'FULL',
+    'busy_timeout': DB_BUSY_TIMEOUT,
+    'temp_store': 'MEMORY',
+    'cache_size': -8000,  # 约8MB页缓存
+}
+
+class ConnectionManager:
+    """SQLite连接管理器
+
+    连接在借出期间只属于当前线程（gevent下threading.local会被monkey patch为greenlet本地），
+    同一线程内嵌套借用复用同一个连接；用完归还到空闲池供后续请求复用。
+    借出前对空闲过久的连接做健康检查，超过存活时间或借出次数的连接会被关闭重建。
+    """
+
+    def __init__(self, database_path: str, pragmas: Optional[Dict[str, Any]] = None,
+                 pool_size: int = DB_POOL_SIZE, max_age: int = DB_CONNECTION_MAX_AGE,
+                 max_uses: int = DB_CONNECTION_MAX_USES,
+                 health_check_interval: int = DB_HEALTH_CHECK_INTERVAL,
+                 trace_callback=None):
+        self.database_path = database_path
+        self.pragmas = dict(pragmas or {})
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.health_check_interval = health_check_interval
+        self.trace_callback = trace_callback
+        self._idle = deque()
+        self._idle_lock = threading.Lock()
+        self._local = threading.local()
+        self.stats = {
+            'opened': 0,
+            'reused': 0,
+            'recycled': 0,
+            'health_check_failures': 0
+        }
+        # 以preload方式fork出的worker不能沿用父进程的SQLite连接
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """子进程丢弃从父进程继承的连接（不关闭，避免影响父进程持有的连接）"""
+        self._idle = deque()
+        self._idle_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _open(self) -> Dict[str, Any]:
+        """打开新连接并应用PRAGMA配置"""
+        # isolation_level=None：读查询不再隐式开启事务，写事务由db_write显式BEGIN
+        conn = sqlite3.connect(self.database_path, check_same_thread=False, isolation_level=None)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.trace_callback is not None:
+            conn.set_trace_callback(self.trace_callback)
+        self.stats['opened'] += 1
+        now = time.monotonic()
+        return {'conn': conn, 'created_at': now, 'last_used': now, 'uses': 0}
+
+    def _is_expired(self, entry: Dict[str, Any]) -> bool:
+        """连接是否超过存活时间或借出次数"""
+        return (time.monotonic() - entry['created_at'] > self.max_age
+                or entry['uses'] >= self.max_uses)
+
+    def _is_healthy(self, entry: Dict[str, Any]) -> bool:
+        """空闲过久的连接借出前执行一次轻量查询"""
+        if time.monotonic() - entry['last_used'] < self.health_check_interval:
+            return True
+        try:
+            entry['conn'].execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            self.stats['health_check_failures'] += 1
+            return False
+
+    def _acquire(self) -> Dict[str, Any]:
+        """从空闲池取出可用连接，没有则新建"""
+        while True:
+            with self._idle_lock:
+                entry = self._idle.pop() if self._idle else None
+            if entry is None:
+                return self._open()
+            if self._is_expired(entry) or not self._is_healthy(entry):
+                self.stats['recycled'] += 1
+                self._close_entry(entry)
+                continue
+            self.stats['reused'] += 1
+            return entry
+
+    def _release(self, entry: Dict[str, Any]):
+        """归还连接：回滚未提交的事务，放回空闲池或关闭"""
+        conn = entry['conn']
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._close_entry(entry)
+            return
+        entry['uses'] += 1
+        entry['last_used'] = time.monotonic()
+        if self._is_expired(entry):
+            self.stats['recycled'] += 1
+            self._close_entry(entry)
+            return
+        with self._idle_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(entry)
+                return
+        self._close_entry(entry)
+
+    @staticmethod
+    def _close_entry(entry: Dict[str, Any]):
+        try:
+            entry['conn'].close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """借用当前线程的连接，嵌套调用复用同一连接"""
+        entry = getattr(self._local, 'entry', None)
+        if entry is not None:
+            self._local.depth += 1
+            try:
+                yield entry['conn']
+            finally:
+                self._local.depth -= 1
+            return
+
+        entry = self._acquire()
+        self._local.entry = entry
+        self._local.depth = 1
+        try:
+            yield entry['conn']
+        finally:
+            self._local.entry = None
+            self._local.depth = 0
+            self._release(entry)
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._idle_lock:
+            entries = list(self._idle)
+            self._idle.clear()
+        for entry in entries:
+            self._close_entry(entry)
+
+class QueryPlanRecorder:
+    """记录应用实际执行过的SQL，并用EXPLAIN QUERY PLAN检查是否存在全表扫描
+
+    作为连接的trace回调使用，按去掉字面量后的语句去重，每种语句保留一个带实际参数的样例。
+    """
+
+    IGNORED_PREFIXES = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE',
+                        'EXPLAIN', 'CREATE', 'DROP', 'ALTER')
+
+    def __init__(self):
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(sql: str) -> str:
+        """把字面量替换为?并压缩空白，作为去重键"""
+        sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+        sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+        return ' '.join(sql.split())
+
+    def __call__(self, sql: str):
+        if sql.lstrip().upper().startswith(self.IGNORED_PREFIXES):
+            return
+        key = self.normalize(sql)
+        with self._lock:
+            self.statements.setdefault(key, sql)
+
+    def report(self, conn) -> List[Dict[str, Any]]:
+        """对每种语句执行EXPLAIN QUERY PLAN，full_scans列出未使用索引的表扫描"""
+        with self._lock:
+            samples = dict(self.statements)
+        result = []
+        for key, sql in sorted(samples.items()):
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+            full_scans = [detail for detail in plan
+                          if detail.startswith('SCAN ') and ' USING ' not in detail]
+            result.append({'sql': key, 'plan': plan, 'full_scans': full_scans})
+        return result
+
+# 设置DB_EXPLAIN_QUERIES=1后记录所有查询，可通过/api/admin/query-plans查看执行计划
+query_plan_recorder = QueryPlanRecorder() if os.environ.get('DB_EXPLAIN_QUERIES') == '1' else None
+
+db_manager = ConnectionManager(DATABASE_PATH, DB_PRAGMAS, trace_callback=query_plan_recorder)
+
+class DatabaseBusyError(Exception):
+    """等待写锁超时"""
+    pass
+
+class WriteLockMetrics:
+    """写锁等待统计：进程内排队时间和SQLite跨进程锁的重试情况"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.transactions = 0
+            self.local_wait_total = 0.0
+            self.local_wait_max = 0.0
+            self.busy_retries = 0
+            self.busy_wait_total = 0.0
+            self.busy_wait_max = 0.0
+            self.timeouts = 0
+
+    def record(self, local_wait: float, busy_wait: float, retries: int, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.transactions += 1
+            self.local_wait_total += local_wait
+            self.local_wait_max = max(self.local_wait_max, local_wait)
+            self.busy_retries += retries
+            self.busy_wait_total += busy_wait
+            self.busy_wait_max = max(self.busy_wait_max, busy_wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            count = max(self.transactions, 1)
+            return {
+                'transactions': self.transactions,
+                'timeouts': self.timeouts,
+                'busy_retries': self.busy_retries,
+                'local_wait_avg_ms': round(self.local_wait_total / count * 1000, 3),
+                'local_wait_max_ms': round(self.local_wait_max * 1000, 3),
+                'busy_wait_avg_ms': round(self.busy_wait_total / count * 1000, 3),
+                'busy_wait_max_ms': round(self.busy_wait_max * 1000, 3)
+            }
+
+write_metrics = WriteLockMetrics()
+
+# 进程内写锁：只串行化本进程的写事务，读查询不加锁并发执行；
+# 跨进程（gunicorn多worker）由SQLite的数据库锁协调，见_begin_immediate
+db_write_lock = threading.Lock()
+
+def _reset_write_lock_after_fork():
+    global db_write_lock
+    db_write_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_write_lock_after_fork)
+
+# 当前线程所在写事务的提交后回调，不在写事务中时为None
+_write_state = threading.local()
+
+def after_commit(fn):
+    """当前写事务提交成功后、释放写锁前调用fn，事务回滚时丢弃；不在写事务中时立即调用
+
+    fn在写锁内执行，不能阻塞或再次进入db_write。
+    """
+    hooks = getattr(_write_state, 'hooks', None)
+    if hooks is None:
+        fn()
+    else:
+        hooks.append(fn)
+
+def _is_busy_error(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def _begin_immediate(conn) -> tuple:
+    """开启写事务，数据库被其他进程锁住时指数退避重试，返回 (等待秒数, 重试次数)"""
+    start = time.monotonic()
+    deadline = start + DB_WRITE_TIMEOUT / 1000
+    delay = DB_WRITE_RETRY_BASE_DELAY / 1000
+    retries = 0
+    while True:
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            return time.monotonic() - start, retries
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e):
+                raise
+            now = time.monotonic()
+            if now >= deadline:
+                raise DatabaseBusyError('数据库繁忙，请稍后重试') from e
+            retries += 1
+            # 加随机抖动，避免多个worker同时醒来再次冲突
+            time.sleep(min(delay * random.uniform(0.5, 1.5), deadline - now))
+            delay = min(delay * 2, DB_WRITE_RETRY_MAX_DELAY / 1000)
+
+@contextmanager
+def db_read():
+    """只读访问：直接借用连接，不占用写锁"""
+    with db_manager.connection() as conn:
+        yield conn
+
+@contextmanager
+def db_write():
+    """写访问：进程内串行化，BEGIN IMMEDIATE提前拿到数据库写锁，正常退出时提交，异常时回滚"""
+    wait_start = time.monotonic()
+    with db_write_lock, db_manager.connection() as conn:
+        local_wait = time.monotonic() - wait_start
+        try:
+            busy_wait, retries = _begin_immediate(conn)
+        except DatabaseBusyError:
+            write_metrics.record(local_wait, time.monotonic() - wait_start - local_wait, 0, timed_out=True)
+            raise
+        write_metrics.record(local_wait, busy_wait, retries)
+        _write_state.hooks = hooks = []
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            _write_state.hooks = None
+        if conn.in_transaction:
+            conn.commit()
+        for hook in hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"提交后回调失败: {str(e)}")
+
+class _GroupCommitOp:
+    __slots__ = ('fn', 'result', 'error', 'lead', 'event')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.result = None
+        self.error = None
+        self.lead = False
+        self.event = threading.Event()
+
+class GroupCommitter:
+    """组提交
+
+    并发写入先排队，队首的调用方成为leader，等待一个窗口（或攒满max_batch）后
+    在一个写事务里依次执行所有排队的写入，每个写入包在自己的SAVEPOINT里，
+    单个写入出错只回滚它自己；提交成功后才唤醒各调用方返回结果，提交失败则全部报错。
+    leader处理完一组后把leader身份交给下一组的队首，没有后台线程。
+    """
+
+    def __init__(self, window_ms: float = DB_GROUP_COMMIT_WINDOW_MS, max_batch: int = DB_GROUP_COMMIT_MAX_BATCH):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._reset()
+        self.stats = {'groups': 0, 'operations': 0, 'max_group_size': 0, 'failed_groups': 0}
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._cond = threading.Condition()
+        self._pending = []
+        self._leader_active = False
+
+    def run(self, fn):
+        """执行写入函数fn(conn)，返回其结果；组提交关闭时直接使用db_write"""
+        if self.window_ms <= 0:
+            with db_write() as conn:
+                return fn(conn)
+
+        op = _GroupCommitOp(fn)
+        with self._cond:
+            self._pending.append(op)
+            if self._leader_active:
+                if len(self._pending) >= self.max_batch:
+                    self._cond.notify_all()
+            else:
+                self._leader_active = True
+                op.lead = True
+
+        if not op.lead:
+            op.event.wait()
+        if op.lead:
+            # 成为leader时自己的写入一定在本组中，_lead返回即已完成
+            self._lead()
+        if op.error is not None:
+            raise op.error
+        return op.result
+
+    def _lead(self):
+        deadline = time.monotonic() + self.window_ms / 1000
+        with self._cond:
+            while len(self._pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+
+        try:
+            with db_write() as conn:
+                for op in batch:
+                    conn.execute('SAVEPOINT group_commit_op')
+                    mark = len(_write_state.hooks)
+                    try:
+                        op.result = op.fn(conn)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO group_commit_op')
+                        # 回滚的写入不触发它登记的提交后回调
+                        del _write_state.hooks[mark:]
+                        op.error = e
+                    conn.execute('RELEASE group_commit_op')
+            self.stats['groups'] += 1
+            self.stats['operations'] += len(batch)
+            self.stats['max_group_size'] = max(self.stats['max_group_size'], len(batch))
+        except BaseException as e:
+            # 整组提交失败（如数据库繁忙超时），组内每个调用方都收到错误
+            self.stats['failed_groups'] += 1
+            for op in batch:
+                op.result = None
+                op.error = e if isinstance(e, Exception) else DatabaseBusyError('组提交被中断')
+            raise
+        finally:
+            with self._cond:
+                if self._pending:
+                    successor = self._pending[0]
+                    successor.lead = True
+                    successor.event.set()
+                else:
+                    self._leader_active = False
+            for op in batch:
+                op.event.set()
+
+group_committer = GroupCommitter()
+
+def db_group_write(fn):
+    """按组提交方式执行写入函数fn(conn)，调用方在共享事务提交后才返回"""
+    return group_committer.run(fn)
 
 def hash_password(password: str) -> str:
     """哈希密码"""
@@ -40,14 +497,99 @@ def generate_token() -> str:
     """生成会话token"""
     return secrets.token_urlsafe(32)
 
-def init_database():
-    """初始化数据库"""
-    with db_lock:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
+# 重置纪元：每个(用户, PGN)在progress_epochs中记录当前纪元epoch和最近一次彻底重置的纪元hard_epoch。
+# 进度、学习日志及其汇总都带上纪元；重置只递增纪元，旧纪元的行对读取不可见，由后台清理器分批删除。
+# 一行进度可见：所属纪元就是当前纪元，或者不早于最近的彻底重置且该分支已掌握（普通重置保留已掌握分支）
+def progress_mastered_sql(alias: str) -> str:
+    """分支已掌握（完成且全部正确）的SQL条件"""
+    return f'{alias}.is_completed = 1 AND {alias}.total_attempts > 0 AND {alias}.correct_count = {alias}.total_attempts'
+
+def progress_visible_sql(alias: str) -> str:
+    """user_progress中的行在当前重置纪元下可见的SQL条件"""
+    return f'''NOT EXISTS (
+        SELECT 1 FROM progress_epochs e
+        WHERE e.user_id = {alias}.user_id AND e.pgn_game_id = {alias}.pgn_game_id
+        AND {alias}.epoch <> e.epoch
+        AND ({alias}.epoch < e.hard_epoch OR NOT ({progress_mastered_sql(alias)}))
+    )'''
+
+def study_log_visible_sql(alias: str) -> str:
+    """user_study_logs中的行在当前重置纪元下可见的SQL条件：旧纪元的日志只在对应分支仍保留为已掌握时可见"""
+    return f'''NOT EXISTS (
+        SELECT 1 FROM progress_epochs e
+        WHERE e.user_id = {alias}.user_id AND e.pgn_game_id = {alias}.pgn_game_id
+        AND {alias}.epoch <> e.epoch
+        AND ({alias}.epoch < e.hard_epoch OR NOT EXISTS (
+            SELECT 1 FROM user_progress kept
+            WHERE kept.user_id = {alias}.user_id AND kept.pgn_game_id = {alias}.pgn_game_id
+            AND kept.branch_id = {alias}.branch_id AND kept.epoch >= e.hard_epoch
+            AND {progress_mastered_sql('kept')}
+        ))
+    )'''
+
+# 从user_progress的可见行重新聚合progress_rollup（修复漂移、普通重置后刷新汇总共用）
+# 已删除PGN的进度和汇总行在后台清理任务删完之前不计入汇总，也不算作漂移
+def progress_rollup_select_sql(extra_where: str = '') -> str:
+    return f'''
+        SELECT 
+            user_id,
+            pgn_game_id,
+            COUNT(*),
+            SUM(CASE WHEN is_completed = 1 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN {progress_mastered_sql('user_progress')} THEN 1 ELSE 0 END),
+            SUM(COALESCE(correct_count, 0)),
+            SUM(COALESCE(total_attempts, 0)),
+            MAX(last_attempt_at)
+        FROM user_progress
+        WHERE {progress_visible_sql('user_progress')}
+        AND pgn_game_id IN (SELECT id FROM pgn_games WHERE deleted_at IS NULL) {extra_where}
+        GROUP BY user_id, pgn_game_id
+    '''
+
+def rebuild_progress_rollup(conn) -> int:
+    """在当前写事务中按user_progress重建progress_rollup，返回修正前与重新聚合结果不一致的行数"""
+    drifted = conn.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT * FROM ({progress_rollup_select_sql()})
+            EXCEPT
+            SELECT user_id, pgn_game_id, practiced_branches, completed_branches, mastered_branches,
+                   total_correct, total_attempts, last_practice_time
+            FROM progress_rollup
+        )
+    ''').fetchone()[0]
+    drifted += conn.execute(f'''
+        SELECT COUNT(*) FROM progress_rollup
+        WHERE pgn_game_id IN (SELECT id FROM pgn_games WHERE deleted_at IS NULL)
+        AND (user_id, pgn_game_id) NOT IN (SELECT user_id, pgn_game_id FROM ({progress_rollup_select_sql()}))
+    ''').fetchone()[0]
+    if drifted:
+        # 修正后的汇总会改变进度统计接口的返回内容
+        conn.execute("UPDATE resource_versions SET version = version + 1 WHERE scope = 'user'")
+    conn.execute('DELETE FROM progress_rollup')
+    conn.execute(f'''
+        INSERT INTO progress_rollup
+        (user_id, pgn_game_id, practiced_branches, completed_branches, mastered_branches,
+         total_correct, total_attempts, last_practice_time)
+        {progress_rollup_select_sql()}
+    ''')
+    return drifted
+
+def refresh_progress_rollup(conn, user_id: int, pgn_game_id: int):
+    """在当前写事务中按可见行重新计算单个(用户, PGN)的汇总（只扫描该用户该PGN的分支）"""
+    conn.execute('DELETE FROM progress_rollup WHERE user_id = ? AND pgn_game_id = ?', (user_id, pgn_game_id))
+    conn.execute(f'''
+        INSERT INTO progress_rollup
+        (user_id, pgn_game_id, practiced_branches, completed_branches, mastered_branches,
+         total_correct, total_attempts, last_practice_time)
+        {progress_rollup_select_sql('AND user_id = ? AND pgn_game_id = ?')}
+    ''', (user_id, pgn_game_id))
+
+# 数据库结构迁移：(版本号, 说明, 步骤列表)
+# 步骤可以是SQL语句或接收连接的函数；已发布的迁移不要修改，结构变更一律追加新版本
+SCHEMA_MIGRATIONS = [
+    (1, '初始表结构', [
         # 创建用户表
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
@@ -59,10 +601,9 @@ def init_database():
                 last_login DATETIME,
                 login_count INTEGER DEFAULT 0
             )
-        ''')
-        
+        ''',
         # 创建会话表
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS user_sessions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -71,10 +612,9 @@ def init_database():
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
-        ''')
-        
+        ''',
         # 创建用户进度表
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS user_progress (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -92,10 +632,9 @@ def init_database():
                 FOREIGN KEY (pgn_game_id) REFERENCES pgn_games (id),
                 UNIQUE(user_id, pgn_game_id, branch_id)
             )
-        ''')
-        
+        ''',
         # 创建用户学习记录表
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS user_study_logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -108,10 +647,9 @@ def init_database():
                 FOREIGN KEY (user_id) REFERENCES users (id),
                 FOREIGN KEY (pgn_game_id) REFERENCES pgn_games (id)
             )
-        ''')
-        
+        ''',
         # 创建PGN存储表
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS pgn_games (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 filename TEXT NOT NULL,
@@ -125,10 +663,9 @@ def init_database():
                 is_public BOOLEAN DEFAULT 0,
                 FOREIGN KEY (uploaded_by) REFERENCES users (id)
             )
-        ''')
-        
+        ''',
         # 创建PGN权限表
-        cursor.execute('''
+        '''
             CREATE TABLE IF NOT EXISTS pgn_permissions (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 pgn_id INTEGER NOT NULL,
@@ -140,7 +677,516 @@ def init_database():
                 FOREIGN KEY (granted_by) REFERENCES users (id),
                 UNIQUE(pgn_id, user_id)
             )
-        ''')
+        ''',
+    ]),
+    (2, '热点查询索引', [
+        # get_progress_stats按用户和时间范围统计学习记录（覆盖DATE(created_at)聚合）
+        'CREATE INDEX IF NOT EXISTS idx_study_logs_user_created ON user_study_logs (user_id, created_at)',
+        # delete_pgn / 重置进度按PGN（及用户）删除学习记录
+        'CREATE INDEX IF NOT EXISTS idx_study_logs_pgn_user ON user_study_logs (pgn_game_id, user_id, branch_id)',
+        # 管理员按PGN查看/删除所有用户进度
+        'CREATE INDEX IF NOT EXISTS idx_user_progress_pgn ON user_progress (pgn_game_id, user_id)',
+        # 普通用户的PGN列表和最新PGN通过权限表按用户查找
+        'CREATE INDEX IF NOT EXISTS idx_pgn_permissions_user ON pgn_permissions (user_id, pgn_id)',
+        # get_latest_pgn_api / PGN列表按上传时间倒序
+        'CREATE INDEX IF NOT EXISTS idx_pgn_games_upload_time ON pgn_games (upload_time)',
+        # parse_pgn的同名文件检查
+        'CREATE INDEX IF NOT EXISTS idx_pgn_games_filename ON pgn_games (filename)',
+    ]),
+    (3, '按(用户, PGN)汇总的进度表及其维护触发器', [
+        '''
+            CREATE TABLE IF NOT EXISTS progress_rollup (
+                user_id INTEGER NOT NULL,
+                pgn_game_id INTEGER NOT NULL,
+                practiced_branches INTEGER NOT NULL DEFAULT 0,
+                completed_branches INTEGER NOT NULL DEFAULT 0,
+                mastered_branches INTEGER NOT NULL DEFAULT 0,
+                total_correct INTEGER NOT NULL DEFAULT 0,
+                total_attempts INTEGER NOT NULL DEFAULT 0,
+                last_practice_time DATETIME,
+                PRIMARY KEY (user_id, pgn_game_id)
+            )
+        ''',
+        # 管理员按PGN查看所有用户进度 / PGN列表统计练习人数
+        'CREATE INDEX IF NOT EXISTS idx_progress_rollup_pgn ON progress_rollup (pgn_game_id, user_id)',
+        # 触发器在写user_progress的同一事务里更新汇总，UPSERT的DO UPDATE分支同样会触发UPDATE触发器
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_progress_rollup_insert
+            AFTER INSERT ON user_progress
+            BEGIN
+                INSERT INTO progress_rollup
+                (user_id, pgn_game_id, practiced_branches, completed_branches, mastered_branches,
+                 total_correct, total_attempts, last_practice_time)
+                VALUES (
+                    NEW.user_id, NEW.pgn_game_id, 1,
+                    COALESCE(NEW.is_completed = 1, 0),
+                    COALESCE(NEW.is_completed = 1 AND NEW.total_attempts > 0 AND NEW.correct_count = NEW.total_attempts, 0),
+                    COALESCE(NEW.correct_count, 0), COALESCE(NEW.total_attempts, 0), NEW.last_attempt_at
+                )
+                ON CONFLICT(user_id, pgn_game_id) DO UPDATE SET
+                    practiced_branches = practiced_branches + 1,
+                    completed_branches = completed_branches + excluded.completed_branches,
+                    mastered_branches = mastered_branches + excluded.mastered_branches,
+                    total_correct = total_correct + excluded.total_correct,
+                    total_attempts = total_attempts + excluded.total_attempts,
+                    last_practice_time = CASE
+                        WHEN last_practice_time IS NULL OR excluded.last_practice_time > last_practice_time
+                        THEN excluded.last_practice_time ELSE last_practice_time END;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_progress_rollup_update
+            AFTER UPDATE ON user_progress
+            BEGIN
+                UPDATE progress_rollup SET
+                    completed_branches = completed_branches
+                        + COALESCE(NEW.is_completed = 1, 0) - COALESCE(OLD.is_completed = 1, 0),
+                    mastered_branches = mastered_branches
+                        + COALESCE(NEW.is_completed = 1 AND NEW.total_attempts > 0 AND NEW.correct_count = NEW.total_attempts, 0)
+                        - COALESCE(OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts, 0),
+                    total_correct = total_correct + COALESCE(NEW.correct_count, 0) - COALESCE(OLD.correct_count, 0),
+                    total_attempts = total_attempts + COALESCE(NEW.total_attempts, 0) - COALESCE(OLD.total_attempts, 0),
+                    -- 练习时间只会往后走（热点路径），否则按该用户该PGN的分支重新取最大值
+                    last_practice_time = CASE
+                        WHEN NEW.last_attempt_at IS NOT NULL
+                             AND (last_practice_time IS NULL OR NEW.last_attempt_at >= last_practice_time)
+                        THEN NEW.last_attempt_at
+                        ELSE (SELECT MAX(last_attempt_at) FROM user_progress
+                              WHERE user_id = NEW.user_id AND pgn_game_id = NEW.pgn_game_id)
+                    END
+                WHERE user_id = NEW.user_id AND pgn_game_id = NEW.pgn_game_id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_progress_rollup_delete
+            AFTER DELETE ON user_progress
+            BEGIN
+                UPDATE progress_rollup SET
+                    practiced_branches = practiced_branches - 1,
+                    completed_branches = completed_branches - COALESCE(OLD.is_completed = 1, 0),
+                    mastered_branches = mastered_branches
+                        - COALESCE(OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts, 0),
+                    total_correct = total_correct - COALESCE(OLD.correct_count, 0),
+                    total_attempts = total_attempts - COALESCE(OLD.total_attempts, 0),
+                    last_practice_time = (SELECT MAX(last_attempt_at) FROM user_progress
+                                          WHERE user_id = OLD.user_id AND pgn_game_id = OLD.pgn_game_id)
+                WHERE user_id = OLD.user_id AND pgn_game_id = OLD.pgn_game_id;
+                DELETE FROM progress_rollup
+                WHERE user_id = OLD.user_id AND pgn_game_id = OLD.pgn_game_id AND practiced_branches <= 0;
+            END
+        ''',
+        # 回填已有进度
+        '''
+            INSERT INTO progress_rollup
+            (user_id, pgn_game_id, practiced_branches, completed_branches, mastered_branches,
+             total_correct, total_attempts, last_practice_time)
+            SELECT 
+                user_id,
+                pgn_game_id,
+                COUNT(*),
+                SUM(CASE WHEN is_completed = 1 THEN 1 ELSE 0 END),
+                SUM(CASE WHEN is_completed = 1 AND total_attempts > 0 AND correct_count = total_attempts THEN 1 ELSE 0 END),
+                SUM(COALESCE(correct_count, 0)),
+                SUM(COALESCE(total_attempts, 0)),
+                MAX(last_attempt_at)
+            FROM user_progress
+            GROUP BY user_id, pgn_game_id
+        ''',
+    ]),
+    (4, '记忆学习分支状态表', [
+        '''
+            CREATE TABLE IF NOT EXISTS user_branch_states (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                pgn_game_id INTEGER NOT NULL,
+                mode TEXT NOT NULL DEFAULT 'memory_learning',
+                branch_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (pgn_game_id) REFERENCES pgn_games (id),
+                UNIQUE(user_id, pgn_game_id, mode, branch_id)
+            )
+        ''',
+        # 删除PGN时按PGN清理所有用户的分支状态
+        'CREATE INDEX IF NOT EXISTS idx_branch_states_pgn ON user_branch_states (pgn_game_id, user_id)',
+    ]),
+    (5, '进度重置纪元', [
+        'ALTER TABLE user_progress ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE user_study_logs ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0',
+        '''
+            CREATE TABLE IF NOT EXISTS progress_epochs (
+                user_id INTEGER NOT NULL,
+                pgn_game_id INTEGER NOT NULL,
+                epoch INTEGER NOT NULL DEFAULT 0,
+                hard_epoch INTEGER NOT NULL DEFAULT 0,
+                swept_epoch INTEGER NOT NULL DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, pgn_game_id)
+            )
+        ''',
+        # 后台清理器只查找还有旧纪元数据未清理的(用户, PGN)
+        'CREATE INDEX IF NOT EXISTS idx_progress_epochs_unswept ON progress_epochs (user_id, pgn_game_id) WHERE swept_epoch < epoch',
+        # 删除PGN时清理所有用户的纪元记录
+        'CREATE INDEX IF NOT EXISTS idx_progress_epochs_pgn ON progress_epochs (pgn_game_id)',
+        # 汇总只统计可见行：旧纪元的行被UPSERT复用时按新插入处理，被清理器删除时不影响汇总
+        'DROP TRIGGER IF EXISTS trg_user_progress_rollup_update',
+        'DROP TRIGGER IF EXISTS trg_user_progress_rollup_delete',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_progress_rollup_update
+            AFTER UPDATE ON user_progress
+            WHEN NOT EXISTS (
+                SELECT 1 FROM progress_epochs e
+                WHERE e.user_id = OLD.user_id AND e.pgn_game_id = OLD.pgn_game_id
+                AND OLD.epoch <> e.epoch
+                AND (OLD.epoch < e.hard_epoch OR NOT (OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts))
+            )
+            BEGIN
+                UPDATE progress_rollup SET
+                    completed_branches = completed_branches
+                        + COALESCE(NEW.is_completed = 1, 0) - COALESCE(OLD.is_completed = 1, 0),
+                    mastered_branches = mastered_branches
+                        + COALESCE(NEW.is_completed = 1 AND NEW.total_attempts > 0 AND NEW.correct_count = NEW.total_attempts, 0)
+                        - COALESCE(OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts, 0),
+                    total_correct = total_correct + COALESCE(NEW.correct_count, 0) - COALESCE(OLD.correct_count, 0),
+                    total_attempts = total_attempts + COALESCE(NEW.total_attempts, 0) - COALESCE(OLD.total_attempts, 0),
+                    last_practice_time = CASE
+                        WHEN NEW.last_attempt_at IS NOT NULL
+                             AND (last_practice_time IS NULL OR NEW.last_attempt_at >= last_practice_time)
+                        THEN NEW.last_attempt_at
+                        ELSE (SELECT MAX(last_attempt_at) FROM user_progress
+                              WHERE user_id = NEW.user_id AND pgn_game_id = NEW.pgn_game_id)
+                    END
+                WHERE user_id = NEW.user_id AND pgn_game_id = NEW.pgn_game_id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_progress_rollup_revive
+            AFTER UPDATE ON user_progress
+            WHEN EXISTS (
+                SELECT 1 FROM progress_epochs e
+                WHERE e.user_id = OLD.user_id AND e.pgn_game_id = OLD.pgn_game_id
+                AND OLD.epoch <> e.epoch
+                AND (OLD.epoch < e.hard_epoch OR NOT (OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts))
+            )
+            BEGIN
+                INSERT INTO progress_rollup
+                (user_id, pgn_game_id, practiced_branches, completed_branches, mastered_branches,
+                 total_correct, total_attempts, last_practice_time)
+                VALUES (
+                    NEW.user_id, NEW.pgn_game_id, 1,
+                    COALESCE(NEW.is_completed = 1, 0),
+                    COALESCE(NEW.is_completed = 1 AND NEW.total_attempts > 0 AND NEW.correct_count = NEW.total_attempts, 0),
+                    COALESCE(NEW.correct_count, 0), COALESCE(NEW.total_attempts, 0), NEW.last_attempt_at
+                )
+                ON CONFLICT(user_id, pgn_game_id) DO UPDATE SET
+                    practiced_branches = practiced_branches + 1,
+                    completed_branches = completed_branches + excluded.completed_branches,
+                    mastered_branches = mastered_branches + excluded.mastered_branches,
+                    total_correct = total_correct + excluded.total_correct,
+                    total_attempts = total_attempts + excluded.total_attempts,
+                    last_practice_time = CASE
+                        WHEN last_practice_time IS NULL OR excluded.last_practice_time > last_practice_time
+                        THEN excluded.last_practice_time ELSE last_practice_time END;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_user_progress_rollup_delete
+            AFTER DELETE ON user_progress
+            WHEN NOT EXISTS (
+                SELECT 1 FROM progress_epochs e
+                WHERE e.user_id = OLD.user_id AND e.pgn_game_id = OLD.pgn_game_id
+                AND OLD.epoch <> e.epoch
+                AND (OLD.epoch < e.hard_epoch OR NOT (OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts))
+            )
+            BEGIN
+                UPDATE progress_rollup SET
+                    practiced_branches = practiced_branches - 1,
+                    completed_branches = completed_branches - COALESCE(OLD.is_completed = 1, 0),
+                    mastered_branches = mastered_branches
+                        - COALESCE(OLD.is_completed = 1 AND OLD.total_attempts > 0 AND OLD.correct_count = OLD.total_attempts, 0),
+                    total_correct = total_correct - COALESCE(OLD.correct_count, 0),
+                    total_attempts = total_attempts - COALESCE(OLD.total_attempts, 0),
+                    last_practice_time = (SELECT MAX(last_attempt_at) FROM user_progress
+                                          WHERE user_id = OLD.user_id AND pgn_game_id = OLD.pgn_game_id)
+                WHERE user_id = OLD.user_id AND pgn_game_id = OLD.pgn_game_id;
+                DELETE FROM progress_rollup
+                WHERE user_id = OLD.user_id AND pgn_game_id = OLD.pgn_game_id AND practiced_branches <= 0;
+            END
+        ''',
+    ]),
+    (6, '后台任务表', [
+        '''
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'pending',
+                processed INTEGER NOT NULL DEFAULT 0,
+                total INTEGER,
+                error TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                locked_by TEXT,
+                heartbeat_at DATETIME,
+                created_by INTEGER,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                started_at DATETIME,
+                finished_at DATETIME
+            )
+        ''',
+        # 任务线程按状态认领待执行或租约过期的任务，管理员按状态筛选任务列表
+        'CREATE INDEX IF NOT EXISTS idx_background_jobs_status ON background_jobs (status, id)',
+    ]),
+    (7, 'PGN软删除', [
+        # 删除PGN只写入删除时间，记录和相关数据由后台清理任务按速率限制回收
+        'ALTER TABLE pgn_games ADD COLUMN deleted_at DATETIME',
+        # 查找已删除但没有清理任务的PGN
+        'CREATE INDEX IF NOT EXISTS idx_pgn_games_deleted ON pgn_games (deleted_at) WHERE deleted_at IS NOT NULL',
+    ]),
+    (8, '每日学习活动汇总表', [
+        '''
+            CREATE TABLE IF NOT EXISTS daily_activity (
+                user_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                duration INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            )
+        ''',
+        # 插入由学习日志写入方按批累加；删除（旧纪元清理、PGN清理、删除用户）由触发器逐行扣减
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_study_logs_daily_activity_delete
+            AFTER DELETE ON user_study_logs
+            BEGIN
+                UPDATE daily_activity SET
+                    count = count - 1,
+                    correct = correct - COALESCE(OLD.result = 'correct', 0),
+                    duration = duration - COALESCE(OLD.duration_seconds, 0)
+                WHERE user_id = OLD.user_id AND day = DATE(OLD.created_at);
+                DELETE FROM daily_activity
+                WHERE user_id = OLD.user_id AND day = DATE(OLD.created_at) AND count <= 0;
+            END
+        ''',
+        # 回填已有日志（固定SQL，之后的结构变更不影响此迁移）
+        '''
+            INSERT OR REPLACE INTO daily_activity (user_id, day, count, correct, duration)
+            SELECT user_id, DATE(created_at), COUNT(*),
+                   SUM(CASE WHEN result = 'correct' THEN 1 ELSE 0 END),
+                   SUM(COALESCE(duration_seconds, 0))
+            FROM user_study_logs
+            GROUP BY user_id, DATE(created_at)
+        ''',
+    ]),
+    (9, '学习日志保留、压缩与归档', [
+        # 超过保留期的原始日志压缩为按(用户, PGN, 分支, 日期, 纪元)的汇总，原始行归档到磁盘后删除
+        '''
+            CREATE TABLE IF NOT EXISTS study_log_summaries (
+                user_id INTEGER NOT NULL,
+                pgn_game_id INTEGER NOT NULL,
+                branch_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                epoch INTEGER NOT NULL DEFAULT 0,
+                count INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                duration INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, pgn_game_id, branch_id, day, epoch)
+            )
+        ''',
+        # 删除PGN时按PGN清理汇总
+        'CREATE INDEX IF NOT EXISTS idx_study_log_summaries_pgn ON study_log_summaries (pgn_game_id)',
+        # 汇总被清理（旧纪元、已删除PGN）时同样从每日活动中扣减
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_study_log_summaries_daily_activity_delete
+            AFTER DELETE ON study_log_summaries
+            BEGIN
+                UPDATE daily_activity SET
+                    count = count - OLD.count,
+                    correct = correct - OLD.correct,
+                    duration = duration - OLD.duration
+                WHERE user_id = OLD.user_id AND day = OLD.day;
+                DELETE FROM daily_activity
+                WHERE user_id = OLD.user_id AND day = OLD.day AND count <= 0;
+            END
+        ''',
+        # 压缩任务按时间从旧到新取过期日志
+        'CREATE INDEX IF NOT EXISTS idx_study_logs_created ON user_study_logs (created_at)',
+        # 定期任务按类型查找最近一次执行
+        'CREATE INDEX IF NOT EXISTS idx_background_jobs_kind ON background_jobs (kind, id)',
+    ]),
+    (10, '学习日志事件段', [
+        # STUDY_LOG_FORMAT=events时学习日志按(用户, PGN, 纪元, UTC日期)追加到定长记录的事件段，
+        # count/correct/duration是段内记录的合计，供每日活动扣减和重建使用
+        '''
+            CREATE TABLE IF NOT EXISTS study_event_segments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                pgn_game_id INTEGER NOT NULL,
+                epoch INTEGER NOT NULL DEFAULT 0,
+                day TEXT NOT NULL,
+                base_time INTEGER NOT NULL,
+                last_time INTEGER NOT NULL,
+                branches TEXT NOT NULL,
+                events BLOB NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                correct INTEGER NOT NULL DEFAULT 0,
+                duration INTEGER NOT NULL DEFAULT 0,
+                swept_epoch INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (pgn_game_id) REFERENCES pgn_games (id)
+            )
+        ''',
+        # 追加时查找最新的未写满段、清理器按(用户, PGN)查找旧纪元的段
+        'CREATE INDEX IF NOT EXISTS idx_study_event_segments_user ON study_event_segments (user_id, pgn_game_id, epoch, day, id)',
+        'CREATE INDEX IF NOT EXISTS idx_study_event_segments_pgn ON study_event_segments (pgn_game_id)',
+        'CREATE INDEX IF NOT EXISTS idx_study_event_segments_day ON study_event_segments (day)',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_study_event_segments_daily_activity_delete
+            AFTER DELETE ON study_event_segments
+            BEGIN
+                UPDATE daily_activity SET
+                    count = count - OLD.count,
+                    correct = correct - OLD.correct,
+                    duration = duration - OLD.duration
+                WHERE user_id = OLD.user_id AND day = OLD.day;
+                DELETE FROM daily_activity
+                WHERE user_id = OLD.user_id AND day = OLD.day AND count <= 0;
+            END
+        ''',
+    ]),
+    (11, '资源版本号', [
+        # 条件GET的版本号：('user', 用户ID)随该用户的进度、重置、授权和角色变化递增，
+        # ('pgn', PGN ID)随该PGN的增删改递增，('catalog', 0)随任意PGN的增删改递增
+        '''
+            CREATE TABLE IF NOT EXISTS resource_versions (
+                scope TEXT NOT NULL,
+                key INTEGER NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (scope, key)
+            ) WITHOUT ROWID
+        ''',
+        *[f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{name}_version
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO resource_versions (scope, key, version) VALUES ('user', {row}.user_id, 1)
+                ON CONFLICT(scope, key) DO UPDATE SET version = version + 1;
+            END
+        ''' for name, event, table, row in (
+            ('user_progress_insert', 'INSERT', 'user_progress', 'NEW'),
+            ('user_progress_update', 'UPDATE', 'user_progress', 'NEW'),
+            ('progress_epochs_insert', 'INSERT', 'progress_epochs', 'NEW'),
+            ('progress_epochs_update', 'UPDATE OF epoch, hard_epoch', 'progress_epochs', 'NEW'),
+            ('pgn_permissions_insert', 'INSERT', 'pgn_permissions', 'NEW'),
+            ('pgn_permissions_delete', 'DELETE', 'pgn_permissions', 'OLD'),
+        )],
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_users_role_version
+            AFTER UPDATE OF role ON users
+            BEGIN
+                INSERT INTO resource_versions (scope, key, version) VALUES ('user', NEW.id, 1)
+                ON CONFLICT(scope, key) DO UPDATE SET version = version + 1;
+            END
+        ''',
+        *[f'''
+            CREATE TRIGGER IF NOT EXISTS trg_pgn_games_{event.lower()}_version
+            AFTER {event} ON pgn_games
+            BEGIN
+                INSERT INTO resource_versions (scope, key, version) VALUES ('pgn', {row}.id, 1)
+                ON CONFLICT(scope, key) DO UPDATE SET version = version + 1;
+                INSERT INTO resource_versions (scope, key, version) VALUES ('catalog', 0, 1)
+                ON CONFLICT(scope, key) DO UPDATE SET version = version + 1;
+            END
+        ''' for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD'))],
+    ]),
+    (12, '进度变更序号', [
+        # 每个(用户, PGN, 分支)只保留最近一次变更，每次变更把seq设为当前最大值加一（写事务串行，seq单调递增）；
+        # kind为progress的是进度行变更，reset（branch_id为空）表示该PGN被重置，
+        # deleted（user_id为0、branch_id为空）表示PGN被删除，对所有用户生效。
+        # 触发进度写入的语句本身是UPSERT，会覆盖触发器内INSERT OR REPLACE的冲突处理，所以这里也用UPSERT
+        '''
+            CREATE TABLE IF NOT EXISTS progress_changes (
+                seq INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                pgn_game_id INTEGER NOT NULL,
+                branch_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                UNIQUE (user_id, pgn_game_id, branch_id)
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_progress_changes_user_seq ON progress_changes (user_id, seq)',
+        *[f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{name}_change
+            AFTER {event} ON {table}
+            {when}
+            BEGIN
+                INSERT INTO progress_changes (seq, user_id, pgn_game_id, branch_id, kind)
+                VALUES ((SELECT COALESCE(MAX(seq), 0) + 1 FROM progress_changes), {values})
+                ON CONFLICT(user_id, pgn_game_id, branch_id) DO UPDATE SET seq = excluded.seq, kind = excluded.kind;
+            END
+        ''' for name, event, table, when, values in (
+            ('user_progress_insert', 'INSERT', 'user_progress', '',
+             "NEW.user_id, NEW.pgn_game_id, NEW.branch_id, 'progress'"),
+            ('user_progress_update', 'UPDATE', 'user_progress', '',
+             "NEW.user_id, NEW.pgn_game_id, NEW.branch_id, 'progress'"),
+            ('progress_epochs_insert', 'INSERT', 'progress_epochs', '',
+             "NEW.user_id, NEW.pgn_game_id, '', 'reset'"),
+            ('progress_epochs_update', 'UPDATE OF epoch', 'progress_epochs', '',
+             "NEW.user_id, NEW.pgn_game_id, '', 'reset'"),
+            ('pgn_games_deleted', 'UPDATE OF deleted_at', 'pgn_games',
+             'WHEN NEW.deleted_at IS NOT NULL AND OLD.deleted_at IS NULL',
+             "0, NEW.id, '', 'deleted'"),
+        )],
+        # 已有进度记为一次变更，客户端从游标0开始即可全量同步
+        '''
+            INSERT INTO progress_changes (seq, user_id, pgn_game_id, branch_id, kind)
+            SELECT ROW_NUMBER() OVER (ORDER BY updated_at, id), user_id, pgn_game_id, branch_id, 'progress'
+            FROM user_progress
+        ''',
+    ]),
+    (13, '修正对局数', [
+        # 之前只解析文件中的第一局，total_games一直写的是0；已有记录实际导入的都是一局
+        "UPDATE pgn_games SET total_games = 1 WHERE total_games = 0 AND parsed_data IS NOT NULL",
+    ]),
+]
+
+def get_schema_version(conn) -> int:
+    """当前数据库结构版本"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def run_migrations() -> List[int]:
+    """依次执行未应用的迁移，每个版本一个写事务，返回本次应用的版本号"""
+    applied = []
+    for version, description, steps in SCHEMA_MIGRATIONS:
+        with db_write() as conn:
+            # 多个worker同时启动时，拿到写锁后再确认一次版本
+            if get_schema_version(conn) >= version:
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                         (version, description))
+            applied.append(version)
+            print(f"✅ 数据库结构已升级到版本 {version}: {description}")
+    return applied
+
+def init_database():
+    """初始化数据库"""
+    run_migrations()
+    
+    with db_write() as conn:
+        cursor = conn.cursor()
         
         # 创建默认管理员用户
         cursor.execute('SELECT COUNT(*) FROM users WHERE role = "admin"')
@@ -153,9 +1199,23 @@ def init_database():
                 VALUES (?, ?, ?, ?, ?)
             ''', ('admin', admin_password, 'admin@chess.com', 'admin', 1))
             print("✅ 创建默认管理员账号: admin / admin123")
-        
-        conn.commit()
-        conn.close()
+
+@app.cli.command('rebuild-progress-rollup')
+def rebuild_progress_rollup_command():
+    """从user_progress重建progress_rollup汇总表，修复漂移（flask --app app rebuild-progress-rollup）"""
+    with db_write() as conn:
+        drifted = rebuild_progress_rollup(conn)
+        total = conn.execute('SELECT COUNT(*) FROM progress_rollup').fetchone()[0]
+    print(f"✅ 进度汇总表已重建: 共 {total} 行，修正 {drifted} 行")
+
+@app.cli.command('backfill-daily-activity')
+def backfill_daily_activity_command():
+    """从学习日志及其汇总回填daily_activity每日活动汇总表（flask --app app backfill-daily-activity）"""
+    study_log_writer.flush()
+    with db_write() as conn:
+        drifted = rebuild_daily_activity(conn)
+        total = conn.execute('SELECT COUNT(*) FROM daily_activity').fetchone()[0]
+    print(f"✅ 每日活动汇总表已回填: 共 {total} 行，修正 {drifted} 行")
 
 def require_login(f):
     """需要登录的装饰器"""
@@ -174,12 +1234,10 @@ def require_admin(f):
             return jsonify({'error': '需要登录', 'require_login': True}), 401
         
         user_id = session['user_id']
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT role FROM users WHERE id = ?', (user_id,))
             user = cursor.fetchone()
-            conn.close()
             
             if not user or user[0] != 'admin':
                 return jsonify({'error': '需要管理员权限', 'require_admin': True}), 403
@@ -193,15 +1251,13 @@ def get_current_user():
         return None
     
     user_id = session['user_id']
-    with db_lock:
-        conn = sqlite3.connect(DATABASE_PATH)
+    with db_read() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, username, email, role, is_active, created_at, last_login, login_count
             FROM users WHERE id = ?
         ''', (user_id,))
         user = cursor.fetchone()
-        conn.close()
         
         if user:
             return {
@@ -218,15 +1274,18 @@ def get_current_user():
 
 def check_pgn_permission(user_id: int, pgn_id: int) -> bool:
     """检查用户是否有访问特定PGN的权限"""
-    with db_lock:
-        conn = sqlite3.connect(DATABASE_PATH)
+    with db_read() as conn:
         cursor = conn.cursor()
         
+        # 已删除（等待清理）的PGN对所有人不可见
+        cursor.execute('SELECT 1 FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
+        if cursor.fetchone() is None:
+            return False
+        
         # 检查用户是否是管理员
         cursor.execute('SELECT role FROM users WHERE id = ?', (user_id,))
         user = cursor.fetchone()
         if user and user[0] == 'admin':
-            conn.close()
             return True
         
         # 检查是否有专门的权限授权
@@ -236,9 +1295,32 @@ def check_pgn_permission(user_id: int, pgn_id: int) -> bool:
         ''', (pgn_id, user_id))
         permission = cursor.fetchone()
         
-        conn.close()
         return permission is not None
 
+def get_resource_versions(*keys: tuple) -> List[int]:
+    """读取(scope, key)的资源版本号，没有记录的为0
+
+    要在读取数据之前调用：期间有写入时ETag只会比内容旧（客户端下次多拉取一次），不会比内容新。
+    """
+    with db_read() as conn:
+        versions = {(scope, key): version for scope, key, version in conn.execute(f'''
+            SELECT scope, key, version FROM resource_versions
+            WHERE {' OR '.join(['(scope = ? AND key = ?)'] * len(keys))}
+        ''', [value for key in keys for value in key])}
+    return [versions.get(key, 0) for key in keys]
+
+def not_modified(etag: str):
+    """请求的If-None-Match与etag匹配时返回304响应，否则返回None"""
+    if not request.if_none_match.contains(etag):
+        return None
+    return with_etag(app.response_class(status=304), etag)
+
+def with_etag(response, etag: str):
+    """给响应加上强ETag；响应因用户而异，只允许浏览器私有缓存并且每次使用前重新验证"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # 用户认证相关API
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -251,8 +1333,7 @@ def login():
         if not username or not password:
             return jsonify({'error': '用户名和密码不能为空'}), 400
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 查找用户
@@ -281,9 +1362,6 @@ def login():
                 SET last_login = CURRENT_TIMESTAMP, login_count = login_count + 1
                 WHERE id = ?
             ''', (user_id,))
-            
-            conn.commit()
-            conn.close()
         
         # 设置会话
         session['user_id'] = user_id
@@ -329,8 +1407,7 @@ def register():
         if len(password) < 6:
             return jsonify({'error': '密码至少6个字符'}), 400
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 检查用户名是否已存在
@@ -352,8 +1429,6 @@ def register():
             ''', (username, password_hash, email, 'user', 1))
             
             user_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
         
         return jsonify({
             'success': True,
@@ -379,8 +1454,7 @@ def get_user_info():
 def get_users():
     """获取用户列表"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -388,7 +1462,6 @@ def get_users():
                 FROM users ORDER BY created_at DESC
             ''')
             users = cursor.fetchall()
-            conn.close()
         
         user_list = []
         for user in users:
@@ -425,8 +1498,7 @@ def create_user():
         if role not in ['user', 'admin']:
             return jsonify({'error': '权限角色无效'}), 400
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 检查用户名是否已存在
@@ -442,8 +1514,6 @@ def create_user():
             ''', (username, password_hash, email, role, 1))
             
             user_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
         
         return jsonify({
             'success': True,
@@ -469,8 +1539,7 @@ def update_user(user_id):
         if role not in ['user', 'admin']:
             return jsonify({'error': '权限角色无效'}), 400
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 检查用户是否存在
@@ -510,9 +1579,9 @@ def update_user(user_id):
             
             sql = f"UPDATE users SET {', '.join(update_fields)} WHERE id = ?"
             cursor.execute(sql, update_values)
-            
-            conn.commit()
-            conn.close()
+        
+        # 角色可能变化（管理员可访问所有PGN），缓存的权限不再可靠
+        progress_cache.invalidate(user_id=user_id)
         
         return jsonify({'success': True, 'message': '用户更新成功'})
         
@@ -524,8 +1593,7 @@ def update_user(user_id):
 def delete_user(user_id):
     """删除用户"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 检查用户是否存在
@@ -537,9 +1605,8 @@ def delete_user(user_id):
             
             # 删除用户（会级联删除相关记录）
             cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
+        
+        progress_cache.invalidate(user_id=user_id)
         
         return jsonify({
             'success': True,
@@ -554,8 +1621,7 @@ def delete_user(user_id):
 def get_user_progress(user_id):
     """获取特定用户的学习进度（包括授权情况）"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 检查用户是否存在
@@ -575,22 +1641,21 @@ def get_user_progress(user_id):
                     pg.total_branches,
                     pg.upload_time,
                     CASE WHEN p.user_id IS NOT NULL THEN 1 ELSE 0 END as has_permission,
-                    COALESCE(COUNT(up.id), 0) as practiced_branches,
-                    COALESCE(SUM(CASE WHEN up.is_completed = 1 THEN 1 ELSE 0 END), 0) as completed_branches,
-                    COALESCE(SUM(CASE WHEN up.is_completed = 1 AND up.correct_count > 0 AND up.total_attempts > 0 AND (up.correct_count * 1.0 / up.total_attempts) = 1.0 THEN 1 ELSE 0 END), 0) as mastered_branches,
-                    COALESCE(SUM(up.correct_count), 0) as total_correct,
-                    COALESCE(SUM(up.total_attempts), 0) as total_attempts,
-                    MAX(up.last_attempt_at) as last_practice_time,
-                    CASE WHEN COUNT(up.id) > 0 THEN 1 ELSE 0 END as has_progress
+                    COALESCE(r.practiced_branches, 0) as practiced_branches,
+                    COALESCE(r.completed_branches, 0) as completed_branches,
+                    COALESCE(r.mastered_branches, 0) as mastered_branches,
+                    COALESCE(r.total_correct, 0) as total_correct,
+                    COALESCE(r.total_attempts, 0) as total_attempts,
+                    r.last_practice_time,
+                    CASE WHEN r.user_id IS NOT NULL THEN 1 ELSE 0 END as has_progress
                 FROM pgn_games pg
                 LEFT JOIN pgn_permissions p ON pg.id = p.pgn_id AND p.user_id = ?
-                LEFT JOIN user_progress up ON pg.id = up.pgn_game_id AND up.user_id = ?
-                GROUP BY pg.id, pg.filename, pg.total_branches, pg.upload_time, p.user_id
+                LEFT JOIN progress_rollup r ON r.user_id = ? AND r.pgn_game_id = pg.id
+                WHERE pg.deleted_at IS NULL
                 ORDER BY pg.upload_time DESC
             ''', (user_id, user_id))
             
             rows = cursor.fetchall()
-            conn.close()
         
         result = []
         for row in rows:
@@ -635,16 +1700,20 @@ def get_user_progress(user_id):
 @app.route('/api/progress/my', methods=['GET'])
 @require_login
 def get_my_progress():
-    """获取当前用户的学习进度"""
+    """获取当前用户的学习进度（支持If-None-Match条件请求）"""
     try:
         user_id = session['user_id']
+        user_version, catalog_version = get_resource_versions(('user', user_id), ('catalog', 0))
+        etag = f'my-{user_id}-{user_version}-{catalog_version}'
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 获取用户进度
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     up.pgn_game_id,
                     up.branch_id,
@@ -657,12 +1726,11 @@ def get_my_progress():
                     pg.filename
                 FROM user_progress up
                 JOIN pgn_games pg ON up.pgn_game_id = pg.id
-                WHERE up.user_id = ?
+                WHERE up.user_id = ? AND pg.deleted_at IS NULL AND {progress_visible_sql('up')}
                 ORDER BY up.updated_at DESC
             ''', (user_id,))
             
             progress_data = cursor.fetchall()
-            conn.close()
         
         progress_list = []
         for row in progress_data:
@@ -678,11 +1746,1441 @@ def get_my_progress():
                 'pgn_filename': row[8]
             })
         
-        return jsonify({'success': True, 'progress': progress_list})
+        return with_etag(jsonify({'success': True, 'progress': progress_list}), etag)
         
     except Exception as e:
         return jsonify({'error': f'获取进度失败: {str(e)}'}), 500
 
+# 单条语句完成进度的插入或累加：
+# - 正确数、尝试数在数据库里原子累加，两个标签页同时提交也不会丢失更新
+# - 掌握度 = 正确数 * 100 / 尝试数（取整）
+# - 已完成的分支保持完成；未完成的分支只有走到分支最后一步且本次正确才标记完成
+# 当前重置纪元（?1为用户ID，?2为PGN游戏ID）
+CURRENT_EPOCH_SQL = '(SELECT COALESCE(MAX(epoch), 0) FROM progress_epochs WHERE user_id = ?1 AND pgn_game_id = ?2)'
+
+# 已有行属于旧纪元（重置后不可见）时按新记录重新计数，否则累加
+PROGRESS_UPSERT_SQL = f'''
+    INSERT INTO user_progress 
+    (user_id, pgn_game_id, branch_id, is_completed, correct_count, 
+     total_attempts, last_attempt_at, mastery_level, notes, epoch)
+    VALUES (?1, ?2, ?3, ?4, ?5, 1, CURRENT_TIMESTAMP, ?6, ?7, {CURRENT_EPOCH_SQL})
+    ON CONFLICT(user_id, pgn_game_id, branch_id) DO UPDATE SET
+        correct_count = CASE WHEN {progress_visible_sql('user_progress')}
+            THEN correct_count + excluded.correct_count ELSE excluded.correct_count END,
+        total_attempts = CASE WHEN {progress_visible_sql('user_progress')}
+            THEN total_attempts + 1 ELSE 1 END,
+        mastery_level = CASE WHEN {progress_visible_sql('user_progress')}
+            THEN (correct_count + excluded.correct_count) * 100 / (total_attempts + 1) ELSE excluded.mastery_level END,
+        is_completed = CASE WHEN {progress_visible_sql('user_progress')}
+            THEN (is_completed OR excluded.is_completed) ELSE excluded.is_completed END,
+        epoch = excluded.epoch,
+        last_attempt_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP,
+        notes = excluded.notes
+'''
+
+STUDY_LOG_INSERT_SQL = f'''
+    INSERT INTO user_study_logs 
+    (user_id, pgn_game_id, branch_id, action, result, duration_seconds, created_at, epoch)
+    VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, {CURRENT_EPOCH_SQL})
+'''
+
+# 学习日志按(用户, UTC日期)累加到daily_activity，/api/progress/stats直接读取每日汇总
+DAILY_ACTIVITY_UPSERT_SQL = '''
+    INSERT INTO daily_activity (user_id, day, count, correct, duration)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, day) DO UPDATE SET
+        count = count + excluded.count,
+        correct = correct + excluded.correct,
+        duration = duration + excluded.duration
+'''
+
+# 从原始日志、事件段和已压缩的日志汇总重新聚合daily_activity（backfill-daily-activity命令使用）
+DAILY_ACTIVITY_SELECT_SQL = '''
+    SELECT user_id, day, SUM(count), SUM(correct), SUM(duration)
+    FROM (
+        SELECT user_id, DATE(created_at) AS day, 1 AS count,
+               CASE WHEN result = 'correct' THEN 1 ELSE 0 END AS correct,
+               COALESCE(duration_seconds, 0) AS duration
+        FROM user_study_logs
+        UNION ALL
+        SELECT user_id, day, count, correct, duration FROM study_log_summaries
+        UNION ALL
+        SELECT user_id, day, count, correct, duration FROM study_event_segments
+    )
+    GROUP BY user_id, day
+'''
+
+# 学习日志存储格式：rows每次练习写一行；events把练习追加到按(用户, PGN, 纪元, UTC日期)划分的事件段，
+# 段内是定长记录，分支ID在段内编号，时间存为与上一条记录的秒差
+STUDY_LOG_FORMAT = os.environ.get('STUDY_LOG_FORMAT', 'rows')
+STUDY_EVENT_SEGMENT_MAX_EVENTS = int(os.environ.get('STUDY_EVENT_SEGMENT_MAX_EVENTS', 512))  # 每段最多记录数，写满后开新段
+
+# 一条记录：秒差(int32)、段内分支编号(uint16)、动作和结果编码(uint8)、用时秒数(uint16)
+STUDY_EVENT_RECORD = struct.Struct('<iHBH')
+STUDY_EVENT_ACTIONS = ('practice',)
+STUDY_EVENT_RESULTS = ('incorrect', 'correct')
+STUDY_EVENT_MAX_DURATION = 0xFFFF
+
+STUDY_EVENT_SEGMENT_COLUMNS = 'id, user_id, pgn_game_id, epoch, day, base_time, branches, events'
+
+def _study_event_code(action: str, result: str, duration: Optional[int]) -> Optional[int]:
+    """动作和结果的编码；不在编码表中或用时超出范围的日志返回None，仍按行存储"""
+    if action not in STUDY_EVENT_ACTIONS or result not in STUDY_EVENT_RESULTS:
+        return None
+    if not 0 <= (duration or 0) <= STUDY_EVENT_MAX_DURATION:
+        return None
+    return STUDY_EVENT_ACTIONS.index(action) * len(STUDY_EVENT_RESULTS) + STUDY_EVENT_RESULTS.index(result)
+
+def _utc_seconds(created_at: str) -> int:
+    return calendar.timegm(time.strptime(created_at, '%Y-%m-%d %H:%M:%S'))
+
+def _utc_text(seconds: int) -> str:
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+def _unpack_study_events(base_time: int, branches: str, events: bytes) -> List[tuple]:
+    """把事件段解码为(分支ID, 编码, 用时, UTC秒)列表"""
+    branch_ids = json.loads(branches)
+    decoded = []
+    timestamp = base_time
+    for delta, branch, code, duration in STUDY_EVENT_RECORD.iter_unpack(events):
+        timestamp += delta
+        decoded.append((branch_ids[branch], code, duration, timestamp))
+    return decoded
+
+def _encode_study_events(decoded: List[tuple], branch_ids: List[str], previous: int) -> tuple:
+    """把(分支ID, 编码, 用时, UTC秒)列表编码为定长记录，接在时间为previous的记录之后
+
+    新出现的分支ID追加到branch_ids，返回(记录字节, 最后一条的时间, 正确数, 总用时)。
+    """
+    index = {branch_id: i for i, branch_id in enumerate(branch_ids)}
+    events = bytearray()
+    correct = duration_total = 0
+    for branch_id, code, duration, timestamp in decoded:
+        branch = index.get(branch_id)
+        if branch is None:
+            branch = index[branch_id] = len(branch_ids)
+            branch_ids.append(branch_id)
+        events += STUDY_EVENT_RECORD.pack(timestamp - previous, branch, code, duration)
+        previous = timestamp
+        correct += STUDY_EVENT_RESULTS[code % len(STUDY_EVENT_RESULTS)] == 'correct'
+        duration_total += duration
+    return bytes(events), previous, correct, duration_total
+
+def _pack_study_events(decoded: List[tuple]) -> dict:
+    """把(分支ID, 编码, 用时, UTC秒)列表编码为事件段的列值"""
+    branch_ids = []
+    events, last_time, correct, duration = _encode_study_events(decoded, branch_ids, decoded[0][3])
+    return {
+        'base_time': decoded[0][3],
+        'last_time': last_time,
+        'branches': json.dumps(branch_ids, ensure_ascii=False),
+        'events': events,
+        'count': len(decoded),
+        'correct': correct,
+        'duration': duration
+    }
+
+def append_study_events(conn, rows: List[tuple]) -> List[tuple]:
+    """在当前写事务中把学习日志（_study_log_params格式）追加到事件段，返回无法编码、仍需按行存储的日志
+
+    每个(用户, PGN, 日期)只读出最新未写满段的段头（最后时间、分支表、条数），新记录用events || ?
+    接在段尾并累加合计，不读取和重写已有记录；超出容量的部分开新段。
+    """
+    leftover = []
+    grouped = {}
+    for row in rows:
+        user_id, pgn_game_id, branch_id, action, result, duration, created_at = row
+        # 先转成整数再编码（与每日活动的累加一致），无法转换的日志在这里出错，不会到struct.pack
+        duration = int(duration or 0)
+        code = _study_event_code(action, result, duration)
+        if code is None:
+            leftover.append(row)
+            continue
+        grouped.setdefault((user_id, pgn_game_id, created_at[:10]), []).append(
+            (branch_id, code, duration, _utc_seconds(created_at)))
+    
+    for (user_id, pgn_game_id, day), decoded in grouped.items():
+        epoch = conn.execute(f'SELECT {CURRENT_EPOCH_SQL}', (user_id, pgn_game_id)).fetchone()[0]
+        key = (user_id, pgn_game_id, epoch, day)
+        segment = conn.execute('''
+            SELECT id, last_time, branches, count FROM study_event_segments
+            WHERE user_id = ? AND pgn_game_id = ? AND epoch = ? AND day = ? AND count < ?
+            ORDER BY id DESC LIMIT 1
+        ''', (*key, STUDY_EVENT_SEGMENT_MAX_EVENTS)).fetchone()
+        if segment is not None:
+            segment_id, last_time, branches, count = segment
+            appended = decoded[:STUDY_EVENT_SEGMENT_MAX_EVENTS - count]
+            decoded = decoded[len(appended):]
+            branch_ids = json.loads(branches)
+            known = len(branch_ids)
+            events, last_time, correct, duration = _encode_study_events(appended, branch_ids, last_time)
+            # ||按文本拼接，转回BLOB保持列类型
+            conn.execute('''
+                UPDATE study_event_segments SET
+                    events = CAST(events || ? AS BLOB),
+                    last_time = ?,
+                    branches = ?,
+                    count = count + ?,
+                    correct = correct + ?,
+                    duration = duration + ?
+                WHERE id = ?
+            ''', (events, last_time,
+                  branches if len(branch_ids) == known else json.dumps(branch_ids, ensure_ascii=False),
+                  len(appended), correct, duration, segment_id))
+        for start in range(0, len(decoded), STUDY_EVENT_SEGMENT_MAX_EVENTS):
+            values = _pack_study_events(decoded[start:start + STUDY_EVENT_SEGMENT_MAX_EVENTS])
+            conn.execute(f'''
+                INSERT INTO study_event_segments (user_id, pgn_game_id, epoch, day, {', '.join(values)})
+                VALUES (?, ?, ?, ?, {', '.join('?' * len(values))})
+            ''', (*key, *values.values()))
+    return leftover
+
+def decode_study_event_segment(segment: tuple) -> List[tuple]:
+    """把一行事件段（STUDY_EVENT_SEGMENT_COLUMNS）还原为按STUDY_LOG_ARCHIVE_FIELDS排列的日志，事件段中的日志没有id"""
+    _, user_id, pgn_game_id, epoch, _, base_time, branches, events = segment
+    return [
+        (None, user_id, pgn_game_id, branch_id,
+         STUDY_EVENT_ACTIONS[code // len(STUDY_EVENT_RESULTS)], STUDY_EVENT_RESULTS[code % len(STUDY_EVENT_RESULTS)],
+         duration, _utc_text(timestamp), epoch)
+        for branch_id, code, duration, timestamp in _unpack_study_events(base_time, branches, events)
+    ]
+
+def iter_study_logs(conn, user_id: Optional[int] = None, pgn_game_id: Optional[int] = None):
+    """逐条读取原始学习日志（与归档相同的字典格式），先读按行存储的日志，再解码事件段
+
+    不按重置纪元过滤，后台清理之前的旧纪元日志也会读到；已压缩为汇总的日志请从归档读取。
+    """
+    conditions, params = [], []
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if pgn_game_id is not None:
+        conditions.append('pgn_game_id = ?')
+        params.append(pgn_game_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    for row in conn.execute(f'''
+        SELECT {', '.join(STUDY_LOG_ARCHIVE_FIELDS)} FROM user_study_logs {where} ORDER BY id
+    ''', params).fetchall():
+        yield dict(zip(STUDY_LOG_ARCHIVE_FIELDS, row))
+    for segment in conn.execute(f'''
+        SELECT {STUDY_EVENT_SEGMENT_COLUMNS} FROM study_event_segments {where} ORDER BY id
+    ''', params).fetchall():
+        for row in decode_study_event_segment(segment):
+            yield dict(zip(STUDY_LOG_ARCHIVE_FIELDS, row))
+
+def sweep_study_event_segments(conn, user_id: int, pgn_game_id: int, limit: int) -> int:
+    """在当前写事务中清理一个(用户, PGN)旧纪元事件段中不可见的记录，返回处理的段数
+
+    可见性与study_log_visible_sql相同：早于最近彻底重置的段整段删除，其余旧纪元的段只保留
+    仍为已掌握分支的记录并重写，同时扣减每日活动；处理过的段记下清理到的纪元，不会重复处理。
+    """
+    epoch, hard_epoch = conn.execute('''
+        SELECT epoch, hard_epoch FROM progress_epochs WHERE user_id = ? AND pgn_game_id = ?
+    ''', (user_id, pgn_game_id)).fetchone()
+    segments = conn.execute('''
+        SELECT id, epoch, day, base_time, branches, events, count, correct, duration FROM study_event_segments
+        WHERE user_id = ? AND pgn_game_id = ? AND epoch <> ? AND swept_epoch < ?
+        LIMIT ?
+    ''', (user_id, pgn_game_id, epoch, epoch, limit)).fetchall()
+    if not segments:
+        return 0
+    
+    kept = {row[0] for row in conn.execute(f'''
+        SELECT branch_id FROM user_progress kept
+        WHERE user_id = ? AND pgn_game_id = ? AND epoch >= ? AND {progress_mastered_sql('kept')}
+    ''', (user_id, pgn_game_id, hard_epoch))}
+    for segment_id, segment_epoch, day, base_time, branches, events, count, correct, duration in segments:
+        decoded = []
+        if segment_epoch >= hard_epoch:
+            decoded = [event for event in _unpack_study_events(base_time, branches, events) if event[0] in kept]
+        if not decoded:
+            # 删除触发器扣减每日活动
+            conn.execute('DELETE FROM study_event_segments WHERE id = ?', (segment_id,))
+            continue
+        
+        values = _pack_study_events(decoded)
+        conn.execute(f'''
+            UPDATE study_event_segments SET {', '.join(f'{column} = ?' for column in values)}, swept_epoch = ?
+            WHERE id = ?
+        ''', (*values.values(), epoch, segment_id))
+        if values['count'] < count:
+            conn.execute(DAILY_ACTIVITY_UPSERT_SQL, (
+                user_id, day, values['count'] - count, values['correct'] - correct, values['duration'] - duration))
+            conn.execute('DELETE FROM daily_activity WHERE user_id = ? AND day = ? AND count <= 0', (user_id, day))
+    return len(segments)
+
+def insert_study_logs(conn, rows: List[tuple]):
+    """在当前写事务中插入学习日志（_study_log_params格式），同时按(用户, 日期)累加每日活动
+
+    STUDY_LOG_FORMAT为events时写入事件段，只有无法编码的日志按行插入。
+    """
+    stored = append_study_events(conn, rows) if STUDY_LOG_FORMAT == 'events' else rows
+    conn.executemany(STUDY_LOG_INSERT_SQL, stored)
+    activity = {}
+    for user_id, _, _, _, result, duration, created_at in rows:
+        count, correct, total_duration = activity.get((user_id, created_at[:10]), (0, 0, 0))
+        # 用时按整数累加（与INTEGER列的取值一致），无法转换的日志只让它自己写入失败
+        activity[(user_id, created_at[:10])] = (
+            count + 1, correct + (result == 'correct'), total_duration + int(duration or 0))
+    conn.executemany(DAILY_ACTIVITY_UPSERT_SQL, [
+        (user_id, day, count, correct, duration)
+        for (user_id, day), (count, correct, duration) in activity.items()
+    ])
+
+def rebuild_daily_activity(conn) -> int:
+    """在当前写事务中按学习日志及其汇总重建daily_activity，返回修正前不一致的行数"""
+    drifted = conn.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT * FROM ({DAILY_ACTIVITY_SELECT_SQL})
+            EXCEPT
+            SELECT user_id, day, count, correct, duration FROM daily_activity
+        )
+    ''').fetchone()[0]
+    drifted += conn.execute(f'''
+        SELECT COUNT(*) FROM daily_activity
+        WHERE (user_id, day) NOT IN (SELECT user_id, day FROM ({DAILY_ACTIVITY_SELECT_SQL}))
+    ''').fetchone()[0]
+    conn.execute('DELETE FROM daily_activity')
+    conn.execute(f'INSERT INTO daily_activity (user_id, day, count, correct, duration) {DAILY_ACTIVITY_SELECT_SQL}')
+    return drifted
+
+PROGRESS_BATCH_MAX_SIZE = 500  # 单次批量提交的最大走子数
+
+# 学习日志后写缓冲配置
+STUDY_LOG_WRITE_BEHIND = os.environ.get('STUDY_LOG_WRITE_BEHIND', '1') == '1'  # 关闭后日志与进度同事务写入
+STUDY_LOG_FLUSH_SIZE = int(os.environ.get('STUDY_LOG_FLUSH_SIZE', 200))  # 攒够多少条立即写入
+STUDY_LOG_FLUSH_INTERVAL = float(os.environ.get('STUDY_LOG_FLUSH_INTERVAL', 1.0))  # 最长多少秒写入一次
+STUDY_LOG_BUFFER_CAPACITY = int(os.environ.get('STUDY_LOG_BUFFER_CAPACITY', 10000))  # 缓冲区上限
+STUDY_LOG_BACKPRESSURE_TIMEOUT = float(os.environ.get('STUDY_LOG_BACKPRESSURE_TIMEOUT', 0.05))  # 缓冲区满时最多等待秒数
+STUDY_LOG_FLUSH_MAX_RETRIES = int(os.environ.get('STUDY_LOG_FLUSH_MAX_RETRIES', 3))  # 写事务连续失败多少次后丢弃这批日志
+
+class StudyLogWriter:
+    """学习日志后写缓冲
+
+    走子请求只负责进度写入，学习日志在进度提交后放入进程内有界缓冲区，由后台线程按数量或时间阈值批量写入。
+    缓冲区满时走子请求在开始写事务前短暂等待后台线程腾出空间（背压），提交后仍然放不下则丢弃并计数；
+    整批写入出错时在同一事务中逐条重试，单独写入仍出错的日志丢弃并计数，不影响同批其他日志；
+    写事务本身失败（如数据库繁忙）时放回缓冲区重试，连续失败flush_max_retries次后丢弃；
+    进程退出时写完剩余日志。
+    """
+
+    def __init__(self, enabled: bool = STUDY_LOG_WRITE_BEHIND, flush_size: int = STUDY_LOG_FLUSH_SIZE,
+                 flush_interval: float = STUDY_LOG_FLUSH_INTERVAL, capacity: int = STUDY_LOG_BUFFER_CAPACITY,
+                 backpressure_timeout: float = STUDY_LOG_BACKPRESSURE_TIMEOUT,
+                 flush_max_retries: int = STUDY_LOG_FLUSH_MAX_RETRIES):
+        self.enabled = enabled
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.backpressure_timeout = backpressure_timeout
+        self.flush_max_retries = flush_max_retries
+        self._failed_flushes = 0  # 写事务连续失败次数
+        self._buffer = []
+        self._room_waiters = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self.stats = {
+            'enqueued': 0,
+            'written': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'backpressure_waits': 0,
+            'dropped': 0,
+            'rejected': 0
+        }
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """子进程不继承父进程缓冲区和后台线程"""
+        self._buffer = []
+        self._room_waiters = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='study-log-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, conn, rows: List[tuple]):
+        """记录学习日志：后写模式下在当前事务提交后放入缓冲区，否则在当前事务中直接插入
+
+        提交后入队在写锁内完成，重置纪元不会插在提交和入队之间；事务回滚时日志不入队。
+        """
+        if not self.enabled:
+            insert_study_logs(conn, rows)
+            return
+        after_commit(lambda: self.enqueue(rows))
+
+    def wait_for_room(self, count: int) -> bool:
+        """背压：写事务开始前等待缓冲区能放下count条日志，最多等backpressure_timeout秒，返回是否有空间
+
+        不能在持有写锁时调用，否则后台线程无法写入腾出空间。
+        """
+        if not self.enabled:
+            return True
+        with self._cond:
+            self._ensure_started()
+            if len(self._buffer) + count <= self.capacity:
+                return True
+            self.stats['backpressure_waits'] += 1
+            self._room_waiters += 1
+            self._cond.notify_all()
+            try:
+                deadline = time.monotonic() + self.backpressure_timeout
+                while len(self._buffer) + count > self.capacity:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._room_waiters -= 1
+        return True
+
+    def enqueue(self, rows: List[tuple]) -> bool:
+        """放入缓冲区，不等待；缓冲区满时丢弃并计数，返回是否成功入队"""
+        with self._cond:
+            self._ensure_started()
+            if len(self._buffer) + len(rows) > self.capacity:
+                self.stats['dropped'] += len(rows)
+                return False
+            self._buffer.extend(rows)
+            self.stats['enqueued'] += len(rows)
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify_all()
+        return True
+
+    def flush_matching(self, conn, predicate) -> int:
+        """把满足条件的待写日志在当前事务中立即写入（删除日志前调用，保证DELETE也作用于它们）"""
+        with self._cond:
+            matched = [row for row in self._buffer if predicate(row)]
+            if not matched:
+                return 0
+            self._buffer = [row for row in self._buffer if not predicate(row)]
+            self._cond.notify_all()
+        rejected = self._insert(conn, matched)
+        self.stats['rejected'] += rejected
+        self.stats['written'] += len(matched) - rejected
+        return len(matched) - rejected
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._buffer)
+
+    def flush(self) -> int:
+        """把缓冲区中的日志一次性写入数据库，返回写入条数"""
+        with self._flush_lock:
+            if not self.pending():
+                return 0
+            rows = []
+            try:
+                with db_write() as conn:
+                    # 持有写锁后再取出日志，重置/删除时flush_matching不会漏掉正在写入的日志
+                    with self._cond:
+                        rows, self._buffer = self._buffer, []
+                        self._cond.notify_all()
+                    rejected = self._insert(conn, rows)
+            except Exception as e:
+                # 写事务失败时放回缓冲区等待下次重试，放不下的部分或连续失败过多时计入丢弃
+                self._failed_flushes += 1
+                with self._cond:
+                    room = max(self.capacity - len(self._buffer), 0)
+                    if self._failed_flushes >= self.flush_max_retries:
+                        # 没拿到写锁时日志还在缓冲区里，一并丢弃
+                        if not rows:
+                            rows, self._buffer = self._buffer, []
+                        room = 0
+                        self._failed_flushes = 0
+                    self._buffer[:0] = rows[:room]
+                    self.stats['dropped'] += max(len(rows) - room, 0)
+                    self.stats['flush_errors'] += 1
+                print(f"写入学习日志失败: {str(e)}")
+                return 0
+            self._failed_flushes = 0
+            self.stats['rejected'] += rejected
+            self.stats['written'] += len(rows) - rejected
+            self.stats['flushes'] += 1
+            return len(rows) - rejected
+
+    def _insert(self, conn, rows: List[tuple]) -> int:
+        """在当前写事务中写入日志，整批出错时逐条重试，返回单独写入仍出错而丢弃的条数"""
+        conn.execute('SAVEPOINT study_log_batch')
+        try:
+            insert_study_logs(conn, rows)
+            conn.execute('RELEASE study_log_batch')
+            return 0
+        except Exception as e:
+            conn.execute('ROLLBACK TO study_log_batch')
+            conn.execute('RELEASE study_log_batch')
+            self.stats['flush_errors'] += 1
+            print(f"批量写入学习日志失败，逐条重试: {str(e)}")
+        
+        rejected = 0
+        for row in rows:
+            conn.execute('SAVEPOINT study_log_row')
+            try:
+                insert_study_logs(conn, [row])
+            except Exception as e:
+                conn.execute('ROLLBACK TO study_log_row')
+                rejected += 1
+                print(f"丢弃无法写入的学习日志 {row}: {str(e)}")
+            conn.execute('RELEASE study_log_row')
+        return rejected
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # 有请求在等待空间时不再等攒够一批，避免后台线程启动前错过唤醒
+                if not self._stopping and not self._room_waiters and len(self._buffer) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def close(self):
+        """停止后台线程并写完剩余日志"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            thread.join(timeout=5)
+        self.flush()
+
+study_log_writer = StudyLogWriter()
+atexit.register(study_log_writer.close)
+
+def _progress_upsert_params(user_id: int, pgn_game_id: int, branch_id: str,
+                            is_correct: bool, is_branch_end: bool, notes: str = '') -> tuple:
+    correct = 1 if is_correct else 0
+    return (user_id, pgn_game_id, branch_id,
+            1 if (is_branch_end and is_correct) else 0,
+            correct, correct * 100, notes)
+
+def _study_log_params(user_id: int, pgn_game_id: int, branch_id: str,
+                      is_correct: bool, duration: int = 0) -> tuple:
+    # 入队时就确定时间，后写不会推迟created_at（与CURRENT_TIMESTAMP一样使用UTC）
+    return (user_id, pgn_game_id, branch_id, 'practice',
+            'correct' if is_correct else 'incorrect', duration,
+            datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'))
+
+def _valid_duration(duration) -> bool:
+    """学习用时必须是非负整数（JSON的true/false不算）"""
+    return isinstance(duration, int) and not isinstance(duration, bool) and duration >= 0
+
+def _user_resource_version(conn, user_id: int) -> int:
+    row = conn.execute("SELECT version FROM resource_versions WHERE scope = 'user' AND key = ?",
+                       (user_id,)).fetchone()
+    return row[0] if row else 0
+
+def record_progress_attempt(conn, user_id: int, pgn_game_id: int, branch_id: str,
+                            is_correct: bool, is_branch_end: bool, duration: int = 0, notes: str = '') -> tuple:
+    """在当前写事务中记录一次练习：累加分支进度，学习日志交给study_log_writer
+
+    返回写入前后该用户的资源版本号，供progress_cache判断缓存条目是否仍是最新。
+    """
+    before = _user_resource_version(conn, user_id)
+    conn.execute(PROGRESS_UPSERT_SQL, _progress_upsert_params(
+        user_id, pgn_game_id, branch_id, is_correct, is_branch_end, notes))
+    study_log_writer.write(conn, [_study_log_params(
+        user_id, pgn_game_id, branch_id, is_correct, duration)])
+    return before, _user_resource_version(conn, user_id)
+
+def record_progress_attempts(conn, user_id: int, attempts: List[Dict[str, Any]]) -> tuple:
+    """在当前写事务中按顺序批量记录练习（executemany，语义与逐条调用相同），返回值同record_progress_attempt"""
+    before = _user_resource_version(conn, user_id)
+    conn.executemany(PROGRESS_UPSERT_SQL, [
+        _progress_upsert_params(user_id, a['pgn_game_id'], a['branch_id'], a['is_correct'],
+                                a['is_branch_end'], a['notes'])
+        for a in attempts
+    ])
+    study_log_writer.write(conn, [
+        _study_log_params(user_id, a['pgn_game_id'], a['branch_id'], a['is_correct'], a['duration'])
+        for a in attempts
+    ])
+    return before, _user_resource_version(conn, user_id)
+
+def flush_pending_study_logs(conn, pgn_game_id: int, user_id: Optional[int] = None):
+    """删除学习日志前先写入缓冲区中对应的待写日志，避免重置或删除后又被后台线程写回"""
+    pgn_game_id = int(pgn_game_id)
+    study_log_writer.flush_matching(
+        conn, lambda row: row[1] == pgn_game_id and (user_id is None or row[0] == user_id))
+
+# 旧纪元数据后台清理配置
+PROGRESS_SWEEP_INTERVAL = float(os.environ.get('PROGRESS_SWEEP_INTERVAL', 30))  # 没有重置时多久检查一次（秒）
+PROGRESS_SWEEP_CHUNK_SIZE = int(os.environ.get('PROGRESS_SWEEP_CHUNK_SIZE', 500))  # 每个清理事务最多删除的行数
+PROGRESS_SWEEP_PAUSE = float(os.environ.get('PROGRESS_SWEEP_PAUSE', 0.01))  # 两个清理事务之间让出写锁的秒数
+
+def reset_progress_epoch(conn, user_id: int, pgn_game_id: int, keep_mastered: bool) -> int:
+    """在当前写事务中重置(用户, PGN)的进度，只写纪元和汇总两行，返回被重置的分支数
+
+    keep_mastered为True时是普通重置（保留已掌握分支），否则为彻底重置。
+    旧纪元的进度和学习日志不再可见，由progress_sweeper在后台分批删除。
+    """
+    pgn_game_id = int(pgn_game_id)
+    # 缓冲区中的日志先以旧纪元写入，之后随旧纪元一起失效
+    flush_pending_study_logs(conn, pgn_game_id, user_id)
+    rollup = conn.execute('''
+        SELECT practiced_branches, mastered_branches FROM progress_rollup
+        WHERE user_id = ? AND pgn_game_id = ?
+    ''', (user_id, pgn_game_id)).fetchone()
+    practiced, mastered = rollup or (0, 0)
+    
+    conn.execute('''
+        INSERT INTO progress_epochs (user_id, pgn_game_id, epoch, hard_epoch)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT(user_id, pgn_game_id) DO UPDATE SET
+            epoch = epoch + 1,
+            hard_epoch = CASE WHEN excluded.hard_epoch > 0 THEN epoch + 1 ELSE hard_epoch END,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (user_id, pgn_game_id, 0 if keep_mastered else 1))
+    
+    if keep_mastered and mastered:
+        refresh_progress_rollup(conn, user_id, pgn_game_id)
+    else:
+        conn.execute('DELETE FROM progress_rollup WHERE user_id = ? AND pgn_game_id = ?', (user_id, pgn_game_id))
+    return practiced - mastered if keep_mastered else practiced
+
+class StaleProgressSweeper:
+    """旧纪元数据清理器
+
+    后台线程逐个处理还有旧纪元数据的(用户, PGN)，每个写事务最多删除chunk_size行进度或学习日志，
+    事务之间让出写锁，避免长时间阻塞学生的进度写入。
+    """
+
+    def __init__(self, interval: float = PROGRESS_SWEEP_INTERVAL, chunk_size: int = PROGRESS_SWEEP_CHUNK_SIZE,
+                 pause: float = PROGRESS_SWEEP_PAUSE):
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._thread = None
+        self._pid = None
+        self._wakeup = threading.Event()
+        self.stats = {
+            'chunks': 0,
+            'progress_deleted': 0,
+            'logs_deleted': 0,
+            'summaries_deleted': 0,
+            'segments_swept': 0,
+            'pairs_swept': 0,
+            'errors': 0
+        }
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._thread = None
+        self._pid = None
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        """有新的重置时唤醒后台线程（首次调用时启动）"""
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='progress-sweeper', daemon=True)
+            self._thread.start()
+        self._wakeup.set()
+
+    def sweep_chunk(self) -> bool:
+        """执行一个清理事务，返回是否还有待清理的数据"""
+        with db_write() as conn:
+            pair = conn.execute('''
+                SELECT user_id, pgn_game_id, epoch FROM progress_epochs
+                WHERE swept_epoch < epoch
+                LIMIT 1
+            ''').fetchone()
+            if pair is None:
+                return False
+            user_id, pgn_game_id, epoch = pair
+            
+            progress_deleted = conn.execute(f'''
+                DELETE FROM user_progress WHERE id IN (
+                    SELECT up.id FROM user_progress up
+                    WHERE up.user_id = ? AND up.pgn_game_id = ? AND NOT {progress_visible_sql('up')}
+                    LIMIT ?
+                )
+            ''', (user_id, pgn_game_id, self.chunk_size)).rowcount
+            
+            logs_deleted = 0
+            if progress_deleted < self.chunk_size:
+                logs_deleted = conn.execute(f'''
+                    DELETE FROM user_study_logs WHERE id IN (
+                        SELECT l.id FROM user_study_logs l
+                        WHERE l.pgn_game_id = ? AND l.user_id = ? AND NOT {study_log_visible_sql('l')}
+                        LIMIT ?
+                    )
+                ''', (pgn_game_id, user_id, self.chunk_size - progress_deleted)).rowcount
+            
+            summaries_deleted = 0
+            if progress_deleted + logs_deleted < self.chunk_size:
+                # 已压缩的日志汇总与原始日志使用同样的可见性规则
+                summaries_deleted = conn.execute(f'''
+                    DELETE FROM study_log_summaries WHERE rowid IN (
+                        SELECT l.rowid FROM study_log_summaries l
+                        WHERE l.user_id = ? AND l.pgn_game_id = ? AND NOT {study_log_visible_sql('l')}
+                        LIMIT ?
+                    )
+                ''', (user_id, pgn_game_id, self.chunk_size - progress_deleted - logs_deleted)).rowcount
+            
+            segments_swept = 0
+            if progress_deleted + logs_deleted + summaries_deleted < self.chunk_size:
+                segments_swept = sweep_study_event_segments(
+                    conn, user_id, pgn_game_id, self.chunk_size - progress_deleted - logs_deleted - summaries_deleted)
+            
+            if progress_deleted + logs_deleted + summaries_deleted + segments_swept < self.chunk_size:
+                conn.execute('''
+                    UPDATE progress_epochs SET swept_epoch = ?
+                    WHERE user_id = ? AND pgn_game_id = ?
+                ''', (epoch, user_id, pgn_game_id))
+                self.stats['pairs_swept'] += 1
+        
+        self.stats['chunks'] += 1
+        self.stats['progress_deleted'] += progress_deleted
+        self.stats['logs_deleted'] += logs_deleted
+        self.stats['summaries_deleted'] += summaries_deleted
+        self.stats['segments_swept'] += segments_swept
+        return True
+
+    def sweep_all(self) -> int:
+        """同步清理全部旧纪元数据，返回执行的事务数"""
+        chunks = 0
+        while self.sweep_chunk():
+            chunks += 1
+        return chunks
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                while self.sweep_chunk():
+                    time.sleep(self.pause)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"清理旧纪元进度失败: {str(e)}")
+
+progress_sweeper = StaleProgressSweeper()
+
+# 后台任务配置
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))  # 每个进程执行后台任务的线程数
+JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', 500))  # 每个任务事务最多处理的行数
+JOB_CHUNK_PAUSE = float(os.environ.get('JOB_CHUNK_PAUSE', 0.01))  # 两个任务事务之间让出写锁的秒数
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 60))  # 运行中的任务超过多少秒没有心跳视为所在进程已退出
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 5))  # 空闲时多久检查一次待执行任务（秒）
+JOB_PERIODIC_CHECK_INTERVAL = float(os.environ.get('JOB_PERIODIC_CHECK_INTERVAL', 60))  # 多久检查一次定期任务是否到期（秒）
+
+JOB_STATUSES = ('pending', 'running', 'completed', 'failed', 'cancelled')
+
+# 任务类型 -> {'step': 执行一个分块的函数, 'count': 统计总量的函数, 'rows_per_second': 速率上限}
+# 分块函数在写事务中处理至多chunk_size行并返回处理行数，返回0表示任务完成。
+# 分块和任务进度在同一事务中提交，进程退出后从最后提交的分块继续，所以分块必须可以重复执行
+JOB_HANDLERS = {}
+
+# 定期创建任务的函数，任务线程空闲时最多每JOB_PERIODIC_CHECK_INTERVAL秒调用一次，返回创建的任务ID或None
+PERIODIC_JOB_SCHEDULERS = []
+
+def job_handler(kind: str, count=None, rows_per_second: float = 0):
+    """注册后台任务类型
+
+    count(conn, params)在任务开始时统计待处理总行数（可选）；
+    rows_per_second大于0时按处理行数在分块之间等待，限制该类任务占用写锁的比例。
+    """
+    def decorator(step):
+        JOB_HANDLERS[kind] = {'step': step, 'count': count, 'rows_per_second': rows_per_second}
+        return step
+    return decorator
+
+def enqueue_job(conn, kind: str, params: dict, created_by: Optional[int] = None) -> int:
+    """在当前写事务中创建后台任务并返回任务ID，任务随事务一起提交；提交后调用job_runner.wake()"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'未知的任务类型: {kind}')
+    cursor = conn.execute('''
+        INSERT INTO background_jobs (kind, params, created_by) VALUES (?, ?, ?)
+    ''', (kind, json.dumps(params), created_by))
+    return cursor.lastrowid
+
+JOB_COLUMNS = '''id, kind, params, status, processed, total, error, cancel_requested, attempts,
+                 created_by, created_at, started_at, finished_at'''
+
+def job_to_dict(row) -> Dict[str, Any]:
+    """把background_jobs的一行（按JOB_COLUMNS顺序）转换为API返回格式"""
+    (job_id, kind, params, status, processed, total, error, cancel_requested, attempts,
+     created_by, created_at, started_at, finished_at) = row
+    if status == 'completed':
+        percent = 100.0
+    elif total:
+        percent = round(min(processed / total * 100, 100), 1)
+    else:
+        percent = 0.0
+    return {
+        'id': job_id,
+        'kind': kind,
+        'params': json.loads(params),
+        'status': status,
+        'processed': processed,
+        'total': total,
+        'percent': percent,
+        'error': error,
+        'cancel_requested': bool(cancel_requested),
+        'attempts': attempts,
+        'created_by': created_by,
+        'created_at': created_at,
+        'started_at': started_at,
+        'finished_at': finished_at
+    }
+
+def cancel_job(conn, job_id: int) -> Optional[str]:
+    """在当前写事务中取消任务：未开始的直接取消，运行中的在下一个分块前停止；返回取消后的状态"""
+    conn.execute('''
+        UPDATE background_jobs SET status = 'cancelled', cancel_requested = 1, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'pending'
+    ''', (job_id,))
+    conn.execute('''
+        UPDATE background_jobs SET cancel_requested = 1
+        WHERE id = ? AND status = 'running'
+    ''', (job_id,))
+    row = conn.execute('SELECT status FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+    return row[0] if row else None
+
+class JobRunner:
+    """后台任务执行器
+
+    每个进程一组任务线程，从background_jobs认领待执行的任务，按分块写事务执行，事务之间让出写锁。
+    运行中的任务每个分块更新一次心跳；进程退出或崩溃后，心跳超过租约的任务会被任意进程重新认领继续执行。
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, chunk_size: int = JOB_CHUNK_SIZE, pause: float = JOB_CHUNK_PAUSE,
+                 lease_seconds: int = JOB_LEASE_SECONDS, poll_interval: float = JOB_POLL_INTERVAL):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._next_periodic = 0.0
+        self._threads = []
+        self._pid = None
+        self._owner = f'{os.getpid()}-{secrets.token_hex(4)}'
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self.stats = {
+            'claimed': 0,
+            'chunks': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'released': 0,
+            'errors': 0
+        }
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self._threads = []
+        self._pid = None
+        self._owner = f'{os.getpid()}-{secrets.token_hex(4)}'
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+
+    def start(self):
+        """启动本进程的任务线程（已启动时直接返回）"""
+        if self._threads and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def wake(self):
+        """有新任务时唤醒任务线程"""
+        self.start()
+        self._wakeup.set()
+
+    def claim(self) -> Optional[int]:
+        """认领一个待执行或租约已过期的任务，返回任务ID"""
+        with db_write() as conn:
+            row = conn.execute('''
+                SELECT id FROM background_jobs
+                WHERE status IN ('pending', 'running')
+                AND (status = 'pending' OR heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))
+                ORDER BY id
+                LIMIT 1
+            ''', (f'-{self.lease_seconds} seconds',)).fetchone()
+            if row is None:
+                return None
+            conn.execute('''
+                UPDATE background_jobs SET
+                    status = 'running',
+                    locked_by = ?,
+                    heartbeat_at = CURRENT_TIMESTAMP,
+                    started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+                    attempts = attempts + 1
+                WHERE id = ?
+            ''', (self._owner, row[0]))
+        self.stats['claimed'] += 1
+        return row[0]
+
+    def _finish(self, conn, job_id: int, status: str, error: Optional[str] = None):
+        conn.execute('''
+            UPDATE background_jobs SET status = ?, error = ?, locked_by = NULL, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND locked_by = ?
+        ''', (status, error, job_id, self._owner))
+        self.stats[status] += 1
+
+    def run_chunk(self, job_id: int) -> Optional[float]:
+        """执行任务的一个分块，任务还要继续时返回下一个分块前应等待的秒数，否则返回None
+
+        等待时间随返回值交给调用线程，多个任务线程之间不共享。
+        """
+        with db_write() as conn:
+            job = conn.execute('''
+                SELECT kind, params, total, cancel_requested, locked_by FROM background_jobs WHERE id = ?
+            ''', (job_id,)).fetchone()
+            if job is None or job[4] != self._owner:
+                # 租约过期后已被其他进程接管
+                return None
+            kind, params, total, cancel_requested, _ = job
+            if cancel_requested:
+                self._finish(conn, job_id, 'cancelled')
+                return None
+            if kind not in JOB_HANDLERS:
+                self._finish(conn, job_id, 'failed', f'未知的任务类型: {kind}')
+                return None
+            
+            handler = JOB_HANDLERS[kind]
+            params = json.loads(params)
+            if total is None and handler['count'] is not None:
+                conn.execute('UPDATE background_jobs SET total = ? WHERE id = ?',
+                             (handler['count'](conn, params), job_id))
+            processed = handler['step'](conn, params, self.chunk_size)
+            if not processed:
+                self._finish(conn, job_id, 'completed')
+                return None
+            conn.execute('''
+                UPDATE background_jobs SET processed = processed + ?, heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (processed, job_id))
+        self.stats['chunks'] += 1
+        
+        rate = handler['rows_per_second']
+        return max(self.pause, processed / rate if rate > 0 else 0)
+
+    def run_job(self, job_id: int):
+        """执行已认领的任务直到完成、取消或失败；进程停止时把任务交还给其他进程"""
+        while True:
+            if self._stopping.is_set():
+                self._release(job_id)
+                return
+            try:
+                delay = self.run_chunk(job_id)
+                if delay is None:
+                    return
+            except DatabaseBusyError:
+                # 写锁繁忙时稍后重试这个分块
+                time.sleep(self.pause)
+                continue
+            except Exception as e:
+                print(f"后台任务 {job_id} 执行失败: {str(e)}")
+                with db_write() as conn:
+                    self._finish(conn, job_id, 'failed', str(e))
+                return
+            time.sleep(delay)
+
+    def _release(self, job_id: int):
+        with db_write() as conn:
+            conn.execute('''
+                UPDATE background_jobs SET status = 'pending', locked_by = NULL
+                WHERE id = ? AND locked_by = ?
+            ''', (job_id, self._owner))
+        self.stats['released'] += 1
+
+    def run_pending(self) -> int:
+        """在当前线程执行所有待执行的任务，返回执行的任务数（命令行和测试使用）"""
+        jobs = 0
+        while True:
+            job_id = self.claim()
+            if job_id is None:
+                return jobs
+            self.run_job(job_id)
+            jobs += 1
+
+    def schedule_periodic(self):
+        """调用定期任务的调度函数，到期的会创建新任务"""
+        for scheduler in PERIODIC_JOB_SCHEDULERS:
+            try:
+                scheduler()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"创建定期任务失败: {str(e)}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            if time.monotonic() >= self._next_periodic:
+                self._next_periodic = time.monotonic() + JOB_PERIODIC_CHECK_INTERVAL
+                self.schedule_periodic()
+            try:
+                job_id = self.claim()
+                if job_id is not None:
+                    self.run_job(job_id)
+                    continue
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"认领后台任务失败: {str(e)}")
+            self._wakeup.wait(self.poll_interval)
+
+    def close(self):
+        """停止任务线程，运行中的任务在当前分块提交后交还"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._pid == os.getpid():
+            for thread in self._threads:
+                thread.join(timeout=5)
+        self._threads = []
+
+job_runner = JobRunner()
+atexit.register(job_runner.close)
+
+@app.before_request
+def start_job_runner():
+    """worker进程收到第一个请求时启动任务线程，接管进程重启前没有完成的任务"""
+    job_runner.start()
+
+@app.cli.command('run-jobs')
+def run_jobs_command():
+    """在前台执行所有待执行的后台任务（flask --app app run-jobs）"""
+    jobs = job_runner.run_pending()
+    print(f"✅ 已执行 {jobs} 个后台任务")
+
+# 已删除PGN的清理速率上限（每秒删除行数，0表示不限制），避免大批量删除挤占学生的进度写入
+PGN_PURGE_ROWS_PER_SECOND = float(os.environ.get('PGN_PURGE_ROWS_PER_SECOND', 2000))
+
+# 已删除PGN由后台任务分块清理的表：(表名, PGN列)，按顺序清空，最后删除PGN记录本身。
+# 先删汇总行，之后删除进度时触发器不再需要更新汇总；进度要在重置纪元之前删除，触发器依赖纪元判断可见性
+PGN_PURGE_TABLES = (
+    ('progress_rollup', 'pgn_game_id'),
+    ('user_progress', 'pgn_game_id'),
+    ('user_study_logs', 'pgn_game_id'),
+    ('study_log_summaries', 'pgn_game_id'),
+    ('study_event_segments', 'pgn_game_id'),
+    ('user_branch_states', 'pgn_game_id'),
+    ('progress_epochs', 'pgn_game_id'),
+    ('pgn_permissions', 'pgn_id'),
+)
+
+def count_pgn_data(conn, params: dict) -> int:
+    return 1 + sum(
+        conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {column} = ?', (params['pgn_id'],)).fetchone()[0]
+        for table, column in PGN_PURGE_TABLES
+    )
+
+@job_handler('purge_pgn_data', count=count_pgn_data, rows_per_second=PGN_PURGE_ROWS_PER_SECOND)
+def purge_pgn_data(conn, params: dict, chunk_size: int) -> int:
+    """分块删除已删除PGN的汇总、进度、学习日志及其压缩汇总、分支状态、重置纪元和授权，最后删除PGN记录"""
+    pgn_id = params['pgn_id']
+    if conn.execute('SELECT 1 FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,)).fetchone():
+        # 只清理已删除的PGN
+        return 0
+    for table, column in PGN_PURGE_TABLES:
+        deleted = conn.execute(f'''
+            DELETE FROM {table} WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE {column} = ? LIMIT ?
+            )
+        ''', (pgn_id, chunk_size)).rowcount
+        if deleted:
+            return deleted
+    return conn.execute('DELETE FROM pgn_games WHERE id = ? AND deleted_at IS NOT NULL', (pgn_id,)).rowcount
+
+def remove_pgn(conn, pgn_id: int, deleted_by: Optional[int] = None) -> int:
+    """在当前写事务中删除PGN，返回清理相关数据的后台任务ID
+
+    只标记删除时间，PGN立即从列表、最新PGN和权限检查中消失，耗时与PGN关联的数据量无关；
+    PGN记录（包括原始内容和解析结果）及其进度、日志、授权由后台任务按速率限制回收。
+    """
+    # 缓冲区中的日志先写入，之后由清理任务一起删除
+    flush_pending_study_logs(conn, pgn_id)
+    conn.execute('UPDATE pgn_games SET deleted_at = CURRENT_TIMESTAMP WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
+    return enqueue_job(conn, 'purge_pgn_data', {'pgn_id': pgn_id}, deleted_by)
+
+def schedule_pgn_purges(conn) -> List[int]:
+    """为已删除但没有待执行清理任务的PGN（例如清理任务被取消或失败）重新创建清理任务，返回任务ID"""
+    active = {
+        json.loads(params)['pgn_id'] for (params,) in conn.execute('''
+            SELECT params FROM background_jobs
+            WHERE status IN ('pending', 'running') AND kind = 'purge_pgn_data'
+        ''')
+    }
+    return [
+        enqueue_job(conn, 'purge_pgn_data', {'pgn_id': pgn_id})
+        for (pgn_id,) in conn.execute('SELECT id FROM pgn_games WHERE deleted_at IS NOT NULL').fetchall()
+        if pgn_id not in active
+    ]
+
+@app.cli.command('purge-deleted-pgns')
+def purge_deleted_pgns_command():
+    """为已删除但未清理完的PGN重新创建清理任务（flask --app app purge-deleted-pgns）"""
+    with db_write() as conn:
+        job_ids = schedule_pgn_purges(conn)
+    job_runner.wake()
+    print(f"✅ 已创建 {len(job_ids)} 个PGN清理任务")
+
+# 学习日志保留配置
+STUDY_LOG_RETENTION_DAYS = int(os.environ.get('STUDY_LOG_RETENTION_DAYS', 180))  # 原始日志保留天数，更早的压缩为每日汇总（0表示不压缩）
+STUDY_LOG_ARCHIVE_DIR = os.environ.get(  # 压缩前把原始日志归档为gzip NDJSON的目录（设为空表示不归档）
+    'STUDY_LOG_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(DATABASE_PATH)), 'study_log_archive'))
+STUDY_LOG_COMPACT_INTERVAL = float(os.environ.get('STUDY_LOG_COMPACT_INTERVAL', 86400))  # 自动压缩的间隔秒数
+STUDY_LOG_COMPACT_ROWS_PER_SECOND = float(os.environ.get('STUDY_LOG_COMPACT_ROWS_PER_SECOND', 5000))  # 压缩速率上限
+
+# 归档文件每行一条原始日志，字段顺序与压缩时的查询一致
+STUDY_LOG_ARCHIVE_FIELDS = ('id', 'user_id', 'pgn_game_id', 'branch_id', 'action', 'result',
+                            'duration_seconds', 'created_at', 'epoch')
+
+STUDY_LOG_SUMMARY_UPSERT_SQL = '''
+    INSERT INTO study_log_summaries (user_id, pgn_game_id, branch_id, day, epoch, count, correct, duration)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, pgn_game_id, branch_id, day, epoch) DO UPDATE SET
+        count = count + excluded.count,
+        correct = correct + excluded.correct,
+        duration = duration + excluded.duration
+'''
+
+def study_log_archive_path(day: str) -> str:
+    return os.path.join(STUDY_LOG_ARCHIVE_DIR, f'study_logs_{day}.ndjson.gz')
+
+def archive_study_logs(rows: List[tuple]):
+    """把原始日志按UTC日期追加到gzip NDJSON归档文件，落盘后才返回
+
+    每次追加一个独立的gzip成员，gzip读取时会依次解压全部成员；
+    之后的数据库事务失败时同一批日志会在下次压缩时再次归档，恢复时按id去重。
+    """
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row[7][:10], []).append(row)
+    os.makedirs(STUDY_LOG_ARCHIVE_DIR, exist_ok=True)
+    for day, day_rows in by_day.items():
+        lines = ''.join(json.dumps(dict(zip(STUDY_LOG_ARCHIVE_FIELDS, row)), ensure_ascii=False) + '\n'
+                        for row in day_rows)
+        with open(study_log_archive_path(day), 'ab') as f:
+            f.write(gzip.compress(lines.encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+
+def read_study_log_archive(day: str):
+    """逐条读取某一天的归档日志（字典），没有归档文件时什么也不返回"""
+    path = study_log_archive_path(day)
+    if not os.path.exists(path):
+        return
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+@job_handler('compact_study_logs', rows_per_second=STUDY_LOG_COMPACT_ROWS_PER_SECOND)
+def compact_study_logs(conn, params: dict, chunk_size: int) -> int:
+    """把created_at早于cutoff的原始日志归档后压缩为按(用户, PGN, 分支, 日期, 纪元)的汇总
+
+    先处理按行存储的日志，再处理日期早于cutoff当天的事件段（整段解码，一个分块至少处理一段）。
+    """
+    expired = conn.execute(f'''
+        SELECT {', '.join(STUDY_LOG_ARCHIVE_FIELDS)} FROM user_study_logs
+        WHERE created_at < ?
+        ORDER BY created_at LIMIT ?
+    ''', (params['cutoff'], chunk_size)).fetchall()
+    segment_ids = []
+    if len(expired) < chunk_size:
+        for segment in conn.execute(f'''
+            SELECT {STUDY_EVENT_SEGMENT_COLUMNS} FROM study_event_segments
+            WHERE day < ?
+            ORDER BY day, id LIMIT ?
+        ''', (params['cutoff'][:10], chunk_size - len(expired))).fetchall():
+            if segment_ids and len(expired) >= chunk_size:
+                break
+            segment_ids.append((segment[0],))
+            expired.extend(decode_study_event_segment(segment))
+    if not expired:
+        return 0
+    
+    if STUDY_LOG_ARCHIVE_DIR:
+        archive_study_logs(expired)
+    
+    summaries = {}
+    activity = {}
+    for _, user_id, pgn_game_id, branch_id, _, result, duration, created_at, epoch in expired:
+        correct = 1 if result == 'correct' else 0
+        for totals, key in ((summaries, (user_id, pgn_game_id, branch_id, created_at[:10], epoch)),
+                            (activity, (user_id, created_at[:10]))):
+            count, correct_count, total_duration = totals.get(key, (0, 0, 0))
+            totals[key] = (count + 1, correct_count + correct, total_duration + (duration or 0))
+    conn.executemany(STUDY_LOG_SUMMARY_UPSERT_SQL, [key + totals for key, totals in summaries.items()])
+    # 删除触发器会从每日活动中扣减这些日志，而它们仍以汇总形式计入，先加回
+    conn.executemany(DAILY_ACTIVITY_UPSERT_SQL, [key + totals for key, totals in activity.items()])
+    conn.executemany('DELETE FROM user_study_logs WHERE id = ?', [(row[0],) for row in expired if row[0] is not None])
+    conn.executemany('DELETE FROM study_event_segments WHERE id = ?', segment_ids)
+    return len(expired)
+
+def enqueue_study_log_compaction(conn, retention_days: int = STUDY_LOG_RETENTION_DAYS,
+                                 created_by: Optional[int] = None) -> int:
+    """在当前写事务中创建压缩任务，截止时间在创建时确定，任务中断后按同一截止时间继续"""
+    cutoff = (datetime.utcnow() - timedelta(days=retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+    return enqueue_job(conn, 'compact_study_logs', {'cutoff': cutoff}, created_by)
+
+def schedule_study_log_compaction() -> Optional[int]:
+    """配置了保留期且距上次压缩超过STUDY_LOG_COMPACT_INTERVAL时创建压缩任务"""
+    if STUDY_LOG_RETENTION_DAYS <= 0:
+        return None
+    due = (datetime.utcnow() - timedelta(seconds=STUDY_LOG_COMPACT_INTERVAL)).strftime('%Y-%m-%d %H:%M:%S')
+    with db_write() as conn:
+        last = conn.execute('''
+            SELECT status, created_at FROM background_jobs
+            WHERE kind = 'compact_study_logs'
+            ORDER BY id DESC LIMIT 1
+        ''').fetchone()
+        if last and (last[0] in ('pending', 'running') or last[1] > due):
+            return None
+        return enqueue_study_log_compaction(conn)
+
+PERIODIC_JOB_SCHEDULERS.append(schedule_study_log_compaction)
+
+def restore_study_logs(conn, records) -> int:
+    """在当前写事务中把归档日志写回user_study_logs并从对应汇总中扣除，返回恢复条数
+
+    只恢复仍计入汇总的日志：已恢复过的、随重置被清理的、随PGN删除的日志都会跳过，
+    所以同一归档可以重复恢复。来自事件段的日志没有id，恢复为新的行，重复恢复只靠汇总计数去重。
+    每日活动只是从汇总挪回原始日志，总数不变。
+    """
+    restored = 0
+    touched = set()
+    for record in records:
+        key = (record['user_id'], record['pgn_game_id'], record['branch_id'],
+               record['created_at'][:10], record['epoch'])
+        summary = conn.execute('''
+            SELECT count FROM study_log_summaries
+            WHERE user_id = ? AND pgn_game_id = ? AND branch_id = ? AND day = ? AND epoch = ?
+        ''', key).fetchone()
+        if not summary or summary[0] <= 0:
+            continue
+        inserted = conn.execute(f'''
+            INSERT OR IGNORE INTO user_study_logs ({', '.join(STUDY_LOG_ARCHIVE_FIELDS)})
+            VALUES ({', '.join('?' * len(STUDY_LOG_ARCHIVE_FIELDS))})
+        ''', [record[field] for field in STUDY_LOG_ARCHIVE_FIELDS]).rowcount
+        if not inserted:
+            continue
+        conn.execute('''
+            UPDATE study_log_summaries SET
+                count = count - 1, correct = correct - ?, duration = duration - ?
+            WHERE user_id = ? AND pgn_game_id = ? AND branch_id = ? AND day = ? AND epoch = ?
+        ''', (1 if record['result'] == 'correct' else 0, record['duration_seconds'] or 0, *key))
+        touched.add(key)
+        restored += 1
+    for key in touched:
+        conn.execute('''
+            DELETE FROM study_log_summaries
+            WHERE user_id = ? AND pgn_game_id = ? AND branch_id = ? AND day = ? AND epoch = ? AND count <= 0
+        ''', key)
+    return restored
+
+@app.cli.command('compact-study-logs')
+@click.option('--retention-days', type=int, default=None, help='原始日志保留天数，默认使用STUDY_LOG_RETENTION_DAYS')
+def compact_study_logs_command(retention_days):
+    """立即归档并压缩超过保留期的学习日志（flask --app app compact-study-logs）"""
+    study_log_writer.flush()
+    with db_write() as conn:
+        job_id = enqueue_study_log_compaction(
+            conn, STUDY_LOG_RETENTION_DAYS if retention_days is None else retention_days)
+    job_runner.run_pending()
+    with db_read() as conn:
+        row = conn.execute(f'SELECT {JOB_COLUMNS} FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+    job = job_to_dict(row)
+    print(f"✅ 压缩任务 #{job_id} {job['status']}: 已压缩 {job['processed']} 条原始日志")
+
+@app.cli.command('restore-study-logs')
+@click.argument('start_day')
+@click.argument('end_day', required=False)
+def restore_study_logs_command(start_day, end_day):
+    """从归档恢复指定日期范围（UTC，YYYY-MM-DD，含首尾）的原始学习日志（flask --app app restore-study-logs 2025-01-01 2025-01-31）
+
+    恢复的日志仍早于保留期时会在下次压缩时再次归档，需要长期保留请先调大STUDY_LOG_RETENTION_DAYS。
+    """
+    day = datetime.strptime(start_day, '%Y-%m-%d')
+    end = datetime.strptime(end_day or start_day, '%Y-%m-%d')
+    restored = 0
+    while day <= end:
+        batch = []
+        for record in read_study_log_archive(day.strftime('%Y-%m-%d')):
+            batch.append(record)
+            if len(batch) >= JOB_CHUNK_SIZE:
+                with db_write() as conn:
+                    restored += restore_study_logs(conn, batch)
+                batch = []
+        if batch:
+            with db_write() as conn:
+                restored += restore_study_logs(conn, batch)
+        day += timedelta(days=1)
+    print(f"✅ 已从归档恢复 {restored} 条学习日志")
+
+# 正确率计数缓存配置
+PROGRESS_CACHE_TTL = float(os.environ.get('PROGRESS_CACHE_TTL', 300))  # 缓存条目最长存活秒数，只用于回收长期不用的条目
+PROGRESS_CACHE_MAX_ENTRIES = int(os.environ.get('PROGRESS_CACHE_MAX_ENTRIES', 10000))  # 最多缓存的(用户, PGN)数
+
+class ProgressCounterCache:
+    """按(用户, PGN)缓存正确数和尝试数，供/api/progress/current-stats直接返回
+
+    条目只在通过权限检查后写入，所以命中即表示有权限；进度写入提交后按增量更新（写穿透），
+    重置、删除、撤销权限等操作提交后使条目失效。
+    未命中时从数据库读取后回填：读取期间若有同一键的写入在进行或已提交（版本变化），放弃回填，
+    避免把旧值写回缓存或重复累加。
+    缓存只在本进程内，条目同时记下('user', 用户ID)和('pgn', PGN ID)的资源版本号，命中时按主键读取
+    这两个版本号，不一致说明其他worker有过进度写入、重置、授权变化或PGN变更，条目作废重新读取。
+    """
+
+    def __init__(self, ttl: float = PROGRESS_CACHE_TTL, max_entries: int = PROGRESS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._reset()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'fills': 0,
+            'fills_skipped': 0,
+            'write_updates': 0,
+            'invalidations': 0,
+            'stale': 0,
+            'expirations': 0,
+            'evictions': 0
+        }
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # (user_id, pgn_id) -> [total_correct, total_attempts, expires_at, (用户版本号, PGN版本号)]
+        self._entries = OrderedDict()
+        self._versions = {}            # (user_id, pgn_id) -> 写入/失效次数
+        self._inflight = {}            # (user_id, pgn_id) -> 进行中的写入数
+        self._epoch = 0                # 按用户或PGN批量失效时递增
+
+    def get(self, user_id: int, pgn_id: int) -> Optional[tuple]:
+        """命中且资源版本号未变时返回(total_correct, total_attempts)"""
+        key = (user_id, int(pgn_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                del self._entries[key]
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+        resource_version = tuple(get_resource_versions(('user', key[0]), ('pgn', key[1])))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] != resource_version:
+                if entry is not None:
+                    del self._entries[key]
+                    self.stats['stale'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[0], entry[1]
+
+    def snapshot_version(self, user_id: int, pgn_id: int) -> tuple:
+        """读取数据库前记录版本，回填时用于判断期间是否有写入"""
+        key = (user_id, int(pgn_id))
+        with self._lock:
+            return self._epoch, self._versions.get(key, 0)
+
+    def fill(self, user_id: int, pgn_id: int, total_correct: int, total_attempts: int, version: tuple,
+             resource_version: tuple):
+        """回填读到的计数；resource_version为读取前get_resource_versions得到的(用户版本号, PGN版本号)"""
+        key = (user_id, int(pgn_id))
+        with self._lock:
+            if self._inflight.get(key) or (self._epoch, self._versions.get(key, 0)) != version:
+                self.stats['fills_skipped'] += 1
+                return
+            self._entries[key] = [total_correct, total_attempts, time.monotonic() + self.ttl,
+                                  tuple(resource_version)]
+            self._entries.move_to_end(key)
+            self.stats['fills'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    @contextmanager
+    def writing(self, user_id: int, attempts: List[tuple]):
+        """包住一次进度写事务：attempts为[(pgn_id, is_correct), ...]
+
+        产出一个字典，调用方在事务里把写入前后该用户的资源版本号存为write['user_versions']。
+        提交后若条目记下的用户版本号正是写入前的版本号（期间没有其他worker写入），累加增量并更新版本号，
+        否则（包括写入失败）使条目失效。
+        """
+        deltas = {}
+        for pgn_id, is_correct in attempts:
+            key = (user_id, int(pgn_id))
+            delta = deltas.setdefault(key, [0, 0])
+            delta[0] += 1 if is_correct else 0
+            delta[1] += 1
+        with self._lock:
+            for key in deltas:
+                self._inflight[key] = self._inflight.get(key, 0) + 1
+        write = {}
+        committed = False
+        try:
+            yield write
+            committed = True
+        finally:
+            before, after = write.get('user_versions', (None, None))
+            with self._lock:
+                for key, (correct, total) in deltas.items():
+                    self._inflight[key] -= 1
+                    if not self._inflight[key]:
+                        del self._inflight[key]
+                    self._versions[key] = self._versions.get(key, 0) + 1
+                    entry = self._entries.get(key)
+                    if entry is None:
+                        continue
+                    if committed and before is not None and entry[3][0] == before:
+                        entry[0] += correct
+                        entry[1] += total
+                        entry[3] = (after, entry[3][1])
+                        self.stats['write_updates'] += 1
+                    else:
+                        del self._entries[key]
+                        self.stats['invalidations'] += 1
+
+    def invalidate(self, user_id: Optional[int] = None, pgn_id: Optional[int] = None):
+        """使指定用户和/或PGN的条目失效（两者都为空时清空缓存），在写事务提交后调用"""
+        pgn_id = int(pgn_id) if pgn_id is not None else None
+        with self._lock:
+            self._epoch += 1
+            keys = [key for key in self._entries
+                    if (user_id is None or key[0] == user_id) and (pgn_id is None or key[1] == pgn_id)]
+            for key in keys:
+                del self._entries[key]
+            self.stats['invalidations'] += len(keys)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats,
+                        entries=len(self._entries),
+                        hit_ratio=round(self.stats['hits'] / lookups, 4) if lookups else 0.0)
+
+progress_cache = ProgressCounterCache()
+
 @app.route('/api/progress/update', methods=['POST'])
 @require_login
 def update_progress():
@@ -700,76 +3198,95 @@ def update_progress():
         if not pgn_game_id or not branch_id:
             return jsonify({'error': 'PGN游戏ID和分支ID不能为空'}), 400
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-            
-            # 检查是否已有进度记录
-            cursor.execute('''
-                SELECT id, correct_count, total_attempts, mastery_level, is_completed
-                FROM user_progress 
-                WHERE user_id = ? AND pgn_game_id = ? AND branch_id = ?
-            ''', (user_id, pgn_game_id, branch_id))
-            
-            existing = cursor.fetchone()
-            
-            if existing:
-                # 更新现有记录
-                progress_id, correct_count, total_attempts, mastery_level, current_is_completed = existing
-                new_correct_count = correct_count + (1 if is_correct else 0)
-                new_total_attempts = total_attempts + 1
-                
-                # 计算掌握度（正确率）
-                new_mastery_level = int((new_correct_count / new_total_attempts) * 100)
-                
-                # 修复的完成判断逻辑：
-                # 1. 如果已经完成，保持完成状态
-                # 2. 如果未完成，只有走到分支最后一步且这次操作正确才标记为完成
-                if current_is_completed:
-                    is_completed = True  # 保持已完成状态
-                else:
-                    is_completed = (is_branch_end and is_correct)  # 新完成判断
-                
-                cursor.execute('''
-                    UPDATE user_progress 
-                    SET correct_count = ?, total_attempts = ?, mastery_level = ?,
-                        is_completed = ?, last_attempt_at = CURRENT_TIMESTAMP,
-                        updated_at = CURRENT_TIMESTAMP, notes = ?
-                    WHERE id = ?
-                ''', (new_correct_count, new_total_attempts, new_mastery_level, 
-                      is_completed, notes, progress_id))
-            else:
-                # 创建新记录
-                correct_count = 1 if is_correct else 0
-                total_attempts = 1
-                mastery_level = 100 if is_correct else 0
-                # 新记录的完成判断：第一次就到分支末尾且正确才算完成
-                is_completed = (is_branch_end and is_correct)
-                
-                cursor.execute('''
-                    INSERT INTO user_progress 
-                    (user_id, pgn_game_id, branch_id, is_completed, correct_count, 
-                     total_attempts, last_attempt_at, mastery_level, notes)
-                    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
-                ''', (user_id, pgn_game_id, branch_id, is_completed, 
-                      correct_count, total_attempts, mastery_level, notes))
-            
-            # 记录学习日志
-            cursor.execute('''
-                INSERT INTO user_study_logs 
-                (user_id, pgn_game_id, branch_id, action, result, duration_seconds)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, pgn_game_id, branch_id, 'practice', 
-                  'correct' if is_correct else 'incorrect', duration))
-            
-            conn.commit()
-            conn.close()
+        try:
+            pgn_game_id = int(pgn_game_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'PGN游戏ID无效'}), 400
+        
+        if not _valid_duration(duration):
+            return jsonify({'error': '用时必须是非负整数'}), 400
+        
+        study_log_writer.wait_for_room(1)
+        with progress_cache.writing(user_id, [(pgn_game_id, is_correct)]) as cache_write:
+            cache_write['user_versions'] = db_group_write(lambda conn: record_progress_attempt(
+                conn, user_id, pgn_game_id, branch_id, is_correct, is_branch_end, duration, notes))
         
         return jsonify({'success': True, 'message': '进度更新成功'})
         
     except Exception as e:
         return jsonify({'error': f'更新进度失败: {str(e)}'}), 500
 
+@app.route('/api/progress/batch', methods=['POST'])
+@require_login
+def batch_update_progress():
+    """批量更新学习进度（一次分支练习的所有走子，可跨分支和PGN），在同一个事务中按顺序写入"""
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        updates = data.get('updates')
+        
+        if not isinstance(updates, list) or not updates:
+            return jsonify({'error': '更新列表不能为空'}), 400
+        
+        if len(updates) > PROGRESS_BATCH_MAX_SIZE:
+            return jsonify({'error': f'单次最多提交 {PROGRESS_BATCH_MAX_SIZE} 条进度'}), 400
+        
+        attempts = []
+        for index, update in enumerate(updates):
+            if not isinstance(update, dict) or not update.get('pgn_game_id') or not update.get('branch_id'):
+                return jsonify({'error': f'第 {index + 1} 条进度缺少PGN游戏ID或分支ID'}), 400
+            try:
+                pgn_game_id = int(update['pgn_game_id'])
+            except (TypeError, ValueError):
+                return jsonify({'error': f'第 {index + 1} 条进度的PGN游戏ID无效'}), 400
+            if not _valid_duration(update.get('duration', 0)):
+                return jsonify({'error': f'第 {index + 1} 条进度的用时必须是非负整数'}), 400
+            attempts.append({
+                'pgn_game_id': pgn_game_id,
+                'branch_id': update['branch_id'],
+                'is_correct': update.get('is_correct', False),
+                'is_branch_end': update.get('is_branch_end', False),
+                'duration': update.get('duration', 0),
+                'notes': update.get('notes', '')
+            })
+        
+        pgn_ids = sorted({attempt['pgn_game_id'] for attempt in attempts})
+        for pgn_id in pgn_ids:
+            if not check_pgn_permission(user_id, pgn_id):
+                return jsonify({'error': '您没有权限访问此PGN文件', 'pgn_game_id': pgn_id}), 403
+        
+        cache_attempts = [(attempt['pgn_game_id'], attempt['is_correct']) for attempt in attempts]
+        study_log_writer.wait_for_room(len(attempts))
+        with progress_cache.writing(user_id, cache_attempts) as cache_write, db_write() as conn:
+            cache_write['user_versions'] = record_progress_attempts(conn, user_id, attempts)
+            
+            # 同一事务内读回最新正确率，省去前端再请求current-stats
+            placeholders = ', '.join('?' * len(pgn_ids))
+            rows = conn.execute(f'''
+                SELECT pgn_game_id, total_correct, total_attempts
+                FROM progress_rollup 
+                WHERE user_id = ? AND pgn_game_id IN ({placeholders})
+            ''', (user_id, *pgn_ids)).fetchall()
+        
+        stats = {}
+        for pgn_id, total_correct, total_attempts in rows:
+            accuracy_rate = (total_correct / total_attempts * 100) if total_attempts > 0 else 0
+            stats[str(pgn_id)] = {
+                'total_correct': total_correct,
+                'total_attempts': total_attempts,
+                'accuracy_rate': round(accuracy_rate, 1)
+            }
+        
+        return jsonify({
+            'success': True,
+            'message': f'已批量更新 {len(attempts)} 条进度',
+            'applied': len(attempts),
+            'stats': stats
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'批量更新进度失败: {str(e)}'}), 500
+
 @app.route('/api/progress/stats', methods=['GET'])
 @require_login
 def get_progress_stats():
@@ -777,39 +3294,40 @@ def get_progress_stats():
     try:
         user_id = session['user_id']
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 总体统计
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     COUNT(*) as total_branches,
                     SUM(CASE WHEN is_completed = 1 THEN 1 ELSE 0 END) as completed_branches,
                     SUM(COALESCE(correct_count, 0)) as total_correct,
                     SUM(COALESCE(total_attempts, 0)) as total_attempts,
                     AVG(mastery_level) as avg_mastery
-                FROM user_progress 
-                WHERE user_id = ?
+                FROM user_progress up
+                WHERE up.user_id = ? AND {progress_visible_sql('up')}
             ''', (user_id,))
             
             stats = cursor.fetchone()
             
             # 最近学习记录
             cursor.execute('''
-                SELECT DATE(created_at) as date, COUNT(*) as count
-                FROM user_study_logs 
-                WHERE user_id = ? AND created_at >= date('now', '-30 days')
-                GROUP BY DATE(created_at)
-                ORDER BY date DESC
+                SELECT day, count, correct, duration
+                FROM daily_activity
+                WHERE user_id = ? AND day >= date('now', '-30 days')
+                ORDER BY day DESC
                 LIMIT 30
             ''', (user_id,))
             
             daily_stats = cursor.fetchall()
-            conn.close()
         
         if stats:
             total_branches, completed_branches, total_correct, total_attempts, avg_mastery = stats
+            # 没有可见进度时SUM返回NULL
+            completed_branches = completed_branches or 0
+            total_correct = total_correct or 0
+            total_attempts = total_attempts or 0
             completion_rate = (completed_branches / total_branches * 100) if total_branches > 0 else 0
             accuracy_rate = (total_correct / total_attempts * 100) if total_attempts > 0 else 0
             
@@ -824,7 +3342,10 @@ def get_progress_stats():
                     'accuracy_rate': round(accuracy_rate, 2),
                     'avg_mastery': round(avg_mastery or 0, 2)
                 },
-                'daily_stats': [{'date': row[0], 'count': row[1]} for row in daily_stats]
+                'daily_stats': [
+                    {'date': row[0], 'count': row[1], 'correct': row[2], 'duration': row[3]}
+                    for row in daily_stats
+                ]
             })
         else:
             return jsonify({
@@ -856,32 +3377,25 @@ def reset_progress():
         if not pgn_game_id:
             return jsonify({'error': 'PGN游戏ID不能为空'}), 400
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-            
-            # 只删除未掌握的分支进度记录（未完成或有错误的分支）
-            cursor.execute('''
-                DELETE FROM user_progress 
-                WHERE user_id = ? AND pgn_game_id = ? 
-                AND (is_completed = 0 OR (correct_count * 1.0 / total_attempts) < 1.0)
-            ''', (user_id, pgn_game_id))
-            
-            reset_count = cursor.rowcount
+        try:
+            pgn_game_id = int(pgn_game_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'PGN游戏ID无效'}), 400
+        
+        # 只重置未掌握的分支（未完成或有错误的分支），旧数据由后台清理
+        with db_write() as conn:
+            # 在写事务里检查，避免给不存在或已删除的PGN创建重置纪元
+            cursor = conn.execute('SELECT 1 FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_game_id,))
+            if cursor.fetchone() is None:
+                return jsonify({'error': 'PGN文件不存在'}), 404
             
-            # 删除对应的学习日志（只删除未掌握分支的日志）
-            cursor.execute('''
-                DELETE FROM user_study_logs 
-                WHERE user_id = ? AND pgn_game_id = ? 
-                AND branch_id NOT IN (
-                    SELECT branch_id FROM user_progress 
-                    WHERE user_id = ? AND pgn_game_id = ? 
-                    AND is_completed = 1 AND (correct_count * 1.0 / total_attempts) = 1.0
-                )
-            ''', (user_id, pgn_game_id, user_id, pgn_game_id))
+            if not check_pgn_permission(user_id, pgn_game_id):
+                return jsonify({'error': '您没有权限访问此PGN文件'}), 403
             
-            conn.commit()
-            conn.close()
+            reset_count = reset_progress_epoch(conn, user_id, pgn_game_id, keep_mastered=True)
+        progress_sweeper.wake()
+        
+        progress_cache.invalidate(user_id, pgn_game_id)
         
         return jsonify({
             'success': True,
@@ -903,43 +3417,34 @@ def hard_reset_progress():
         if not pgn_game_id:
             return jsonify({'error': 'PGN游戏ID不能为空'}), 400
         
+        try:
+            pgn_game_id = int(pgn_game_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'PGN游戏ID无效'}), 400
+        
         # 检查用户是否有访问此PGN的权限
         if not check_pgn_permission(user_id, pgn_game_id):
             return jsonify({'error': '您没有权限访问此PGN文件'}), 403
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 获取PGN文件名（用于日志）
-            cursor.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_game_id,))
+            cursor.execute('SELECT filename FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_game_id,))
             pgn_info = cursor.fetchone()
             
             if not pgn_info:
                 return jsonify({'error': 'PGN文件不存在'}), 404
             
-            # 删除该用户在该PGN上的所有进度记录
-            cursor.execute('''
-                DELETE FROM user_progress 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_game_id))
-            
-            progress_deleted = cursor.rowcount
-            
-            # 删除该用户在该PGN上的所有学习日志
-            cursor.execute('''
-                DELETE FROM user_study_logs 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_game_id))
-            
-            logs_deleted = cursor.rowcount
-            
-            conn.commit()
-            conn.close()
+            # 彻底重置该用户在该PGN上的进度，进度记录和学习日志由后台分批清理
+            progress_deleted = reset_progress_epoch(conn, user_id, pgn_game_id, keep_mastered=False)
+        
+        progress_sweeper.wake()
+        progress_cache.invalidate(user_id, pgn_game_id)
         
         return jsonify({
             'success': True,
-            'message': f'已彻底重置PGN "{pgn_info[0]}" 的所有进度，清理进度记录 {progress_deleted} 条，学习日志 {logs_deleted} 条'
+            'message': f'已彻底重置PGN "{pgn_info[0]}" 的所有进度，重置进度记录 {progress_deleted} 条，学习日志将在后台清理'
         })
         
     except Exception as e:
@@ -952,28 +3457,32 @@ def get_current_stats(pgn_id):
     try:
         user_id = session['user_id']
         
-        # 检查用户是否有访问此PGN的权限
-        if not check_pgn_permission(user_id, pgn_id):
-            return jsonify({'error': '您没有权限访问此PGN文件'}), 403
-        
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
+        # 缓存命中即表示已通过权限检查，只按主键读取一次资源版本号确认条目仍是最新，不查进度表
+        cached = progress_cache.get(user_id, pgn_id)
+        if cached is not None:
+            total_correct, total_attempts = cached
+        else:
+            # 检查用户是否有访问此PGN的权限
+            if not check_pgn_permission(user_id, pgn_id):
+                return jsonify({'error': '您没有权限访问此PGN文件'}), 403
             
-            # 获取数据库中的统计数据
-            cursor.execute('''
-                SELECT 
-                    SUM(COALESCE(correct_count, 0)) as total_correct,
-                    SUM(COALESCE(total_attempts, 0)) as total_attempts
-                FROM user_progress 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_id))
+            version = progress_cache.snapshot_version(user_id, pgn_id)
+            resource_version = get_resource_versions(('user', user_id), ('pgn', pgn_id))
+            with db_read() as conn:
+                cursor = conn.cursor()
+                
+                # 获取数据库中的统计数据（汇总表只包含当前重置纪元的进度）
+                cursor.execute('''
+                    SELECT total_correct, total_attempts
+                    FROM progress_rollup 
+                    WHERE user_id = ? AND pgn_game_id = ?
+                ''', (user_id, pgn_id))
+                
+                db_stats = cursor.fetchone() or (0, 0)
             
-            db_stats = cursor.fetchone()
-            conn.close()
-        
-        total_correct = db_stats[0] or 0
-        total_attempts = db_stats[1] or 0
+            total_correct = db_stats[0] or 0
+            total_attempts = db_stats[1] or 0
+            progress_cache.fill(user_id, pgn_id, total_correct, total_attempts, version, resource_version)
         
         # 计算整体正确率
         accuracy_rate = (total_correct / total_attempts * 100) if total_attempts > 0 else 0
@@ -988,15 +3497,126 @@ def get_current_stats(pgn_id):
     except Exception as e:
         return jsonify({'error': f'获取当前统计失败: {str(e)}'}), 500
 
+PROGRESS_CHANGES_DEFAULT_LIMIT = 500  # 每次增量同步默认返回的变更数
+PROGRESS_CHANGES_MAX_LIMIT = 1000
+
+@app.route('/api/progress/changes', methods=['GET'])
+@require_login
+def get_progress_changes():
+    """增量同步：返回游标since之后变化的进度行和删除标记
+
+    removed中reason为reset的PGN需要先清空本地进度，再应用changes（重置后仍保留的已掌握分支会一并返回）；
+    reason为deleted的PGN已被删除。changes总是各行的当前状态，has_more为真时用返回的cursor继续拉取。
+    """
+    try:
+        user_id = session['user_id']
+        since = request.args.get('since', '0')
+        limit = request.args.get('limit', str(PROGRESS_CHANGES_DEFAULT_LIMIT))
+        if not since.isdigit():
+            return jsonify({'error': '无效的游标'}), 400
+        if not limit.isdigit() or not 1 <= int(limit) <= PROGRESS_CHANGES_MAX_LIMIT:
+            return jsonify({'error': f'limit必须在1到{PROGRESS_CHANGES_MAX_LIMIT}之间'}), 400
+        since, limit = int(since), int(limit)
+        
+        with db_read() as conn:
+            # 用户自己的变更和全局的PGN删除分别走(user_id, seq)索引取前limit+1条再合并；
+            # 删除标记只返回该用户有过变更记录的PGN，不向其他用户泄露PGN ID
+            entries = conn.execute('''
+                SELECT seq, pgn_game_id, branch_id, kind FROM (
+                    SELECT * FROM (
+                        SELECT seq, pgn_game_id, branch_id, kind FROM progress_changes
+                        WHERE user_id = ? AND seq > ? ORDER BY seq LIMIT ?
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT seq, pgn_game_id, branch_id, kind FROM progress_changes deleted
+                        WHERE user_id = 0 AND seq > ?
+                        AND EXISTS (
+                            SELECT 1 FROM progress_changes own
+                            WHERE own.user_id = ? AND own.pgn_game_id = deleted.pgn_game_id
+                        )
+                        ORDER BY seq LIMIT ?
+                    )
+                )
+                ORDER BY seq LIMIT ?
+            ''', (user_id, since, limit + 1, since, user_id, limit + 1, limit + 1)).fetchall()
+            has_more = len(entries) > limit
+            entries = entries[:limit]
+            
+            removed = []
+            resync = set()
+            branches = []
+            for seq, pgn_game_id, branch_id, kind in entries:
+                if kind == 'progress':
+                    branches.append((pgn_game_id, branch_id))
+                else:
+                    removed.append({'seq': seq, 'pgn_game_id': pgn_game_id, 'reason': kind})
+                    if kind == 'reset':
+                        resync.add(pgn_game_id)
+            
+            conditions = []
+            params = [user_id]
+            if branches:
+                conditions.append(f"(up.pgn_game_id, up.branch_id) IN (VALUES {', '.join(['(?, ?)'] * len(branches))})")
+                params.extend(value for branch in branches for value in branch)
+            if resync:
+                conditions.append(f"up.pgn_game_id IN ({', '.join('?' * len(resync))})")
+                params.extend(resync)
+            rows = []
+            if conditions:
+                rows = conn.execute(f'''
+                    SELECT 
+                        up.pgn_game_id,
+                        up.branch_id,
+                        up.is_completed,
+                        up.correct_count,
+                        up.total_attempts,
+                        up.last_attempt_at,
+                        up.mastery_level,
+                        up.notes,
+                        pg.filename
+                    FROM user_progress up
+                    JOIN pgn_games pg ON up.pgn_game_id = pg.id
+                    WHERE up.user_id = ? AND ({' OR '.join(conditions)})
+                    AND pg.deleted_at IS NULL AND {progress_visible_sql('up')}
+                ''', params).fetchall()
+        
+        changes = [{
+            'pgn_game_id': row[0],
+            'branch_id': row[1],
+            'is_completed': row[2],
+            'correct_count': row[3],
+            'total_attempts': row[4],
+            'last_attempt_at': row[5],
+            'mastery_level': row[6],
+            'notes': row[7],
+            'pgn_filename': row[8]
+        } for row in rows]
+        
+        return jsonify({
+            'success': True,
+            'cursor': entries[-1][0] if entries else since,
+            'has_more': has_more,
+            'changes': changes,
+            'removed': removed
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'获取进度变更失败: {str(e)}'}), 500
+
 @app.route('/api/progress/by-pgn', methods=['GET'])
 @require_login
 def get_progress_by_pgn():
-    """获取按PGN分组的学习进度统计"""
+    """获取按PGN分组的学习进度统计（支持If-None-Match条件请求）"""
     try:
         user_id = session['user_id']
+        user_version, catalog_version = get_resource_versions(('user', user_id), ('catalog', 0))
+        etag = f'by-pgn-{user_id}-{user_version}-{catalog_version}'
+        cached = not_modified(etag)
+        if cached:
+            return cached
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 检查用户是否是管理员
@@ -1011,17 +3631,17 @@ def get_progress_by_pgn():
                         pg.id,
                         pg.filename,
                         pg.total_branches,
-                        COUNT(up.id) as practiced_branches,
-                        SUM(CASE WHEN up.is_completed = 1 THEN 1 ELSE 0 END) as completed_branches,
-                        SUM(COALESCE(up.correct_count, 0)) as total_correct,
-                        SUM(COALESCE(up.total_attempts, 0)) as total_attempts,
-                        AVG(up.mastery_level) as avg_mastery,
-                        MAX(up.last_attempt_at) as last_practice_time,
+                        r.practiced_branches,
+                        r.completed_branches,
+                        r.mastered_branches,
+                        r.total_correct,
+                        r.total_attempts,
+                        r.last_practice_time,
                         pg.upload_time
-                    FROM pgn_games pg
-                    INNER JOIN user_progress up ON pg.id = up.pgn_game_id AND up.user_id = ?
-                    GROUP BY pg.id, pg.filename, pg.total_branches, pg.upload_time
-                    ORDER BY last_practice_time DESC
+                    FROM progress_rollup r
+                    INNER JOIN pgn_games pg ON pg.id = r.pgn_game_id
+                    WHERE r.user_id = ? AND pg.deleted_at IS NULL
+                    ORDER BY r.last_practice_time DESC
                 ''', (user_id,))
             else:
                 # 普通用户只能看到有权限且已练习的PGN
@@ -1030,66 +3650,33 @@ def get_progress_by_pgn():
                         pg.id,
                         pg.filename,
                         pg.total_branches,
-                        COUNT(up.id) as practiced_branches,
-                        SUM(CASE WHEN up.is_completed = 1 THEN 1 ELSE 0 END) as completed_branches,
-                        SUM(COALESCE(up.correct_count, 0)) as total_correct,
-                        SUM(COALESCE(up.total_attempts, 0)) as total_attempts,
-                        AVG(up.mastery_level) as avg_mastery,
-                        MAX(up.last_attempt_at) as last_practice_time,
+                        r.practiced_branches,
+                        r.completed_branches,
+                        r.mastered_branches,
+                        r.total_correct,
+                        r.total_attempts,
+                        r.last_practice_time,
                         pg.upload_time
-                    FROM pgn_games pg
-                    INNER JOIN user_progress up ON pg.id = up.pgn_game_id AND up.user_id = ?
-                    INNER JOIN pgn_permissions p ON pg.id = p.pgn_id AND p.user_id = ?
-                    GROUP BY pg.id, pg.filename, pg.total_branches, pg.upload_time
-                    ORDER BY last_practice_time DESC
-                ''', (user_id, user_id))
+                    FROM progress_rollup r
+                    INNER JOIN pgn_games pg ON pg.id = r.pgn_game_id
+                    INNER JOIN pgn_permissions p ON pg.id = p.pgn_id AND p.user_id = r.user_id
+                    WHERE r.user_id = ? AND pg.deleted_at IS NULL
+                    ORDER BY r.last_practice_time DESC
+                ''', (user_id,))
             
             pgn_stats = cursor.fetchall()
-            conn.close()
         
         result = []
         for row in pgn_stats:
-            pgn_id, filename, total_branches, practiced_branches, completed_branches, total_correct, total_attempts, avg_mastery, last_practice_time, upload_time = row
-            
-            # 重新计算掌握度：需要查询每个分支的详细情况
-            with db_lock:
-                conn = sqlite3.connect(DATABASE_PATH)
-                cursor = conn.cursor()
-                
-                # 获取该PGN下所有分支的完成情况和正确率
-                cursor.execute('''
-                    SELECT 
-                        is_completed,
-                        correct_count,
-                        total_attempts
-                    FROM user_progress 
-                    WHERE user_id = ? AND pgn_game_id = ?
-                ''', (user_id, pgn_id))
-                
-                branch_details = cursor.fetchall()
-                conn.close()
-            
-            # 重新计算总正确数和总尝试数（确保数据准确）
-            recalculated_total_correct = sum(row[1] or 0 for row in branch_details)
-            recalculated_total_attempts = sum(row[2] or 0 for row in branch_details)
-            
-            # 使用重新计算的值
-            total_correct = recalculated_total_correct
-            total_attempts = recalculated_total_attempts
+            pgn_id, filename, total_branches, practiced_branches, completed_branches, mastered_branches, total_correct, total_attempts, last_practice_time, upload_time = row
             
             # 计算统计数据
             completion_rate = (completed_branches / total_branches * 100) if total_branches > 0 else 0
             
-            # 计算整体正确率：使用重新计算的准确数据
+            # 计算整体正确率
             accuracy_rate = (total_correct / total_attempts * 100) if total_attempts > 0 else 0
             
-            # 计算真正掌握的分支数（完成且100%正确）
-            mastered_branches = 0
-            for is_completed, correct_count, total_attempts_branch in branch_details:
-                if is_completed and total_attempts_branch > 0 and (correct_count / total_attempts_branch) == 1.0:
-                    mastered_branches += 1
-            
-            # 计算掌握度百分比
+            # 计算掌握度百分比（mastered_branches为完成且100%正确的分支数）
             mastery_rate = (mastered_branches / total_branches * 100) if total_branches > 0 else 0
             
             # 确定整体状态
@@ -1126,7 +3713,7 @@ def get_progress_by_pgn():
                 'notes': ''  # 可以后续添加备注功能
             })
         
-        return jsonify({'success': True, 'pgn_progress': result})
+        return with_etag(jsonify({'success': True, 'pgn_progress': result}), etag)
         
     except Exception as e:
         return jsonify({'error': f'获取PGN进度统计失败: {str(e)}'}), 500
@@ -1142,12 +3729,11 @@ def get_branches_progress(pgn_id):
         if not check_pgn_permission(user_id, pgn_id):
             return jsonify({'error': '您没有权限访问此PGN文件'}), 404
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 获取该PGN的所有分支进度
-            cursor.execute('''
+            cursor.execute(f'''
                 SELECT 
                     up.branch_id,
                     up.is_completed,
@@ -1157,17 +3743,15 @@ def get_branches_progress(pgn_id):
                     up.mastery_level,
                     up.notes
                 FROM user_progress up
-                WHERE up.user_id = ? AND up.pgn_game_id = ?
+                WHERE up.user_id = ? AND up.pgn_game_id = ? AND {progress_visible_sql('up')}
                 ORDER BY up.branch_id
             ''', (user_id, pgn_id))
             
             branches = cursor.fetchall()
             
             # 获取PGN文件名
-            cursor.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_id,))
+            cursor.execute('SELECT filename FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
             pgn_info = cursor.fetchone()
-            
-            conn.close()
         
         if not pgn_info:
             return jsonify({'error': 'PGN文件不存在'}), 404
@@ -1222,34 +3806,26 @@ def get_branches_progress(pgn_id):
 def delete_pgn(pgn_id):
     """管理员删除PGN（会删除所有用户的相关进度）"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 获取PGN信息
-            cursor.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_id,))
+            cursor.execute('SELECT filename FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
             pgn_info = cursor.fetchone()
             
             if not pgn_info:
                 return jsonify({'error': 'PGN文件不存在'}), 404
             
-            # 删除所有用户的进度记录
-            cursor.execute('DELETE FROM user_progress WHERE pgn_game_id = ?', (pgn_id,))
-            progress_deleted = cursor.rowcount
-            
-            # 删除所有用户的学习日志
-            cursor.execute('DELETE FROM user_study_logs WHERE pgn_game_id = ?', (pgn_id,))
-            logs_deleted = cursor.rowcount
-            
-            # 删除PGN文件记录
-            cursor.execute('DELETE FROM pgn_games WHERE id = ?', (pgn_id,))
-            
-            conn.commit()
-            conn.close()
+            # 删除PGN记录，所有用户的进度和学习日志由后台任务分块清理
+            job_id = remove_pgn(conn, pgn_id, session.get('user_id'))
+        
+        job_runner.wake()
+        progress_cache.invalidate(pgn_id=pgn_id)
         
         return jsonify({
             'success': True,
-            'message': f'已删除PGN文件 "{pgn_info[0]}"，清理进度记录 {progress_deleted} 条，学习日志 {logs_deleted} 条'
+            'job_id': job_id,
+            'message': f'已删除PGN文件 "{pgn_info[0]}"，所有用户的进度和学习日志正在后台清理'
         })
         
     except Exception as e:
@@ -1260,12 +3836,11 @@ def delete_pgn(pgn_id):
 def get_pgn_user_progress(pgn_id):
     """管理员查看指定PGN的所有用户进度"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 获取PGN信息
-            cursor.execute('SELECT filename, total_branches FROM pgn_games WHERE id = ?', (pgn_id,))
+            cursor.execute('SELECT filename, total_branches FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
             pgn_info = cursor.fetchone()
             
             if not pgn_info:
@@ -1277,21 +3852,20 @@ def get_pgn_user_progress(pgn_id):
                     u.id,
                     u.username,
                     u.email,
-                    COUNT(up.id) as practiced_branches,
-                    SUM(CASE WHEN up.is_completed = 1 THEN 1 ELSE 0 END) as completed_branches,
-                    SUM(CASE WHEN up.is_completed = 1 AND (up.correct_count * 1.0 / NULLIF(up.total_attempts, 0)) = 1.0 THEN 1 ELSE 0 END) as mastered_branches,
-                    SUM(COALESCE(up.correct_count, 0)) as total_correct,
-                    SUM(COALESCE(up.total_attempts, 0)) as total_attempts,
-                    MAX(up.last_attempt_at) as last_practice_time,
+                    r.practiced_branches,
+                    r.completed_branches,
+                    r.mastered_branches,
+                    r.total_correct,
+                    r.total_attempts,
+                    r.last_practice_time,
                     u.created_at
-                FROM users u
-                INNER JOIN user_progress up ON u.id = up.user_id AND up.pgn_game_id = ?
-                GROUP BY u.id, u.username, u.email, u.created_at
-                ORDER BY last_practice_time DESC
+                FROM progress_rollup r
+                INNER JOIN users u ON u.id = r.user_id
+                WHERE r.pgn_game_id = ?
+                ORDER BY r.last_practice_time DESC
             ''', (pgn_id,))
             
             user_progress = cursor.fetchall()
-            conn.close()
         
         filename, total_branches = pgn_info
         
@@ -1352,12 +3926,11 @@ def get_pgn_user_progress(pgn_id):
 def admin_reset_user_progress(pgn_id, user_id):
     """管理员彻底重置指定用户在指定PGN上的所有进度"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 验证PGN和用户是否存在
-            cursor.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_id,))
+            cursor.execute('SELECT filename FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
             pgn_info = cursor.fetchone()
             
             cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
@@ -1369,28 +3942,18 @@ def admin_reset_user_progress(pgn_id, user_id):
             if not user_info:
                 return jsonify({'error': '用户不存在'}), 404
             
-            # 删除该用户在该PGN上的所有进度记录
-            cursor.execute('''
-                DELETE FROM user_progress 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_id))
-            
-            progress_deleted = cursor.rowcount
+            # 彻底重置该用户在该PGN上的进度，进度记录和学习日志由后台分批清理
+            progress_deleted = reset_progress_epoch(conn, user_id, pgn_id, keep_mastered=False)
             
-            # 删除该用户在该PGN上的所有学习日志
-            cursor.execute('''
-                DELETE FROM user_study_logs 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_id))
-            
-            logs_deleted = cursor.rowcount
-            
-            conn.commit()
-            conn.close()
+            # 删除该用户在该PGN上的所有分支状态（各学习模式）
+            clear_branch_states(conn, pgn_id, user_id)
+        
+        progress_sweeper.wake()
+        progress_cache.invalidate(user_id, pgn_id)
         
         return jsonify({
             'success': True,
-            'message': f'已彻底重置用户 "{user_info[0]}" 在PGN "{pgn_info[0]}" 上的所有进度，清理进度记录 {progress_deleted} 条，学习日志 {logs_deleted} 条'
+            'message': f'已彻底重置用户 "{user_info[0]}" 在PGN "{pgn_info[0]}" 上的所有进度，重置进度记录 {progress_deleted} 条，学习日志将在后台清理'
         })
         
     except Exception as e:
@@ -1401,8 +3964,7 @@ def admin_reset_user_progress(pgn_id, user_id):
 def get_admin_pgn_list():
     """管理员获取所有PGN列表"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -1414,17 +3976,17 @@ def get_admin_pgn_list():
                     pg.total_branches,
                     pg.total_games,
                     u.username as uploaded_by_username,
-                    COUNT(DISTINCT up.user_id) as users_count,
-                    SUM(COALESCE(up.total_attempts, 0)) as total_attempts
+                    COUNT(r.user_id) as users_count,
+                    SUM(COALESCE(r.total_attempts, 0)) as total_attempts
                 FROM pgn_games pg
                 LEFT JOIN users u ON pg.uploaded_by = u.id
-                LEFT JOIN user_progress up ON pg.id = up.pgn_game_id
+                LEFT JOIN progress_rollup r ON pg.id = r.pgn_game_id
+                WHERE pg.deleted_at IS NULL
                 GROUP BY pg.id, pg.filename, pg.upload_time, pg.file_size, pg.total_branches, pg.total_games, u.username
                 ORDER BY pg.upload_time DESC
             ''')
             
             rows = cursor.fetchall()
-            conn.close()
         
         result = []
         for row in rows:
@@ -1450,12 +4012,11 @@ def get_admin_pgn_list():
 def get_pgn_permissions(pgn_id):
     """获取PGN文件的权限设置"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 获取PGN基本信息
-            cursor.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_id,))
+            cursor.execute('SELECT filename FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
             pgn_info = cursor.fetchone()
             
             if not pgn_info:
@@ -1499,8 +4060,6 @@ def get_pgn_permissions(pgn_id):
                     'role': role,
                     'has_access': user_id in authorized_user_ids
                 })
-            
-            conn.close()
         
         return jsonify({
             'success': True,
@@ -1526,12 +4085,11 @@ def grant_pgn_permission(pgn_id):
         
         admin_id = session['user_id']
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 检查PGN是否存在
-            cursor.execute('SELECT id FROM pgn_games WHERE id = ?', (pgn_id,))
+            cursor.execute('SELECT id FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_id,))
             if not cursor.fetchone():
                 return jsonify({'error': 'PGN文件不存在'}), 404
             
@@ -1547,12 +4105,9 @@ def grant_pgn_permission(pgn_id):
             ''', (pgn_id, user_id, admin_id))
             
             if cursor.rowcount > 0:
-                conn.commit()
                 result = {'success': True, 'message': '权限授予成功'}
             else:
                 result = {'success': True, 'message': '用户已拥有访问权限'}
-            
-            conn.close()
         
         return jsonify(result)
         
@@ -1564,8 +4119,7 @@ def grant_pgn_permission(pgn_id):
 def revoke_pgn_permission(pgn_id, user_id):
     """撤销用户的PGN访问权限"""
     try:
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 删除权限记录
@@ -1575,22 +4129,148 @@ def revoke_pgn_permission(pgn_id, user_id):
             ''', (pgn_id, user_id))
             
             if cursor.rowcount > 0:
-                conn.commit()
                 result = {'success': True, 'message': '权限撤销成功'}
             else:
                 result = {'success': False, 'message': '权限记录不存在'}
-            
-            conn.close()
+        
+        # 缓存条目隐含访问权限，撤销后需要失效
+        progress_cache.invalidate(user_id, pgn_id)
         
         return jsonify(result)
         
     except Exception as e:
         return jsonify({'error': f'撤销权限失败: {str(e)}'}), 500
 
+@app.route('/api/admin/query-plans', methods=['GET'])
+@require_admin
+def get_query_plans():
+    """查看已记录查询的执行计划（需要以DB_EXPLAIN_QUERIES=1启动）"""
+    if query_plan_recorder is None:
+        return jsonify({'error': '未启用查询记录，请设置环境变量 DB_EXPLAIN_QUERIES=1 后重启服务'}), 400
+    
+    try:
+        with db_read() as conn:
+            plans = query_plan_recorder.report(conn)
+            schema_version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+        
+        return jsonify({
+            'success': True,
+            'schema_version': schema_version,
+            'total_queries': len(plans),
+            'full_scan_queries': sum(1 for plan in plans if plan['full_scans']),
+            'plans': plans
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'获取查询计划失败: {str(e)}'}), 500
+
+@app.route('/api/admin/db-stats', methods=['GET'])
+@require_admin
+def get_db_stats():
+    """查看本worker进程的连接池、写锁等待和学习日志缓冲统计"""
+    return jsonify({
+        'success': True,
+        'pid': os.getpid(),
+        'connections': dict(db_manager.stats),
+        'write_lock': write_metrics.snapshot(),
+        'group_commit': dict(group_committer.stats, window_ms=group_committer.window_ms),
+        'progress_cache': progress_cache.snapshot(),
+        'progress_sweeper': dict(progress_sweeper.stats),
+        'jobs': dict(job_runner.stats, workers=job_runner.workers),
+        'study_log_writer': dict(study_log_writer.stats,
+                                 pending=study_log_writer.pending(),
+                                 write_behind=study_log_writer.enabled)
+    })
+
+@app.route('/api/admin/jobs', methods=['GET'])
+@require_admin
+def list_jobs():
+    """管理员查看最近的后台任务，可按状态筛选"""
+    try:
+        status = request.args.get('status')
+        limit = min(int(request.args.get('limit', 50)), 500)
+        
+        if status and status not in JOB_STATUSES:
+            return jsonify({'error': f'无效的任务状态，可选值: {", ".join(JOB_STATUSES)}'}), 400
+        
+        with db_read() as conn:
+            if status:
+                rows = conn.execute(f'''
+                    SELECT {JOB_COLUMNS} FROM background_jobs
+                    WHERE status = ? ORDER BY id DESC LIMIT ?
+                ''', (status, limit)).fetchall()
+            else:
+                rows = conn.execute(f'''
+                    SELECT {JOB_COLUMNS} FROM background_jobs
+                    ORDER BY id DESC LIMIT ?
+                ''', (limit,)).fetchall()
+        
+        return jsonify({'success': True, 'jobs': [job_to_dict(row) for row in rows]})
+        
+    except Exception as e:
+        return jsonify({'error': f'获取任务列表失败: {str(e)}'}), 500
+
+@app.route('/api/admin/jobs/<int:job_id>', methods=['GET'])
+@require_admin
+def get_job(job_id):
+    """管理员查看后台任务的状态和进度"""
+    try:
+        with db_read() as conn:
+            row = conn.execute(f'SELECT {JOB_COLUMNS} FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+        
+        if not row:
+            return jsonify({'error': '任务不存在'}), 404
+        
+        return jsonify({'success': True, 'job': job_to_dict(row)})
+        
+    except Exception as e:
+        return jsonify({'error': f'获取任务状态失败: {str(e)}'}), 500
+
+@app.route('/api/admin/jobs/<int:job_id>/cancel', methods=['POST'])
+@require_admin
+def cancel_job_api(job_id):
+    """管理员取消后台任务：未开始的任务直接取消，运行中的任务在当前分块完成后停止"""
+    try:
+        with db_write() as conn:
+            status = cancel_job(conn, job_id)
+            if status is None:
+                return jsonify({'error': '任务不存在'}), 404
+            if status in ('completed', 'failed'):
+                return jsonify({'error': f'任务已结束（{status}），无法取消'}), 409
+            row = conn.execute(f'SELECT {JOB_COLUMNS} FROM background_jobs WHERE id = ?', (job_id,)).fetchone()
+        
+        return jsonify({
+            'success': True,
+            'job': job_to_dict(row),
+            'message': '任务已取消' if status == 'cancelled' else '已请求取消，任务将在当前分块完成后停止'
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'取消任务失败: {str(e)}'}), 500
+
+@app.route('/api/admin/study-logs/compact', methods=['POST'])
+@require_admin
+def compact_study_logs_api():
+    """管理员立即压缩超过保留期的学习日志，可选retention_days覆盖默认保留天数，返回后台任务ID"""
+    try:
+        data = request.get_json(silent=True) or {}
+        retention_days = data.get('retention_days', STUDY_LOG_RETENTION_DAYS)
+        if not isinstance(retention_days, int) or isinstance(retention_days, bool) or retention_days < 0:
+            return jsonify({'error': 'retention_days必须是非负整数'}), 400
+        
+        study_log_writer.flush()
+        with db_write() as conn:
+            job_id = enqueue_study_log_compaction(conn, retention_days, session.get('user_id'))
+        job_runner.wake()
+        
+        return jsonify({'success': True, 'job_id': job_id, 'message': '已创建学习日志压缩任务'})
+        
+    except Exception as e:
+        return jsonify({'error': f'创建压缩任务失败: {str(e)}'}), 500
+
 def save_pgn_to_db(filename: str, original_content: str, parsed_data: dict, file_size: int):
     """保存PGN数据到数据库"""
-    with db_lock:
-        conn = sqlite3.connect(DATABASE_PATH)
+    with db_write() as conn:
         cursor = conn.cursor()
         
         # 获取上传用户ID
@@ -1605,30 +4285,27 @@ def save_pgn_to_db(filename: str, original_content: str, parsed_data: dict, file
             json.dumps(parsed_data, ensure_ascii=False),
             file_size,
             parsed_data.get('total_branches', 0),
-            len(parsed_data.get('games', [])),
+            parsed_data.get('total_games', 0),
             uploaded_by
         ))
         
         game_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
         return game_id
 
 def get_latest_pgn():
     """获取最新的PGN数据"""
-    with db_lock:
-        conn = sqlite3.connect(DATABASE_PATH)
+    with db_read() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT id, filename, parsed_data, upload_time, file_size, total_branches, total_games
             FROM pgn_games 
+            WHERE deleted_at IS NULL
             ORDER BY upload_time DESC 
             LIMIT 1
         ''')
         
         row = cursor.fetchone()
-        conn.close()
         
         if row:
             return {
@@ -1644,19 +4321,18 @@ def get_latest_pgn():
 
 def get_pgn_list(limit: int = 10):
     """获取PGN历史列表"""
-    with db_lock:
-        conn = sqlite3.connect(DATABASE_PATH)
+    with db_read() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
             SELECT id, filename, upload_time, file_size, total_branches, total_games
             FROM pgn_games 
+            WHERE deleted_at IS NULL
             ORDER BY upload_time DESC 
             LIMIT ?
         ''', (limit,))
         
         rows = cursor.fetchall()
-        conn.close()
         
         return [{
             'id': row[0],
@@ -1670,86 +4346,202 @@ def get_pgn_list(limit: int = 10):
 # 初始化数据库
 init_database()
 
-class PGNNode:
-    """表示PGN棋谱树中的一个节点"""
-    def __init__(self, move: str = None, fen: str = None, move_number: int = 0, is_white: bool = True):
-        self.move = move  # 移动记录（SAN格式）
-        self.fen = fen    # 该位置的FEN字符串
-        self.move_number = move_number  # 回合数
-        self.is_white = is_white  # 是否是白方移动
-        self.children = []  # 子节点列表
-        self.parent = None  # 父节点
-        self.id = None  # 节点ID
-
-    def add_child(self, child):
-        """添加子节点"""
-        child.parent = self
-        self.children.append(child)
-        return child
-
-    def to_dict(self) -> Dict[str, Any]:
-        """转换为字典格式用于JSON序列化"""
-        return {
-            'id': self.id,
-            'move': self.move,
-            'fen': self.fen,
-            'move_number': self.move_number,
-            'is_white': self.is_white,
-            'children': [child.to_dict() for child in self.children]
-        }
+# 走法树模式：tree每个走法序列一个节点；dag按局面（Zobrist哈希和步数）合并节点，
+# 不同走法次序到达已有局面时只记一条转换边，后续走法都挂在先出现的节点下
+PGN_TREE_MODES = ('tree', 'dag')
+PGN_TREE_MODE = os.environ.get('PGN_TREE_MODE', 'tree')
+
+def _encode_move(move: chess.Move) -> int:
+    """把走法压成16位整数：起点6位、终点6位、升变棋子类型3位（空着编码为0）"""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def _decode_move(code: int) -> chess.Move:
+    """_encode_move的逆运算"""
+    return chess.Move(code & 0x3F, (code >> 6) & 0x3F, (code >> 12) or None)
+
+class PGNTree:
+    """PGN走法树，节点按整数下标存放在平行数组里
+
+    节点i的走法编码在codes[i]（见_encode_move），第一个子节点和下一个兄弟节点的下标在
+    first_child[i]、next_sibling[i]（-1表示没有）。根节点下标为0，输出的节点ID为node_<下标+1>。
+    SAN、回合数和执子方由PGNParser序列化时从根开始重放走法得到，FEN不计算，不常驻内存。
+    DAG模式的转换边记在transpositions里：边节点下标 -> 已有的同一局面节点下标，边节点没有子节点。
+    """
+
+    def __init__(self):
+        self.codes = array.array('H', [0])
+        self.first_child = array.array('i', [-1])
+        self.next_sibling = array.array('i', [-1])
+        self.transpositions = {}
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def children(self, node: int) -> List[int]:
+        """node的子节点下标，按加入顺序"""
+        result = []
+        child = self.first_child[node]
+        while child != -1:
+            result.append(child)
+            child = self.next_sibling[child]
+        return result
+
+    def get_or_add_child(self, parent: int, code: int):
+        """返回(parent下走法编码为code的子节点, 是否新建)，新节点加在最后一个子节点之后"""
+        child = self.first_child[parent]
+        last = -1
+        while child != -1:
+            if self.codes[child] == code:
+                return child, False
+            last = child
+            child = self.next_sibling[child]
+        
+        child = len(self.codes)
+        self.codes.append(code)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        if last == -1:
+            self.first_child[parent] = child
+        else:
+            self.next_sibling[last] = child
+        return child, True
+
+
+class PGNTreeBuilder(chess.pgn.BaseVisitor):
+    """chess.pgn.read_game的访问器：边读边把一局的走法合并到PGNParser的走法树
+
+    单遍构建，不生成中间的GameNode树，也不递归。visit_move在当前节点下取或建子节点；
+    变体开始时把(上一节点, 当前节点)压栈并回到上一节点，变体结束时出栈恢复。
+    棋盘由read_game维护，合并时只用到走法本身（DAG模式新建节点时临时push/pop取局面哈希）。
+    """
+
+    def __init__(self, parser: 'PGNParser'):
+        self.parser = parser
+        self.headers = {}
+        self.moves = 0  # 合并的走法数
+        self.skipped = None  # 整局被跳过的原因
+        self.errors = []  # read_game报告的错误（非法走法等），出错的变体其余部分被跳过
+        self.previous = None  # 节点下标
+        self.current = 0
+        self.stack = []
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        self.headers[tagname] = tagvalue
+
+    def end_headers(self):
+        if self.headers.get('FEN', chess.STARTING_FEN) != chess.STARTING_FEN:
+            self.skipped = '不支持从自定义局面开始的对局（FEN标签），已跳过'
+            return chess.pgn.SKIP
+        return None
+
+    def begin_variation(self):
+        # 变体是上一步的替代走法，从上一步之前的节点继续
+        self.stack.append((self.previous, self.current))
+        self.current = self.previous
+        return None
+
+    def end_variation(self):
+        self.previous, self.current = self.stack.pop()
+
+    def visit_move(self, board: chess.Board, move: chess.Move):
+        child = self.parser._get_or_add_child(self.current, move, board)
+        self.previous, self.current = self.current, child
+        self.moves += 1
+
+    def handle_error(self, error: Exception):
+        self.errors.append(error)
+
+    def result(self) -> 'PGNTreeBuilder':
+        return self
 
 class PGNParser:
     """PGN棋谱解析器"""
     
-    def __init__(self):
-        self.root_node = None
-        self.node_counter = 0
+    MAX_REPORTED_ERRORS = 100  # 最多返回多少条逐局错误，其余只计数
+    
+    def __init__(self, dag: bool = False):
+        self.tree = None
+        self.dag = dag  # 是否按局面合并转换（见PGN_TREE_MODE）
+        self.positions = {}  # DAG模式：(Zobrist哈希, 步数) -> 节点下标
     
     def parse_pgn_content(self, pgn_content: str) -> Dict[str, Any]:
-        """解析PGN内容并返回树状结构"""
+        """解析PGN内容并返回树状结构
+
+        文件可以包含多局对局：逐局读取并合并到同一棵走法树（相同前缀共用节点），
+        PGNTreeBuilder边读边合并，不生成对局对象，内存只随合并后的树增长。单局出错时记录到
+        game_errors并继续，含非法走法的对局保留出错前的走法。
+
+        DAG模式下到达已有局面的走法变成转换边（transposition_to指向已有节点），
+        对应的分支在转换处结束，局面之后的走法由经过已有节点的分支覆盖。
+        """
         try:
-            # 创建根节点（初始位置）
-            self.root_node = PGNNode(
-                move=None,
-                fen=chess.STARTING_FEN,
-                move_number=0,
-                is_white=True
-            )
-            self.root_node.id = self._get_next_id()
+            # 创建只有根节点（初始位置）的树，局面表与树一起重建，同一个解析器可以多次解析
+            self.tree = PGNTree()
+            self.positions = {}
+            if self.dag:
+                self.positions[(chess.polyglot.zobrist_hash(chess.Board()), 0)] = 0
             
             # 预处理PGN内容，检查基本格式
             if not pgn_content.strip():
                 return {'error': '文件内容为空'}
             
-            # 解析PGN
+            # 逐局解析PGN
             pgn_io = io.StringIO(pgn_content)
-            game = chess.pgn.read_game(pgn_io)
-            
-            if game is None:
+            games_read = 0
+            total_games = 0
+            game_errors = []
+            failed_games = 0
+            while True:
+                merged = self._merge_next_game(pgn_io)
+                if merged is None:
+                    break
+                games_read += 1
+                
+                headers, error = merged
+                if error is None:
+                    total_games += 1
+                    continue
+                
+                imported, message = error
+                total_games += imported
+                failed_games += 1
+                if len(game_errors) < self.MAX_REPORTED_ERRORS:
+                    game_errors.append({
+                        'game': games_read,
+                        'white': headers.get('White', '?'),
+                        'black': headers.get('Black', '?'),
+                        'event': headers.get('Event', '?'),
+                        'imported': bool(imported),
+                        'error': message
+                    })
+            
+            if games_read == 0:
                 return {
                     'error': '无法解析PGN格式',
                     'details': '文件内容不符合标准PGN格式。PGN文件应该包含游戏信息标签（如[Event]、[Date]等）和移动记录。'
                 }
             
             # 检查是否有移动记录
-            if not game.variations:
+            if total_games == 0:
                 return {
                     'error': '没有找到移动记录',
-                    'details': 'PGN文件中没有包含任何象棋移动记录。'
+                    'details': game_errors[0]['error'] if game_errors else 'PGN文件中没有包含任何象棋移动记录。'
                 }
             
-            # 使用新的解析方法
-            board = chess.Board()
-            self._parse_node_recursive(game, self.root_node, board)
-            
-            # 提取所有分支路径
-            branches = self._extract_branches()
+            # 生成按列存放的走法树并提取所有分支
+            tree, branches = self._serialize_tree()
             
             return {
                 'success': True,
-                'tree': self.root_node.to_dict(),
+                'tree': tree,
                 'branches': branches,
-                'total_branches': len(branches)
+                'total_branches': len(branches),
+                'total_games': total_games,
+                'failed_games': failed_games,
+                'game_errors': game_errors,
+                'tree_mode': 'dag' if self.dag else 'tree',
+                'total_nodes': len(self.tree),
+                'transpositions': len(self.tree.transpositions)
             }
             
         except chess.InvalidMoveError as e:
@@ -1780,101 +4572,102 @@ class PGNParser:
                     'details': str(e)
                 }
     
-    def _get_next_id(self) -> str:
-        """生成下一个节点ID"""
-        self.node_counter += 1
-        return f"node_{self.node_counter}"
+    def _merge_next_game(self, pgn_io):
+        """读取下一局并合并到走法树，文件读完返回None
+
+        否则返回(标签, 错误)：成功时错误为None，否则为(是否导入了走法, 错误说明)。
+        """
+        builder = PGNTreeBuilder(self)
+        try:
+            if chess.pgn.read_game(pgn_io, Visitor=lambda: builder) is None:
+                return None
+        except Exception as e:
+            return builder.headers, (builder.moves > 0, str(e))
+        
+        if builder.skipped:
+            return builder.headers, (False, builder.skipped)
+        if not builder.moves:
+            return builder.headers, (False, '该对局没有移动记录，已跳过')
+        if builder.errors:
+            # python-chess遇到非法走法时停止解析该变体，之前的走法已合并
+            return builder.headers, (True, f'包含非法的移动记录，已导入出错前的走法: {builder.errors[0]}')
+        return builder.headers, None
     
-    def _parse_node_recursive(self, pgn_node: chess.pgn.GameNode, tree_node: PGNNode, board: chess.Board):
-        """递归解析PGN节点"""
-        # 处理主线
-        current_pgn = pgn_node
-        current_tree = tree_node
-        
-        while current_pgn.variations:
-            # 获取主变体（第一个变体）
-            main_variation = current_pgn.variations[0]
-            
-            if main_variation.move is not None:
-                try:
-                    # 获取SAN格式
-                    san_move = board.san(main_variation.move)
-                    # 执行移动
-                    board.push(main_variation.move)
-                    
-                    # 创建树节点
-                    move_number = (board.ply() + 1) // 2
-                    is_white = board.ply() % 2 == 1
-                    
-                    new_tree_node = PGNNode(
-                        move=san_move,
-                        fen=board.fen(),
-                        move_number=move_number,
-                        is_white=is_white
-                    )
-                    new_tree_node.id = self._get_next_id()
-                    current_tree.add_child(new_tree_node)
-                    
-                    # 处理其他变体（从第二个开始）
-                    for i in range(1, len(current_pgn.variations)):
-                        variation = current_pgn.variations[i]
-                        if variation.move is not None:
-                            # 对于变体，使用执行移动前的棋盘状态
-                            board.pop()  # 撤销主变体移动
-                            var_san = board.san(variation.move)
-                            board.push(variation.move)  # 执行变体移动
-                            
-                            # 创建变体节点
-                            var_move_number = (board.ply() + 1) // 2
-                            var_is_white = board.ply() % 2 == 1
-                            
-                            var_tree_node = PGNNode(
-                                move=var_san,
-                                fen=board.fen(),
-                                move_number=var_move_number,
-                                is_white=var_is_white
-                            )
-                            var_tree_node.id = self._get_next_id()
-                            current_tree.add_child(var_tree_node)
-                            
-                            # 递归处理变体的后续
-                            if variation.variations:
-                                self._parse_node_recursive(variation, var_tree_node, board.copy())
-                            
-                            board.pop()  # 撤销变体移动
-                            board.push(main_variation.move)  # 重新执行主变体移动
-                    
-                    # 继续主线
-                    current_pgn = main_variation
-                    current_tree = new_tree_node
-                    
-                except Exception as e:
-                    raise Exception(f"解析移动 {main_variation.move} 失败: {str(e)}")
-            else:
-                break
+    def _get_or_add_child(self, parent: int, move: chess.Move, board: chess.Board) -> int:
+        """返回parent下走法为move的子节点，没有则新建（多局合并时共享相同前缀），board是走子前的局面
+
+        DAG模式下走子后的局面已有节点时，新节点只作为转换边，返回已有节点，
+        后续走法合并到已有节点下。局面键包含步数，边总是从第n步指向第n+1步，不会成环。
+        """
+        child, created = self.tree.get_or_add_child(parent, _encode_move(move))
+        if not self.dag:
+            return child
+        if not created:
+            return self.tree.transpositions.get(child, child)
+        
+        board.push(move)
+        key = (chess.polyglot.zobrist_hash(board), board.ply())
+        board.pop()
+        target = self.positions.setdefault(key, child)
+        if target != child:
+            self.tree.transpositions[child] = target
+        return target
     
-    def _extract_branches(self) -> List[Dict[str, Any]]:
-        """提取所有分支路径"""
+    def _serialize_tree(self):
+        """先序遍历走法树，返回(按列存放的走法树, 所有根到叶子的分支)
+
+        走法树不嵌套：moves[i]、parents[i]是节点node_<i+1>的SAN和父节点下标（根为-1），
+        transpositions为边节点ID -> 已有节点ID。兄弟节点按下标升序排列，回合数和执子方由深度得到，
+        FEN不存，只在前端用chess.js沿路径重放得到。存库和返回JSON时不受嵌套深度限制。
+        用一个棋盘沿遍历顺序重放走法得到SAN；显式栈，不受递归深度限制。
+        分支只记叶子节点ID和深度（走法数），走法列表由前端沿父节点下标按需还原（js/api.js的materializeBranches）。
+        """
+        tree = self.tree
+        board = chess.Board()
+        moves = [None] * len(tree)
+        parents = [-1] * len(tree)
         branches = []
-        self._extract_paths(self.root_node, [], branches)
-        return branches
-    
-    def _extract_paths(self, node: PGNNode, current_path: List[str], branches: List[Dict[str, Any]]):
-        """递归提取路径"""
-        # 如果当前节点有移动，添加到路径中
-        if node.move:
-            current_path.append(node.move)
-        
-        # 如果是叶子节点且路径不为空，添加分支
-        if not node.children and current_path:
-            branches.append({
-                'id': f'branch_{len(branches) + 1}',
-                'moves': current_path.copy()
-            })
-        
-        # 递归处理子节点
-        for child in node.children:
-            self._extract_paths(child, current_path.copy(), branches)
+        # 逆序入栈，保证子节点按原顺序出栈；ply是子节点的步数
+        stack = [(child, 0, 1) for child in reversed(tree.children(0))]
+        while stack:
+            node, parent, ply = stack.pop()
+            # 回到父节点的局面
+            while len(board.move_stack) >= ply:
+                board.pop()
+            move = _decode_move(tree.codes[node])
+            moves[node] = board.san(move)
+            board.push(move)
+            parents[node] = parent
+            
+            target = tree.transpositions.get(node)
+            children = tree.children(node)
+            if not children:
+                # 叶子节点是一个分支（转换边的分支记下转换到的节点）
+                branch = {
+                    'id': f'branch_{len(branches) + 1}',
+                    'leaf': f'node_{node + 1}',
+                    'depth': ply
+                }
+                if target is not None:
+                    branch['transposition_to'] = f'node_{target + 1}'
+                branches.append(branch)
+            else:
+                for child in reversed(children):
+                    stack.append((child, node, ply + 1))
+        return {
+            'moves': moves,
+            'parents': parents,
+            'transpositions': {f'node_{edge + 1}': f'node_{target + 1}'
+                               for edge, target in sorted(tree.transpositions.items())}
+        }, branches
+
+def tree_children(tree: Dict[str, Any]) -> List[List[int]]:
+    """按列存放的走法树中每个节点的子节点下标列表，按原顺序"""
+    children = [[] for _ in tree['parents']]
+    for node, parent in enumerate(tree['parents']):
+        if parent >= 0:
+            children[parent].append(node)
+    return children
 
 @app.route('/')
 def index():
@@ -1907,13 +4700,16 @@ def parse_pgn():
         # 检查是否强制覆盖
         force_overwrite = request.form.get('force_overwrite', 'false').lower() == 'true'
         
+        # 走法树模式，未指定时使用配置的默认值
+        tree_mode = request.form.get('tree_mode', PGN_TREE_MODE)
+        if tree_mode not in PGN_TREE_MODES:
+            return jsonify({'error': f'无效的走法树模式: {tree_mode}'}), 400
+        
         # 检查是否存在同名文件
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT id, filename FROM pgn_games WHERE filename = ?', (file.filename,))
+            cursor.execute('SELECT id, filename FROM pgn_games WHERE filename = ? AND deleted_at IS NULL', (file.filename,))
             existing_pgn = cursor.fetchone()
-            conn.close()
         
         current_user = get_current_user()
         
@@ -1971,7 +4767,7 @@ def parse_pgn():
         likely_pgn = any(indicator in content for indicator in pgn_indicators)
         
         # 解析PGN
-        parser = PGNParser()
+        parser = PGNParser(dag=tree_mode == 'dag')
         result = parser.parse_pgn_content(content)
         
         if 'error' in result:
@@ -2002,23 +4798,14 @@ def parse_pgn():
         
         # 如果是覆盖操作，先删除原有数据
         if existing_pgn and force_overwrite:
-            with db_lock:
-                conn = sqlite3.connect(DATABASE_PATH)
-                cursor = conn.cursor()
-                
-                # 删除所有用户的进度记录
-                cursor.execute('DELETE FROM user_progress WHERE pgn_game_id = ?', (existing_pgn[0],))
-                
-                # 删除所有用户的学习日志
-                cursor.execute('DELETE FROM user_study_logs WHERE pgn_game_id = ?', (existing_pgn[0],))
-                
-                # 删除原有PGN记录
-                cursor.execute('DELETE FROM pgn_games WHERE id = ?', (existing_pgn[0],))
-                
-                conn.commit()
-                conn.close()
+            with db_write() as conn:
+                # 删除原有PGN记录，原有进度和学习日志由后台任务分块清理
+                purge_job_id = remove_pgn(conn, existing_pgn[0], session.get('user_id'))
                 
-                print(f"覆盖操作：已删除原有PGN '{file.filename}' (ID: {existing_pgn[0]}) 及相关数据")
+                print(f"覆盖操作：已删除原有PGN '{file.filename}' (ID: {existing_pgn[0]})，清理任务 #{purge_job_id}")
+            
+            job_runner.wake()
+            progress_cache.invalidate(pgn_id=existing_pgn[0])
         
         # 保存到数据库
         try:
@@ -2038,6 +4825,7 @@ def parse_pgn():
             
             if existing_pgn and force_overwrite:
                 result['overwritten'] = True
+                result['purge_job_id'] = purge_job_id
                 result['message'] = f"成功覆盖PGN文件 {file.filename}，所有用户的学习进度已重置"
                 print(f"成功覆盖保存PGN到数据库，新ID: {game_id}, 文件名: {file.filename}")
             else:
@@ -2071,7 +4859,7 @@ def test_tree():
             content = f.read()
         
         # 解析PGN
-        parser = PGNParser()
+        parser = PGNParser(dag=PGN_TREE_MODE == 'dag')
         result = parser.parse_pgn_content(content)
         
         if 'error' in result:
@@ -2091,56 +4879,77 @@ def test_tree():
     except Exception as e:
         return jsonify({'error': f'测试错误: {str(e)}'}), 500
 
-def generate_tree_html(tree_node: Dict[str, Any], level: int = 0) -> str:
-    """生成树状结构的HTML"""
-    html = '<div class="tree-container horizontal">'
-    html += _generate_node_html(tree_node, level)
-    html += '</div>'
-    return html
-
-def _generate_node_html(node: Dict[str, Any], level: int) -> str:
-    """递归生成节点HTML"""
-    indent = '  ' * level
-    move_text = node['move'] if node['move'] else '起始位置'
-    
-    # 节点样式
-    node_class = 'white-move' if node['is_white'] else 'black-move'
-    if node['move'] is None:
-        node_class = 'root-node'
-    
-    has_children = bool(node['children'])
-    expand_button = ''
-    if has_children:
-        expand_button = '<span class="expand-button expanded">-</span>'
-    
-    html = f'{indent}<div class="tree-node {node_class}" data-level="{level}">\n'
-    html += f'{indent}  <div class="node-wrapper">\n'
-    html += f'{indent}    <div class="node-content">\n'
-    html += f'{indent}      <span class="move-number">{node["move_number"]}.</span>\n'
-    html += f'{indent}      <span class="move-text">{move_text}</span>\n'
-    html += f'{indent}      {expand_button}\n'
-    html += f'{indent}    </div>\n'
-    html += f'{indent}  </div>\n'
-    
-    # 处理子节点
-    if has_children:
-        html += f'{indent}  <div class="children-container expanded">\n'
-        for child in node['children']:
-            html += _generate_node_html(child, level + 1)
-        html += f'{indent}  </div>\n'
-    
-    html += f'{indent}</div>\n'
-    return html
+def generate_tree_html(tree: Dict[str, Any]) -> str:
+    """生成树状结构的HTML（按列存放的走法树，见PGNParser._serialize_tree）
+
+    显式栈先序生成，不受递归深度限制；节点不按层级缩进，避免很深的走法行让HTML按深度平方增长。
+    """
+    moves = tree['moves']
+    children = tree_children(tree)
+    transpositions = tree.get('transpositions', {})
+    parts = ['<div class="tree-container horizontal">']
+    # 栈里是(节点下标, 步数)，或者要在子节点之后输出的结束标签
+    stack = [(0, 0)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        node, ply = item
+        node_id = f'node_{node + 1}'
+        move_text = moves[node] if moves[node] else '起始位置'
+        
+        # 节点样式
+        node_class = 'white-move' if ply % 2 == 1 else 'black-move'
+        if moves[node] is None:
+            node_class = 'root-node'
+        
+        has_children = bool(children[node])
+        expand_button = ''
+        if has_children:
+            expand_button = '<span class="expand-button expanded">-</span>'
+        
+        # DAG模式的转换边：标出转换到的节点，后续走法在那个节点下展开
+        transposition = transpositions.get(node_id)
+        if transposition:
+            node_class += ' transposition'
+            expand_button = f'<span class="transposition-link" data-target="{transposition}" title="转换到已有局面">⇄</span>'
+        
+        html = f'<div class="tree-node {node_class}" data-level="{ply}" data-node-id="{node_id}">\n'
+        html += '  <div class="node-wrapper">\n'
+        html += '    <div class="node-content">\n'
+        html += f'      <span class="move-number">{(ply + 1) // 2}.</span>\n'
+        html += f'      <span class="move-text">{move_text}</span>\n'
+        html += f'      {expand_button}\n'
+        html += '    </div>\n'
+        html += '  </div>\n'
+        parts.append(html)
+        
+        # 处理子节点
+        if has_children:
+            parts.append('  <div class="children-container expanded">\n')
+            stack.append('  </div>\n</div>\n')
+            for child in reversed(children[node]):
+                stack.append((child, ply + 1))
+        else:
+            parts.append('</div>\n')
+    parts.append('</div>')
+    return ''.join(parts)
 
 @app.route('/api/latest-pgn', methods=['GET'])
 @require_login
 def get_latest_pgn_api():
-    """获取最新上传的PGN数据（需要权限检查）"""
+    """获取最新上传的PGN数据（需要权限检查，支持If-None-Match条件请求）"""
     try:
         user_id = session['user_id']
-        
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        # 可见范围取决于用户的授权和角色，内容取决于PGN目录
+        user_version, catalog_version = get_resource_versions(('user', user_id), ('catalog', 0))
+        etag = f'latest-pgn-{user_id}-{user_version}-{catalog_version}'
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 检查用户是否是管理员
@@ -2153,6 +4962,7 @@ def get_latest_pgn_api():
                 cursor.execute('''
                     SELECT id, filename, parsed_data, upload_time, file_size, total_branches, total_games
                     FROM pgn_games 
+                    WHERE deleted_at IS NULL
                     ORDER BY upload_time DESC 
                     LIMIT 1
                 ''')
@@ -2162,13 +4972,12 @@ def get_latest_pgn_api():
                     SELECT g.id, g.filename, g.parsed_data, g.upload_time, g.file_size, g.total_branches, g.total_games
                     FROM pgn_games g
                     JOIN pgn_permissions p ON g.id = p.pgn_id
-                    WHERE p.user_id = ?
+                    WHERE p.user_id = ? AND g.deleted_at IS NULL
                     ORDER BY g.upload_time DESC 
                     LIMIT 1
                 ''', (user_id,))
             
             row = cursor.fetchone()
-            conn.close()
         
         if row is None:
             return jsonify({
@@ -2198,7 +5007,7 @@ def get_latest_pgn_api():
         }
         
         print(f"返回最新PGN数据: {latest_pgn['filename']}, 分支数: {latest_pgn['total_branches']}")
-        return jsonify(response_data)
+        return with_etag(jsonify(response_data), etag)
         
     except Exception as e:
         print(f"获取最新PGN数据失败: {str(e)}")
@@ -2215,8 +5024,7 @@ def get_pgn_list_api():
         limit = request.args.get('limit', 10, type=int)
         user_id = session['user_id']
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_read() as conn:
             cursor = conn.cursor()
             
             # 检查用户是否是管理员
@@ -2229,6 +5037,7 @@ def get_pgn_list_api():
                 cursor.execute('''
                     SELECT id, filename, upload_time, file_size, total_branches, total_games, uploaded_by
                     FROM pgn_games 
+                    WHERE deleted_at IS NULL
                     ORDER BY upload_time DESC 
                     LIMIT ?
                 ''', (limit,))
@@ -2239,13 +5048,12 @@ def get_pgn_list_api():
                            g.total_branches, g.total_games, g.uploaded_by
                     FROM pgn_games g
                     JOIN pgn_permissions p ON g.id = p.pgn_id
-                    WHERE p.user_id = ?
+                    WHERE p.user_id = ? AND g.deleted_at IS NULL
                     ORDER BY g.upload_time DESC 
                     LIMIT ?
                 ''', (user_id, limit))
             
             rows = cursor.fetchall()
-            conn.close()
         
         pgn_list = []
         for row in rows:
@@ -2274,7 +5082,7 @@ def get_pgn_list_api():
 @app.route('/api/pgn/<int:pgn_id>', methods=['GET'])
 @require_login
 def get_pgn_by_id(pgn_id):
-    """根据ID获取PGN数据（需要权限检查）"""
+    """根据ID获取PGN数据（需要权限检查，支持If-None-Match条件请求）"""
     try:
         user_id = session['user_id']
         
@@ -2285,18 +5093,23 @@ def get_pgn_by_id(pgn_id):
                 'error': '您没有权限访问此PGN文件'
             }), 403
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        # 内容与请求的用户无关，有权限的用户共用同一个ETag
+        pgn_version, = get_resource_versions(('pgn', pgn_id))
+        etag = f'pgn-{pgn_id}-{pgn_version}'
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        with db_read() as conn:
             cursor = conn.cursor()
             
             cursor.execute('''
                 SELECT id, filename, original_content, parsed_data, upload_time, file_size
                 FROM pgn_games 
-                WHERE id = ?
+                WHERE id = ? AND deleted_at IS NULL
             ''', (pgn_id,))
             
             row = cursor.fetchone()
-            conn.close()
             
             if not row:
                 return jsonify({
@@ -2318,7 +5131,7 @@ def get_pgn_by_id(pgn_id):
                 'total_games': parsed_data.get('total_games', 0)
             }
             
-            return jsonify(response_data)
+            return with_etag(jsonify(response_data), etag)
             
     except Exception as e:
         print(f"获取PGN数据失败: {str(e)}")
@@ -2354,6 +5167,150 @@ def internal_error(error):
         'message': '请联系管理员或查看服务器日志'
     }), 500
 
+BRANCH_STATE_MODES = ('memory_learning',)
+BRANCH_STATE_STATUSES = ('completed', 'paused')
+BRANCH_STATE_BULK_MAX_SIZE = 5000  # 单次批量保存的最大分支数
+
+BRANCH_STATE_UPSERT_SQL = '''
+    INSERT INTO user_branch_states (user_id, pgn_game_id, mode, branch_id, status)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, pgn_game_id, mode, branch_id) DO UPDATE SET
+        status = excluded.status,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+def save_branch_states(conn, user_id: int, pgn_game_id: int, mode: str,
+                       states: Dict[str, Optional[str]], replace: bool = False):
+    """在当前写事务中保存分支状态：状态为None的分支被删除，replace时先清空该PGN该模式下的其他分支"""
+    if replace:
+        conn.execute('''
+            DELETE FROM user_branch_states
+            WHERE user_id = ? AND pgn_game_id = ? AND mode = ?
+        ''', (user_id, pgn_game_id, mode))
+    conn.executemany(BRANCH_STATE_UPSERT_SQL, [
+        (user_id, pgn_game_id, mode, branch_id, status)
+        for branch_id, status in states.items() if status is not None
+    ])
+    if not replace:
+        conn.executemany('''
+            DELETE FROM user_branch_states
+            WHERE user_id = ? AND pgn_game_id = ? AND mode = ? AND branch_id = ?
+        ''', [(user_id, pgn_game_id, mode, branch_id) for branch_id, status in states.items() if status is None])
+
+def clear_branch_states(conn, pgn_game_id: int, user_id: Optional[int] = None, mode: Optional[str] = None) -> int:
+    """在当前写事务中按PGN（及用户、模式）一次性删除分支状态，返回删除条数"""
+    sql = 'DELETE FROM user_branch_states WHERE pgn_game_id = ?'
+    params = [pgn_game_id]
+    if user_id is not None:
+        sql += ' AND user_id = ?'
+        params.append(user_id)
+    if mode is not None:
+        sql += ' AND mode = ?'
+        params.append(mode)
+    return conn.execute(sql, params).rowcount
+
+@app.route('/api/progress/branch-state', methods=['POST'])
+@require_login
+def save_branch_state():
+    """保存单个分支的记忆学习状态"""
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        pgn_game_id = data.get('pgn_game_id')
+        branch_id = data.get('branch_id')
+        status = data.get('status')
+        mode = data.get('mode', 'memory_learning')
+        
+        if not pgn_game_id or not branch_id:
+            return jsonify({'error': 'PGN游戏ID和分支ID不能为空'}), 400
+        
+        if mode not in BRANCH_STATE_MODES:
+            return jsonify({'error': '学习模式无效'}), 400
+        
+        if status is not None and status not in BRANCH_STATE_STATUSES:
+            return jsonify({'error': '分支状态无效'}), 400
+        
+        if not check_pgn_permission(user_id, pgn_game_id):
+            return jsonify({'error': '您没有权限访问此PGN文件'}), 403
+        
+        with db_write() as conn:
+            save_branch_states(conn, user_id, int(pgn_game_id), mode, {branch_id: status})
+        
+        return jsonify({'success': True, 'message': '分支状态保存成功'})
+        
+    except Exception as e:
+        return jsonify({'error': f'保存分支状态失败: {str(e)}'}), 500
+
+@app.route('/api/progress/branch-states/<int:pgn_id>', methods=['GET'])
+@require_login
+def get_branch_states(pgn_id):
+    """一次获取某个PGN下所有分支的学习状态"""
+    try:
+        user_id = session['user_id']
+        mode = request.args.get('mode', 'memory_learning')
+        
+        if mode not in BRANCH_STATE_MODES:
+            return jsonify({'error': '学习模式无效'}), 400
+        
+        if not check_pgn_permission(user_id, pgn_id):
+            return jsonify({'error': '您没有权限访问此PGN文件'}), 403
+        
+        with db_read() as conn:
+            rows = conn.execute('''
+                SELECT branch_id, status, updated_at
+                FROM user_branch_states
+                WHERE user_id = ? AND pgn_game_id = ? AND mode = ?
+            ''', (user_id, pgn_id, mode)).fetchall()
+        
+        states = {
+            branch_id: {'status': status, 'updated_at': updated_at, 'mode': mode}
+            for branch_id, status, updated_at in rows
+        }
+        
+        return jsonify({'success': True, 'pgn_game_id': pgn_id, 'mode': mode, 'states': states})
+        
+    except Exception as e:
+        return jsonify({'error': f'获取分支状态失败: {str(e)}'}), 500
+
+@app.route('/api/progress/branch-states/<int:pgn_id>', methods=['PUT'])
+@require_login
+def put_branch_states(pgn_id):
+    """在一个事务中批量保存某个PGN的分支状态
+
+    请求体: {"mode": "memory_learning", "states": {"branch_1": "completed", "branch_2": null}, "replace": false}
+    状态为null的分支会被删除；replace为true时先清空该PGN下的全部分支状态再写入。
+    """
+    try:
+        data = request.get_json() or {}
+        user_id = session['user_id']
+        mode = data.get('mode', 'memory_learning')
+        states = data.get('states')
+        replace = bool(data.get('replace', False))
+        
+        if mode not in BRANCH_STATE_MODES:
+            return jsonify({'error': '学习模式无效'}), 400
+        
+        if not isinstance(states, dict):
+            return jsonify({'error': '分支状态格式无效'}), 400
+        
+        if len(states) > BRANCH_STATE_BULK_MAX_SIZE:
+            return jsonify({'error': f'单次最多保存 {BRANCH_STATE_BULK_MAX_SIZE} 个分支状态'}), 400
+        
+        for branch_id, status in states.items():
+            if status is not None and status not in BRANCH_STATE_STATUSES:
+                return jsonify({'error': f'分支 {branch_id} 的状态无效'}), 400
+        
+        if not check_pgn_permission(user_id, pgn_id):
+            return jsonify({'error': '您没有权限访问此PGN文件'}), 403
+        
+        with db_write() as conn:
+            save_branch_states(conn, user_id, pgn_id, mode, states, replace=replace)
+        
+        return jsonify({'success': True, 'message': f'已保存 {len(states)} 个分支状态', 'saved': len(states)})
+        
+    except Exception as e:
+        return jsonify({'error': f'批量保存分支状态失败: {str(e)}'}), 500
+
 @app.route('/api/progress/reset-memory-learning', methods=['POST'])
 @require_login
 def reset_memory_learning_progress():
@@ -2370,13 +5327,13 @@ def reset_memory_learning_progress():
         if not check_pgn_permission(user_id, pgn_game_id):
             return jsonify({'error': '您没有权限访问此PGN文件'}), 403
         
-        # 注意：记忆学习进度主要存储在前端localStorage中
-        # 这里返回成功，前端会负责清理localStorage
-        # 如果将来需要将记忆学习进度也存储到后端，可以在这里添加相应的清理逻辑
+        # 后端的分支状态在这里一次删除，前端负责清理localStorage中的备份
+        with db_write() as conn:
+            states_deleted = clear_branch_states(conn, pgn_game_id, user_id, 'memory_learning')
         
         return jsonify({
             'success': True,
-            'message': '记忆学习进度重置成功，前端localStorage已清理'
+            'message': f'记忆学习进度重置成功，清理分支状态 {states_deleted} 条，前端localStorage已清理'
         })
         
     except Exception as e:
@@ -2394,43 +5351,37 @@ def hard_reset_all_progress():
         if not pgn_game_id:
             return jsonify({'error': 'PGN游戏ID不能为空'}), 400
         
+        try:
+            pgn_game_id = int(pgn_game_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'PGN游戏ID无效'}), 400
+        
         # 检查用户是否有访问此PGN的权限
         if not check_pgn_permission(user_id, pgn_game_id):
             return jsonify({'error': '您没有权限访问此PGN文件'}), 403
         
-        with db_lock:
-            conn = sqlite3.connect(DATABASE_PATH)
+        with db_write() as conn:
             cursor = conn.cursor()
             
             # 获取PGN文件名（用于日志）
-            cursor.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_game_id,))
+            cursor.execute('SELECT filename FROM pgn_games WHERE id = ? AND deleted_at IS NULL', (pgn_game_id,))
             pgn_info = cursor.fetchone()
             
             if not pgn_info:
                 return jsonify({'error': 'PGN文件不存在'}), 404
             
-            # 删除该用户在该PGN上的所有进度记录
-            cursor.execute('''
-                DELETE FROM user_progress 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_game_id))
-            
-            progress_deleted = cursor.rowcount
-            
-            # 删除该用户在该PGN上的所有学习日志
-            cursor.execute('''
-                DELETE FROM user_study_logs 
-                WHERE user_id = ? AND pgn_game_id = ?
-            ''', (user_id, pgn_game_id))
-            
-            logs_deleted = cursor.rowcount
+            # 彻底重置该用户在该PGN上的进度，进度记录和学习日志由后台分批清理
+            progress_deleted = reset_progress_epoch(conn, user_id, pgn_game_id, keep_mastered=False)
             
-            conn.commit()
-            conn.close()
+            # 删除该用户在该PGN上的所有分支状态（包括记忆学习）
+            clear_branch_states(conn, pgn_game_id, user_id)
+        
+        progress_sweeper.wake()
+        progress_cache.invalidate(user_id, pgn_game_id)
         
         return jsonify({
             'success': True,
-            'message': f'已彻底重置所有学习进度（包括背诵学习和记忆学习），清理进度记录 {progress_deleted} 条，学习日志 {logs_deleted} 条'
+            'message': f'已彻底重置所有学习进度（包括背诵学习和记忆学习），重置进度记录 {progress_deleted} 条，学习日志将在后台清理'
         })
         
     except Exception as e:
@@ -2456,13 +5407,24 @@ if __name__ == '__main__':
     print("   PUT    /api/admin/users/<id>   - 更新用户信息")
     print("   DELETE /api/admin/users/<id>   - 删除用户")
     print("   GET    /api/admin/users/<id>/progress - 获取用户学习进度")
+    print("   GET    /api/admin/query-plans  - 查看查询执行计划（需设置DB_EXPLAIN_QUERIES=1）")
+    print("   GET    /api/admin/db-stats     - 查看连接池和写锁等待统计")
+    print("   GET    /api/admin/jobs         - 查看后台任务列表")
+    print("   GET    /api/admin/jobs/<id>    - 查看后台任务进度")
+    print("   POST   /api/admin/jobs/<id>/cancel - 取消后台任务")
+    print("   POST   /api/admin/study-logs/compact - 压缩过期学习日志")
     print("")
     print("📚 学习进度API (需要登录):")
     print("   GET  /api/progress/my     - 获取我的学习进度")
+    print("   GET  /api/progress/changes?since= - 增量同步进度变更")
     print("   POST /api/progress/update - 更新学习进度")
+    print("   POST /api/progress/batch  - 批量更新学习进度（一次提交整个分支的走子）")
     print("   POST /api/progress/reset  - 重置学习进度（保留已完成分支）")
     print("   POST /api/progress/hard-reset  - 彻底重置学习进度（删除所有数据）")
     print("   GET  /api/progress/stats  - 获取学习统计")
+    print("   POST /api/progress/branch-state - 保存单个分支的记忆学习状态")
+    print("   GET  /api/progress/branch-states/<pgn_id> - 获取PGN下所有分支状态")
+    print("   PUT  /api/progress/branch-states/<pgn_id> - 批量保存PGN下的分支状态")
     print("   POST /api/progress/reset-memory-learning - 重置记忆学习进度")
     print("   POST /api/progress/hard-reset-all - 彻底重置所有学习进度")
     print("")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接池基准测试
+
+对比每次调用都新建连接（DB_POOL_SIZE=0，等价于旧实现）和复用连接池两种方式下，
+一次练习走子（/api/progress/update + /api/progress/current-stats）的单请求延迟。
+
+用法: python test/bench_connection_pool.py [请求次数]
+"""
+
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+from conftest import SAMPLE_PGN, login  # noqa: E402
+
+
+def setup_client():
+    client = chess_app.app.test_client()
+    login(client, 'admin', 'admin123')
+    response = client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(SAMPLE_PGN.encode('utf-8')), f'bench_{time.time_ns()}.pgn')
+    }, content_type='multipart/form-data')
+    return client, response.get_json()['game_id']
+
+
+def run(client, pgn_id, requests_count):
+    latencies = []
+    for i in range(requests_count):
+        start = time.perf_counter()
+        client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id,
+            'branch_id': f'branch_{i % 5 + 1}',
+            'is_correct': i % 3 != 0
+        })
+        client.get(f'/api/progress/current-stats/{pgn_id}')
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies, manager):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<12} 平均 {statistics.mean(latencies):7.3f} ms  "
+          f"中位数 {statistics.median(latencies):7.3f} ms  p95 {p95:7.3f} ms  "
+          f"新建连接 {manager.stats['opened']}")
+
+
+def main():
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    client, pgn_id = setup_client()
+
+    print(f"🔍 连接池基准测试 ({requests_count} 次练习走子)")
+    print("=" * 60)
+    for label, pool_size in (('每次新建', 0), ('连接池', chess_app.DB_POOL_SIZE)):
+        manager = chess_app.ConnectionManager(chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, pool_size=pool_size)
+        chess_app.db_manager = manager
+        run(client, pgn_id, 20)  # 预热
+        report(label, run(client, pgn_id, requests_count), manager)
+        manager.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+组提交基准测试
+
+模拟一个班级的学生同时练习：每个学生一个线程连续提交走子，
+对比每次写入单独提交（窗口0）和不同组提交窗口下的吞吐量、延迟和平均组大小。
+
+用法: python test/bench_group_commit.py [学生数] [每学生走子数] [窗口毫秒,...]
+例如: python test/bench_group_commit.py 30 50 0,1,2,5
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+
+
+def run(window_ms, pgn_id, students, moves):
+    chess_app.group_committer = chess_app.GroupCommitter(window_ms=window_ms)
+    barrier = threading.Barrier(students)
+    latencies = []
+
+    def student(user_id):
+        barrier.wait()
+        for i in range(moves):
+            start = time.perf_counter()
+            chess_app.db_group_write(lambda conn: chess_app.record_progress_attempt(
+                conn, user_id, pgn_id, f'branch_{i % 10}', i % 3 != 0, i % 10 == 9))
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=student, args=(user_id,)) for user_id in range(1, students + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    chess_app.study_log_writer.flush()
+
+    stats = chess_app.group_committer.stats
+    groups = stats['groups'] or students * moves
+    return students * moves / elapsed, latencies, students * moves / groups
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    windows = [float(w) for w in sys.argv[3].split(',')] if len(sys.argv) > 3 else [0, 1, 2, 5]
+
+    print(f"🔍 组提交基准测试 ({students} 学生 × {moves} 步，synchronous={chess_app.DB_PRAGMAS['synchronous']})")
+    print("=" * 78)
+    for pgn_id, window_ms in enumerate(windows, start=200000):
+        throughput, latencies, group_size = run(window_ms, pgn_id, students, moves)
+        latencies.sort()
+        label = '单独提交' if window_ms <= 0 else f'窗口 {window_ms:g} ms'
+        print(f"{label:<10} 吞吐量 {throughput:8.1f} 次/秒  平均组大小 {group_size:5.1f}  "
+              f"延迟 中位数 {statistics.median(latencies):6.2f} ms / p95 {latencies[int(len(latencies) * 0.95)]:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
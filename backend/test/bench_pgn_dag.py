@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+走法树/DAG模式对比
+
+对同一份PGN分别用tree和dag模式解析，比较节点数、转换数、分支数、
+保存到数据库的parsed_data JSON大小和解析耗时。
+不带参数时使用仓库里的示例开局库和一份按不同走法次序生成的合成开局库
+（后翼弃兵/卡塔兰体系的几步出子按所有次序排列，再接几种共同后续）。
+
+用法: python test/bench_pgn_dag.py [PGN文件...]
+"""
+
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import chess  # noqa: E402
+import chess.pgn  # noqa: E402
+
+import app as chess_app  # noqa: E402
+
+SAMPLE_FILES = [os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             'white_black_2025.pgn')]
+
+WHITE_SETUP = ['d4', 'c4', 'Nf3', 'g3']
+BLACK_SETUP = ['Nf6', 'e6', 'd5', 'Be7']
+TAILS = [
+    ['Bg2', 'O-O', 'O-O', 'dxc4', 'Qc2', 'a6'],
+    ['Bg2', 'O-O', 'O-O', 'c6', 'Qc2', 'b6'],
+    ['Bg2', 'O-O', 'Qc2', 'c5'],
+]
+
+
+def synthetic_repertoire() -> str:
+    """双方出子的所有合法次序，每种次序接上所有后续"""
+    games = []
+    for white in itertools.permutations(WHITE_SETUP):
+        for black in itertools.permutations(BLACK_SETUP):
+            for tail in TAILS:
+                moves = [m for pair in zip(white, black) for m in pair] + tail
+                game = chess.pgn.Game()
+                node = game
+                try:
+                    for san in moves:
+                        node = node.add_variation(node.board().parse_san(san))
+                except ValueError:
+                    break  # 这个次序走不通（如Be7在e6之前）
+                games.append(str(game))
+    return '\n\n'.join(games)
+
+
+def measure(name, content):
+    print(f'\n{name}: {len(content)} 字节')
+    print(f'  {"模式":<6}{"节点":>8}{"转换":>8}{"分支":>8}{"JSON字节":>12}{"耗时ms":>10}')
+    for mode in chess_app.PGN_TREE_MODES:
+        started = time.perf_counter()
+        result = chess_app.PGNParser(dag=mode == 'dag').parse_pgn_content(content)
+        elapsed = (time.perf_counter() - started) * 1000
+        if 'error' in result:
+            print(f'  {mode:<6}解析失败: {result["error"]}')
+            continue
+        size = len(json.dumps(result, ensure_ascii=False))
+        print(f'  {mode:<6}{result["total_nodes"]:>8}{result["transpositions"]:>8}'
+              f'{result["total_branches"]:>8}{size:>12}{elapsed:>10.1f}')
+
+
+def main():
+    files = sys.argv[1:] or SAMPLE_FILES
+    for path in files:
+        with io.open(path, encoding='utf-8-sig') as f:
+            measure(os.path.basename(path), f.read())
+    if not sys.argv[1:]:
+        measure('合成开局库（走法次序排列）', synthetic_repertoire())
+
+
+if __name__ == '__main__':
+    main()
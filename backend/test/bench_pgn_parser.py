@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PGN解析基准测试
+
+对比旧的"read_game生成GameNode树后递归遍历、每个变体复制棋盘、节点常驻SAN和FEN"的实现和
+当前实现（PGNTreeBuilder单遍访问器、PGNTree平行数组只存16位走法编码，序列化为按列存放的SAN，不算FEN）：
+完整解析耗时、从解析到生成存库JSON的峰值内存、存库的parsed_data JSON大小，并检查两者输出一致。
+合成棋谱是随机合法走法组成的变体树，每个节点有一个或两个后续，直到达到指定节点数。
+
+用法: python test/bench_pgn_parser.py [节点数,...]
+例如: python test/bench_pgn_parser.py 1000,10000,100000,1000000
+"""
+
+import gc
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import chess  # noqa: E402
+import chess.pgn  # noqa: E402
+
+import app as chess_app  # noqa: E402
+from conftest import branch_moves  # noqa: E402
+
+MAX_DEPTH = 30  # 合成棋谱的最大步数
+
+
+class LegacyNode:
+    """旧节点：普通对象，建树时就存SAN、FEN、字符串ID和父指针"""
+
+    def __init__(self, move=None, fen=None, move_number=0, is_white=True):
+        self.move = move
+        self.fen = fen
+        self.move_number = move_number
+        self.is_white = is_white
+        self.children = []
+        self.parent = None
+        self.id = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'move': self.move,
+            'fen': self.fen,
+            'move_number': self.move_number,
+            'is_white': self.is_white,
+            'children': [child.to_dict() for child in self.children]
+        }
+
+
+class LegacyPGNParser:
+    """旧实现：read_game生成GameNode树后递归合并，变体处pop/push主线并复制棋盘，
+    最后递归生成字典和分支"""
+
+    def __init__(self):
+        self.node_counter = 0
+        self.root_node = self._new_node(None, chess.Board())
+        self.root_node.is_white = True
+
+    def _new_node(self, move, board):
+        node = LegacyNode(move, board.fen(), (board.ply() + 1) // 2, board.ply() % 2 == 1)
+        self.node_counter += 1
+        node.id = f'node_{self.node_counter}'
+        return node
+
+    def build(self, content):
+        pgn_io = io.StringIO(content)
+        while True:
+            game = chess.pgn.read_game(pgn_io)
+            if game is None:
+                return
+            self._parse_node_recursive(game, self.root_node, chess.Board())
+
+    def parse_pgn_content(self, content):
+        self.build(content)
+        branches = []
+        self._extract_paths(self.root_node, [], branches)
+        return {'tree': self.root_node.to_dict(), 'branches': branches, 'total_nodes': self.node_counter}
+
+    def _get_or_add_child(self, parent, san_move, board):
+        for child in parent.children:
+            if child.move == san_move:
+                return child
+        child = self._new_node(san_move, board)
+        child.parent = parent
+        parent.children.append(child)
+        return child
+
+    def _parse_node_recursive(self, pgn_node, tree_node, board):
+        current_pgn = pgn_node
+        current_tree = tree_node
+        while current_pgn.variations:
+            main_variation = current_pgn.variations[0]
+            san_move = board.san(main_variation.move)
+            board.push(main_variation.move)
+            new_tree_node = self._get_or_add_child(current_tree, san_move, board)
+            for variation in current_pgn.variations[1:]:
+                board.pop()
+                var_san = board.san(variation.move)
+                board.push(variation.move)
+                var_tree_node = self._get_or_add_child(current_tree, var_san, board)
+                if variation.variations:
+                    self._parse_node_recursive(variation, var_tree_node, board.copy())
+                board.pop()
+                board.push(main_variation.move)
+            current_pgn = main_variation
+            current_tree = new_tree_node
+
+    def _extract_paths(self, node, current_path, branches):
+        if node.move:
+            current_path.append(node.move)
+        if not node.children and current_path:
+            branches.append({'id': f'branch_{len(branches) + 1}', 'moves': current_path.copy()})
+        for child in node.children:
+            self._extract_paths(child, current_path.copy(), branches)
+
+
+def synthetic_pgn(nodes: int, seed: int = 1) -> str:
+    """生成约nodes个节点的单局变体树PGN"""
+    rng = random.Random(seed)
+    # 每个节点以概率q有两个后续，期望节点数约为 sum((1+q)^d)
+    branch_probability = min(1.0, nodes ** (1 / MAX_DEPTH) - 1)
+    board = chess.Board()
+    parts = []
+    count = 0
+
+    def move_text(move, force_number):
+        number = board.fullmove_number
+        if board.turn == chess.WHITE:
+            prefix = f'{number}. '
+        else:
+            prefix = f'{number}... ' if force_number else ''
+        return prefix + board.san(move)
+
+    def write(depth, force_number):
+        nonlocal count
+        legal = list(board.legal_moves)
+        if depth >= MAX_DEPTH or not legal or count >= nodes:
+            return
+        k = 2 if rng.random() < branch_probability else 1
+        moves = rng.sample(legal, min(k, len(legal), nodes - count))
+        count += len(moves)
+
+        parts.append(move_text(moves[0], force_number))
+        for variation in moves[1:]:
+            parts.append('(' + move_text(variation, True))
+            board.push(variation)
+            write(depth + 1, False)
+            board.pop()
+            parts.append(')')
+        board.push(moves[0])
+        write(depth + 1, len(moves) > 1)
+        board.pop()
+
+    # 节点数不够时加开新局，合并后接在同一棵树上
+    games = []
+    while count < nodes:
+        parts.clear()
+        write(0, True)
+        games.append('[Event "bench"]\n\n' + ' '.join(parts) + ' *\n')
+    return '\n'.join(games)
+
+
+def legacy_columns(root):
+    """把旧实现的嵌套树按节点ID换成当前实现的按列格式（不含FEN），用于比较"""
+    columns = {'moves': [], 'parents': []}
+    stack = [(root, -1)]
+    while stack:
+        node, parent = stack.pop()
+        index = int(node['id'][len('node_'):]) - 1
+        for values in columns.values():
+            values.extend([None] * (index + 1 - len(values)))
+        columns['moves'][index] = node['move']
+        columns['parents'][index] = parent
+        stack.extend((child, index) for child in node['children'])
+    return columns
+
+
+def store(parser_class, content):
+    """解析并生成存库的parsed_data JSON（同save_pgn_to_db），返回(解析结果, JSON)"""
+    result = parser_class().parse_pgn_content(content)
+    return result, json.dumps(result, ensure_ascii=False)
+
+
+def measure(parser_class, content):
+    """返回(解析结果, 完整解析耗时, 解析到生成JSON的峰值内存, 存库JSON字节数)"""
+    started = time.perf_counter()
+    result, stored = store(parser_class, content)
+    elapsed = time.perf_counter() - started
+    # tracemalloc会让解析慢好几倍，单独再跑一遍测峰值；PGN文本在开始跟踪前已分配，不计入
+    del result, stored
+    gc.collect()
+    tracemalloc.start()
+    result, stored = store(parser_class, content)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak_bytes, len(stored.encode('utf-8'))
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else [1000, 10000, 100000]
+    print(f'{"节点数":>10}{"实现":>10}{"耗时s":>10}{"节点/秒":>12}{"峰值内存MB":>12}{"字节/节点":>12}{"存库JSON KB":>14}')
+    for size in sizes:
+        content = synthetic_pgn(size)
+        results = []
+        for name, parser_class in (('旧实现', LegacyPGNParser), ('当前实现', chess_app.PGNParser)):
+            result, elapsed, peak_bytes, stored_bytes = measure(parser_class, content)
+            assert 'error' not in result, result
+            results.append(result)
+            nodes = result['total_nodes']
+            print(f'{nodes:>10}{name:>10}{elapsed:>10.2f}{nodes / elapsed:>12.0f}'
+                  f'{peak_bytes / 1024 / 1024:>12.1f}{peak_bytes / nodes:>12.0f}{stored_bytes / 1024:>14.1f}')
+        legacy, current = results
+        assert legacy_columns(legacy['tree']) == {
+            key: current['tree'][key] for key in ('moves', 'parents')}, '两种实现的树不一致'
+        # 当前实现的分支只存叶子和深度，还原走法后比较
+        assert [(branch['id'], branch['moves']) for branch in legacy['branches']] == [
+            (branch['id'], moves) for branch, moves in branch_moves(current)], '两种实现的分支不一致'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进度写入基准测试
+
+对比旧的"先SELECT、Python里计算、再UPDATE/INSERT"写法和单语句UPSERT写法：
+每次走子执行的SQL语句数和写事务耗时。
+
+用法: python test/bench_progress_upsert.py [走子次数]
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+
+
+def legacy_record(conn, user_id, pgn_game_id, branch_id, is_correct, is_branch_end, duration=0, notes=''):
+    """旧实现：SELECT后在Python里计算新值"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, correct_count, total_attempts, mastery_level, is_completed
+        FROM user_progress
+        WHERE user_id = ? AND pgn_game_id = ? AND branch_id = ?
+    ''', (user_id, pgn_game_id, branch_id))
+    existing = cursor.fetchone()
+    if existing:
+        progress_id, correct_count, total_attempts, _, current_is_completed = existing
+        new_correct_count = correct_count + (1 if is_correct else 0)
+        new_total_attempts = total_attempts + 1
+        new_mastery_level = int((new_correct_count / new_total_attempts) * 100)
+        is_completed = True if current_is_completed else (is_branch_end and is_correct)
+        cursor.execute('''
+            UPDATE user_progress
+            SET correct_count = ?, total_attempts = ?, mastery_level = ?,
+                is_completed = ?, last_attempt_at = CURRENT_TIMESTAMP,
+                updated_at = CURRENT_TIMESTAMP, notes = ?
+            WHERE id = ?
+        ''', (new_correct_count, new_total_attempts, new_mastery_level, is_completed, notes, progress_id))
+    else:
+        cursor.execute('''
+            INSERT INTO user_progress
+            (user_id, pgn_game_id, branch_id, is_completed, correct_count,
+             total_attempts, last_attempt_at, mastery_level, notes)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+        ''', (user_id, pgn_game_id, branch_id, is_branch_end and is_correct,
+              1 if is_correct else 0, 1, 100 if is_correct else 0, notes))
+    cursor.execute(chess_app.STUDY_LOG_INSERT_SQL, chess_app._study_log_params(
+        user_id, pgn_game_id, branch_id, is_correct, duration))
+
+
+def run(record, pgn_id, moves):
+    statements = []
+    latencies = []
+    for i in range(moves):
+        start = time.perf_counter()
+        with chess_app.db_write() as conn:
+            conn.set_trace_callback(statements.append)
+            record(conn, 1, pgn_id, f'branch_{i % 20}', i % 3 != 0, i % 20 == 19)
+            conn.set_trace_callback(None)
+        latencies.append((time.perf_counter() - start) * 1000)
+    # BEGIN / COMMIT各算一次往返
+    return (len(statements) + 2 * moves) / moves, latencies
+
+
+def main():
+    moves = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"🔍 进度写入基准测试 ({moves} 次走子)")
+    print("=" * 60)
+    for pgn_id, (label, record) in enumerate((('SELECT+写入', legacy_record),
+                                              ('UPSERT', chess_app.record_progress_attempt)), start=100000):
+        per_move, latencies = run(record, pgn_id, moves)
+        print(f"{label:<12} 每步语句数 {per_move:4.1f}  平均 {statistics.mean(latencies):6.3f} ms  "
+              f"中位数 {statistics.median(latencies):6.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+学习日志存储格式基准测试
+
+对比rows（每次练习一行）、events整段重写（旧实现：读出最新段解码后接上新记录再整段写回）
+和events追加（events || ?只拼接新记录、累加合计）三种写法：
+每条日志最终占用的数据库字节数，以及写入期间产生的WAL字节数（写放大）。
+每个写事务写入的条数分别取1（后写缓冲每次只攒到一条）和批量大小。
+
+用法: python test/bench_study_events.py [日志条数] [批量大小]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+
+
+def legacy_append_study_events(conn, rows):
+    """旧实现：读出最新的未写满段，解码后接上新记录再整段写回"""
+    leftover = []
+    grouped = {}
+    for row in rows:
+        user_id, pgn_game_id, branch_id, action, result, duration, created_at = row
+        code = chess_app._study_event_code(action, result, duration)
+        if code is None:
+            leftover.append(row)
+            continue
+        grouped.setdefault((user_id, pgn_game_id, created_at[:10]), []).append(
+            (branch_id, code, duration or 0, chess_app._utc_seconds(created_at)))
+
+    for (user_id, pgn_game_id, day), decoded in grouped.items():
+        epoch = conn.execute(f'SELECT {chess_app.CURRENT_EPOCH_SQL}', (user_id, pgn_game_id)).fetchone()[0]
+        key = (user_id, pgn_game_id, epoch, day)
+        segment = conn.execute('''
+            SELECT id, base_time, branches, events FROM study_event_segments
+            WHERE user_id = ? AND pgn_game_id = ? AND epoch = ? AND day = ? AND count < ?
+            ORDER BY id DESC LIMIT 1
+        ''', (*key, chess_app.STUDY_EVENT_SEGMENT_MAX_EVENTS)).fetchone()
+        segment_id = None
+        if segment is not None:
+            segment_id = segment[0]
+            decoded = chess_app._unpack_study_events(*segment[1:]) + decoded
+        for start in range(0, len(decoded), chess_app.STUDY_EVENT_SEGMENT_MAX_EVENTS):
+            values = chess_app._pack_study_events(decoded[start:start + chess_app.STUDY_EVENT_SEGMENT_MAX_EVENTS])
+            if segment_id is None:
+                conn.execute(f'''
+                    INSERT INTO study_event_segments (user_id, pgn_game_id, epoch, day, {', '.join(values)})
+                    VALUES (?, ?, ?, ?, {', '.join('?' * len(values))})
+                ''', (*key, *values.values()))
+            else:
+                conn.execute(f'''
+                    UPDATE study_event_segments SET {', '.join(f'{column} = ?' for column in values)} WHERE id = ?
+                ''', (*values.values(), segment_id))
+            segment_id = None
+    return leftover
+
+
+VARIANTS = (
+    ('rows', 'rows', None),
+    ('events整段重写', 'events', legacy_append_study_events),
+    ('events追加', 'events', chess_app.append_study_events),
+)
+
+
+def run(conn, pgn_id, moves, batch, log_format, append):
+    """写入moves条日志，每个事务batch条，返回(每条占用字节, 每条WAL字节, 每条耗时微秒)"""
+    original_format, original_append = chess_app.STUDY_LOG_FORMAT, chess_app.append_study_events
+    chess_app.STUDY_LOG_FORMAT = log_format
+    if append is not None:
+        chess_app.append_study_events = append
+    wal_path = chess_app.DATABASE_PATH + '-wal'
+    try:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        pages_before = conn.execute('PRAGMA page_count').fetchone()[0]
+        started = time.perf_counter()
+        for start in range(0, moves, batch):
+            rows = [chess_app._study_log_params(1, pgn_id, f'branch_{i % 20}', i % 3 != 0, i % 30)
+                    for i in range(start, min(start + batch, moves))]
+            conn.execute('BEGIN IMMEDIATE')
+            chess_app.insert_study_logs(conn, rows)
+            conn.execute('COMMIT')
+        elapsed = time.perf_counter() - started
+        wal_bytes = os.path.getsize(wal_path)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        pages_after = conn.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        chess_app.STUDY_LOG_FORMAT, chess_app.append_study_events = original_format, original_append
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    return (pages_after - pages_before) * page_size / moves, wal_bytes / moves, elapsed / moves * 1e6
+
+
+def main():
+    moves = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    # 单独的连接，关闭自动检查点，WAL文件大小就是这段写入产生的全部WAL
+    conn = sqlite3.connect(chess_app.DATABASE_PATH, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA wal_autocheckpoint=0')
+    print(f"🔍 学习日志存储基准测试 ({moves} 条日志，段容量 {chess_app.STUDY_EVENT_SEGMENT_MAX_EVENTS})")
+    print("=" * 72)
+    print(f'{"写法":<14}{"每事务条数":>10}{"字节/条":>12}{"WAL字节/条":>14}{"微秒/条":>12}')
+    pgn_id = 100000
+    for batch in (1, batch_size):
+        for label, log_format, append in VARIANTS:
+            pgn_id += 1
+            stored, wal, micros = run(conn, pgn_id, moves, batch, log_format, append)
+            print(f'{label:<14}{batch:>10}{stored:>12.1f}{wal:>14.1f}{micros:>12.1f}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
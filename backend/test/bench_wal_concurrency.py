@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WAL并发基准测试
+
+N个模拟学生持续提交走子（/api/progress/update），同时管理员反复打开进度表格
+（/api/admin/pgn/<id>/users，即get_pgn_user_progress）。
+对比两种模式下学生写请求的延迟：
+  - 全局锁：读查询也占用写锁（等价于旧的db_lock实现）
+  - WAL读写分离：读查询不加锁，只有写事务串行
+
+用法: python test/bench_wal_concurrency.py [学生数] [每个学生的走子数]
+"""
+
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_bench_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+from conftest import SAMPLE_PGN, login  # noqa: E402
+
+original_db_read = chess_app.db_read
+
+
+@contextmanager
+def serialized_db_read():
+    """模拟旧实现：读查询同样持有全局锁"""
+    with chess_app.db_write_lock, chess_app.db_manager.connection() as conn:
+        yield conn
+
+
+def setup(students):
+    admin = chess_app.app.test_client()
+    login(admin, 'admin', 'admin123')
+    response = admin.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(SAMPLE_PGN.encode('utf-8')), f'bench_{time.time_ns()}.pgn')
+    }, content_type='multipart/form-data')
+    pgn_id = response.get_json()['game_id']
+
+    clients = []
+    for i in range(students):
+        username = f'student_{time.time_ns()}_{i}'
+        user_id = admin.post('/api/admin/users', json={'username': username, 'password': 'secret123'}).get_json()['user_id']
+        admin.post(f'/api/admin/pgn/{pgn_id}/permissions', json={'user_id': user_id})
+        client = chess_app.app.test_client()
+        login(client, username, 'secret123')
+        clients.append(client)
+    return admin, pgn_id, clients
+
+
+def run(admin, pgn_id, clients, moves):
+    latencies = []
+    latencies_lock = threading.Lock()
+    admin_views = [0]
+    stop = threading.Event()
+
+    def student(client):
+        local = []
+        for i in range(moves):
+            start = time.perf_counter()
+            client.post('/api/progress/update', json={
+                'pgn_game_id': pgn_id,
+                'branch_id': f'branch_{i % 5 + 1}',
+                'is_correct': i % 4 != 0
+            })
+            local.append((time.perf_counter() - start) * 1000)
+        with latencies_lock:
+            latencies.extend(local)
+
+    def teacher():
+        while not stop.is_set():
+            admin.get(f'/api/admin/pgn/{pgn_id}/users')
+            admin_views[0] += 1
+
+    teacher_thread = threading.Thread(target=teacher)
+    teacher_thread.start()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=student, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    teacher_thread.join()
+    return latencies, admin_views[0], elapsed
+
+
+def report(label, latencies, admin_views, elapsed):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<10} 写入 {len(latencies) / elapsed:7.1f} 次/秒  "
+          f"中位数 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms  "
+          f"管理员查看 {admin_views / elapsed:6.1f} 次/秒")
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    moves = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    admin, pgn_id, clients = setup(students)
+
+    print(f"🔍 WAL并发基准测试 ({students} 个学生 × {moves} 步，管理员持续查看进度)")
+    print("=" * 70)
+    chess_app.db_read = serialized_db_read
+    report('全局锁', *run(admin, pgn_id, clients, moves))
+    chess_app.db_read = original_db_read
+    report('WAL读写分离', *run(admin, pgn_id, clients, moves))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pytest公共夹具
+
+在导入app模块之前把DATABASE_PATH指向临时目录，避免测试写入真实的chess_pgn.db。
+"""
+
+import io
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_test_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+
+SAMPLE_PGN = '''[Event "?"]
+[White "white"]
+[Black "black"]
+[Result "*"]
+
+1. e4 e5 2. Nf3 (2. f4 d5 3. fxe5 Qh4+ 4. Ke2 Qxe4+) 2... Nc6 3. Bc4 Bc5 4. c3 Nf6 5. d4 *
+'''
+
+
+def branch_moves(parsed_data):
+    """按分支顺序还原走法列表，yield (分支, 走法列表)
+
+    分支只存叶子节点ID和深度，沿父节点下标从叶子走回根节点（同js/api.js的materializeBranches）。
+    """
+    moves, parents = parsed_data['tree']['moves'], parsed_data['tree']['parents']
+    for branch in parsed_data['branches']:
+        path = [None] * branch['depth']
+        node = int(branch['leaf'][len('node_'):]) - 1
+        for depth in range(branch['depth'] - 1, -1, -1):
+            path[depth] = moves[node]
+            node = parents[node]
+        yield branch, path
+
+
+def login(client, username, password):
+    """登录并返回响应JSON"""
+    response = client.post('/api/auth/login', json={'username': username, 'password': password})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@pytest.fixture
+def app_module():
+    return chess_app
+
+
+@pytest.fixture
+def admin_client():
+    client = chess_app.app.test_client()
+    login(client, 'admin', 'admin123')
+    return client
+
+
+@pytest.fixture
+def make_user(admin_client):
+    """创建一个普通用户并返回 (已登录的client, user_id)"""
+    def _make_user(role='user'):
+        username = f'user_{uuid.uuid4().hex[:10]}'
+        response = admin_client.post('/api/admin/users', json={
+            'username': username,
+            'password': 'secret123',
+            'role': role
+        })
+        user_id = response.get_json()['user_id']
+        client = chess_app.app.test_client()
+        login(client, username, 'secret123')
+        return client, user_id
+    return _make_user
+
+
+@pytest.fixture
+def upload_pgn(admin_client):
+    """以管理员身份上传PGN，可选地授权给指定用户，返回PGN ID"""
+    def _upload_pgn(content=SAMPLE_PGN, grant_to=()):
+        filename = f'test_{uuid.uuid4().hex[:10]}.pgn'
+        response = admin_client.post('/api/parse-pgn', data={
+            'file': (io.BytesIO(content.encode('utf-8')), filename)
+        }, content_type='multipart/form-data')
+        pgn_id = response.get_json()['game_id']
+        for user_id in grant_to:
+            admin_client.post(f'/api/admin/pgn/{pgn_id}/permissions', json={'user_id': user_id})
+        return pgn_id
+    return _upload_pgn
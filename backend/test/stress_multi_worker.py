@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多worker写入压力测试
+
+模拟 gunicorn --workers N 部署：每个worker是独立进程，各自导入app（各自的进程内写锁），
+每个worker内再用多个线程模拟并发学生提交走子。统计失败请求数（如 database is locked）、
+写入吞吐量以及各worker的写锁等待统计，最后核对总尝试次数没有丢失。
+
+安装了gevent时加 --gevent 参数，worker内改用greenlet并打monkey patch（与gevent worker一致）。
+
+用法: python test/stress_multi_worker.py [worker数] [每worker学生数] [每学生走子数] [--gevent]
+"""
+
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+USE_GEVENT = '--gevent' in sys.argv
+if USE_GEVENT and multiprocessing.current_process().name != 'MainProcess':
+    from gevent import monkey
+    monkey.patch_all()
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.mkdtemp(prefix='chess_stress_'), 'chess_pgn.db'))
+
+import app as chess_app  # noqa: E402
+from conftest import SAMPLE_PGN, login  # noqa: E402
+
+
+def worker(worker_index, pgn_id, accounts, moves, results):
+    """一个worker进程：每个学生一个线程（或greenlet）"""
+    errors = []
+
+    def student(username):
+        client = chess_app.app.test_client()
+        login(client, username, 'secret123')
+        for i in range(moves):
+            response = client.post('/api/progress/update', json={
+                'pgn_game_id': pgn_id,
+                'branch_id': f'branch_{i % 5 + 1}',
+                'is_correct': i % 4 != 0,
+                'is_branch_end': i % 5 == 4
+            })
+            if response.status_code != 200:
+                errors.append(response.get_json().get('error'))
+
+    threads = [threading.Thread(target=student, args=(username,)) for username in accounts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((worker_index, errors, chess_app.write_metrics.snapshot()))
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    workers = int(args[0]) if len(args) > 0 else 4
+    students = int(args[1]) if len(args) > 1 else 5
+    moves = int(args[2]) if len(args) > 2 else 40
+
+    admin = chess_app.app.test_client()
+    login(admin, 'admin', 'admin123')
+    response = admin.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(SAMPLE_PGN.encode('utf-8')), f'stress_{time.time_ns()}.pgn')
+    }, content_type='multipart/form-data')
+    pgn_id = response.get_json()['game_id']
+
+    accounts = []
+    for w in range(workers):
+        worker_accounts = []
+        for s in range(students):
+            username = f'stress_{time.time_ns()}_{w}_{s}'
+            user_id = admin.post('/api/admin/users', json={'username': username, 'password': 'secret123'}).get_json()['user_id']
+            admin.post(f'/api/admin/pgn/{pgn_id}/permissions', json={'user_id': user_id})
+            worker_accounts.append(username)
+        accounts.append(worker_accounts)
+    chess_app.db_manager.close_all()
+
+    print(f"🔍 多worker写入压力测试 ({workers} worker × {students} 学生 × {moves} 步"
+          f"{'，gevent' if USE_GEVENT else ''})")
+    print("=" * 70)
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    start = time.perf_counter()
+    processes = [context.Process(target=worker, args=(w, pgn_id, accounts[w], moves, results))
+                 for w in range(workers)]
+    for process in processes:
+        process.start()
+    reports = sorted(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    total_errors = 0
+    for worker_index, errors, metrics in reports:
+        total_errors += len(errors)
+        print(f"worker {worker_index}: 失败 {len(errors)}  重试 {metrics['busy_retries']}  "
+              f"进程内等待 平均 {metrics['local_wait_avg_ms']} ms / 最大 {metrics['local_wait_max_ms']} ms  "
+              f"跨进程等待 平均 {metrics['busy_wait_avg_ms']} ms / 最大 {metrics['busy_wait_max_ms']} ms")
+        for error in set(errors):
+            print(f"    ❌ {error}")
+
+    expected = workers * students * moves
+    with chess_app.db_read() as conn:
+        recorded = conn.execute('SELECT SUM(total_attempts) FROM user_progress WHERE pgn_game_id = ?',
+                                (pgn_id,)).fetchone()[0] or 0
+    print("=" * 70)
+    print(f"吞吐量: {expected / elapsed:.1f} 次写入/秒，失败请求: {total_errors}")
+    print(f"{'✅' if recorded == expected and total_errors == 0 else '❌'} 记录的尝试次数 {recorded} / 期望 {expected}")
+
+
+if __name__ == '__main__':
+    main()
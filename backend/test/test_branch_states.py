@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试记忆学习分支状态：单个保存、批量读写、重置时按PGN整体清理
+"""
+
+import time
+
+from conftest import chess_app
+
+
+def _states(client, pgn_id):
+    response = client.get(f'/api/progress/branch-states/{pgn_id}')
+    assert response.status_code == 200, response.get_json()
+    return {branch_id: state['status'] for branch_id, state in response.get_json()['states'].items()}
+
+
+def test_single_and_bulk_save(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    response = client.post('/api/progress/branch-state', json={
+        'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'status': 'paused', 'mode': 'memory_learning'
+    })
+    assert response.status_code == 200
+    assert _states(client, pgn_id) == {'branch_1': 'paused'}
+
+    response = client.put(f'/api/progress/branch-states/{pgn_id}', json={
+        'states': {'branch_1': 'completed', 'branch_2': 'paused', 'branch_3': 'completed'}
+    })
+    assert response.get_json()['saved'] == 3
+    assert _states(client, pgn_id) == {'branch_1': 'completed', 'branch_2': 'paused', 'branch_3': 'completed'}
+
+    client.put(f'/api/progress/branch-states/{pgn_id}', json={'states': {'branch_2': None}})
+    assert _states(client, pgn_id) == {'branch_1': 'completed', 'branch_3': 'completed'}
+
+    client.put(f'/api/progress/branch-states/{pgn_id}', json={'states': {'branch_2': 'completed'}, 'replace': True})
+    assert _states(client, pgn_id) == {'branch_2': 'completed'}
+
+
+def test_bulk_save_validates_and_checks_permission(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    other_pgn = upload_pgn()
+
+    response = client.put(f'/api/progress/branch-states/{pgn_id}', json={
+        'states': {'branch_1': 'completed', 'branch_2': 'bogus'}
+    })
+    assert response.status_code == 400
+    assert _states(client, pgn_id) == {}
+
+    response = client.put(f'/api/progress/branch-states/{other_pgn}', json={'states': {'branch_1': 'completed'}})
+    assert response.status_code == 403
+
+
+def test_resets_clear_branch_states(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    other_client, other_user = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id, other_user])
+    for c in (client, other_client):
+        c.put(f'/api/progress/branch-states/{pgn_id}', json={'states': {'branch_1': 'completed', 'branch_2': 'paused'}})
+
+    client.post('/api/progress/reset-memory-learning', json={'pgn_game_id': pgn_id})
+    assert _states(client, pgn_id) == {}
+    assert _states(other_client, pgn_id) == {'branch_1': 'completed', 'branch_2': 'paused'}
+
+    job_id = admin_client.delete(f'/api/admin/pgn/{pgn_id}').get_json()['job_id']
+    assert client.get(f'/api/progress/branch-states/{pgn_id}').status_code == 403
+    # 分支状态由后台清理任务删除
+    deadline = time.monotonic() + 10
+    while admin_client.get(f'/api/admin/jobs/{job_id}').get_json()['job']['status'] != 'completed':
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    with chess_app.db_read() as conn:
+        remaining = conn.execute('SELECT COUNT(*) FROM user_branch_states WHERE pgn_game_id = ?',
+                                 (pgn_id,)).fetchone()[0]
+    assert remaining == 0
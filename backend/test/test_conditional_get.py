@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试进度和PGN接口的条件GET：强ETag、未变化时304且只查询版本号、写入后ETag变化
+"""
+
+import pytest
+
+from conftest import chess_app
+
+
+@pytest.fixture
+def statements():
+    """临时把db_manager换成记录每条执行语句的连接管理器"""
+    statements = []
+    original = chess_app.db_manager
+    chess_app.db_manager = chess_app.ConnectionManager(
+        chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=statements.append)
+    try:
+        yield statements
+    finally:
+        chess_app.db_manager.close_all()
+        chess_app.db_manager = original
+
+
+def _post(client, pgn_id, branch_id='branch_1', is_correct=True):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct, 'is_branch_end': True
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _etag(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('"')  # 强ETag
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    return etag
+
+
+def _revalidate(client, url, etag):
+    return client.get(url, headers={'If-None-Match': etag}).status_code
+
+
+@pytest.mark.parametrize('url', ['/api/progress/my', '/api/progress/by-pgn', '/api/latest-pgn', '/api/pgn/{pgn_id}'])
+def test_unchanged_resource_returns_304_without_aggregation(url, statements, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id)
+    url = url.format(pgn_id=pgn_id)
+    etag = _etag(client, url)
+
+    statements.clear()
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b'' and response.headers['ETag'] == etag
+    queries = [sql for sql in statements if 'resource_versions' not in sql]
+    # 只剩PGN详情接口的权限检查（按主键的单行查询）
+    assert not any('progress_rollup' in sql or 'user_progress' in sql or 'parsed_data' in sql for sql in queries)
+
+
+def test_progress_writes_change_etag(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    urls = ['/api/progress/my', '/api/progress/by-pgn']
+    etags = {url: _etag(client, url) for url in urls}
+
+    _post(client, pgn_id)
+    for url in urls:
+        assert _revalidate(client, url, etags[url]) == 200
+        etags[url] = _etag(client, url)
+
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    for url in urls:
+        assert _revalidate(client, url, etags[url]) == 200
+
+    # 其他用户的写入不影响
+    other, other_id = make_user()
+    etag = _etag(client, '/api/progress/my')
+    admin_client.post(f'/api/admin/pgn/{pgn_id}/permissions', json={'user_id': other_id})
+    _post(other, pgn_id)
+    assert _revalidate(client, '/api/progress/my', etag) == 304
+
+
+def test_permission_and_pgn_changes(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    pgn_etag = _etag(client, f'/api/pgn/{pgn_id}')
+    latest_etag = _etag(client, '/api/latest-pgn')
+
+    # 新上传但没有授权的PGN也会让最新PGN重新计算（目录版本变化）
+    upload_pgn()
+    assert _revalidate(client, '/api/latest-pgn', latest_etag) == 200
+    assert _revalidate(client, f'/api/pgn/{pgn_id}', pgn_etag) == 304
+
+    # 撤销授权后即使ETag匹配也返回403
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}/permissions/{user_id}')
+    assert _revalidate(client, f'/api/pgn/{pgn_id}', pgn_etag) == 403
+
+    admin_etag = _etag(admin_client, f'/api/pgn/{pgn_id}')
+    assert admin_etag == pgn_etag  # 内容与用户无关
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+    assert _revalidate(admin_client, f'/api/pgn/{pgn_id}', admin_etag) == 403
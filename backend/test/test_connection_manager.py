@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试SQLite连接管理器的复用、回收和事务清理
+"""
+
+import os
+import tempfile
+import threading
+
+from conftest import chess_app
+
+
+def _manager(**kwargs):
+    path = os.path.join(tempfile.mkdtemp(prefix='chess_pool_'), 'pool.db')
+    return chess_app.ConnectionManager(path, chess_app.DB_PRAGMAS, **kwargs)
+
+
+def test_connection_reused_across_checkouts():
+    manager = _manager(pool_size=2)
+    with manager.connection() as first:
+        pass
+    with manager.connection() as second:
+        pass
+    assert first is second
+    assert manager.stats['opened'] == 1
+    assert manager.stats['reused'] == 1
+
+
+def test_nested_checkout_shares_connection():
+    manager = _manager()
+    with manager.connection() as outer:
+        with manager.connection() as inner:
+            assert inner is outer
+    assert manager.stats['opened'] == 1
+
+
+def test_threads_get_separate_connections():
+    manager = _manager()
+    seen = []
+    barrier = threading.Barrier(2)
+
+    def worker():
+        with manager.connection() as conn:
+            barrier.wait()
+            seen.append(conn)
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen[0] is not seen[1]
+
+
+def test_uncommitted_transaction_rolled_back_on_release():
+    manager = _manager()
+    with manager.connection() as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.execute('BEGIN')
+        conn.execute('INSERT INTO t VALUES (1)')
+    with manager.connection() as conn:
+        assert not conn.in_transaction
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+
+def test_connection_recycled_after_max_uses():
+    manager = _manager(max_uses=2)
+    for _ in range(3):
+        with manager.connection():
+            pass
+    assert manager.stats['recycled'] >= 1
+    assert manager.stats['opened'] == 2
+
+
+def test_pool_size_zero_closes_every_connection():
+    manager = _manager(pool_size=0)
+    for _ in range(3):
+        with manager.connection():
+            pass
+    assert manager.stats['opened'] == 3
+    assert manager.stats['reused'] == 0
+
+
+def test_pragmas_applied():
+    manager = _manager()
+    with manager.connection() as conn:
+        assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == chess_app.DB_PRAGMAS['busy_timeout']
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试daily_activity每日活动汇总：写入日志时按批累加、删除日志时扣减、回填命令修复漂移
+"""
+
+from conftest import chess_app
+
+
+def _post(client, pgn_id, branch_id, is_correct, duration=0):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct, 'duration': duration
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _activity(user_id):
+    with chess_app.db_read() as conn:
+        return conn.execute('''
+            SELECT day, count, correct, duration FROM daily_activity WHERE user_id = ? ORDER BY day
+        ''', (user_id,)).fetchall()
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _drift():
+    # 在写事务里检查漂移后回滚，不改动数据
+    try:
+        with chess_app.db_write() as conn:
+            drifted = chess_app.rebuild_daily_activity(conn)
+            raise _Rollback
+    except _Rollback:
+        return drifted
+
+
+def test_log_writes_accumulate(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True, duration=5)
+    _post(client, pgn_id, 'branch_2', False, duration=3)
+    client.post('/api/progress/batch', json={'updates': [
+        {'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True, 'duration': 2},
+        {'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True}
+    ]})
+    chess_app.study_log_writer.flush()
+
+    with chess_app.db_read() as conn:
+        today = conn.execute("SELECT date('now')").fetchone()[0]
+    assert _activity(user_id) == [(today, 4, 3, 10)]
+    daily = client.get('/api/progress/stats').get_json()['daily_stats']
+    assert daily == [{'date': today, 'count': 4, 'correct': 3, 'duration': 10}]
+    assert _drift() == 0
+
+
+def test_deleted_logs_subtracted(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True)
+    _post(client, pgn_id, 'branch_2', True)
+
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    chess_app.progress_sweeper.sweep_all()
+    assert _activity(user_id) == []
+    assert _drift() == 0
+
+
+def test_backfill_command_repairs_drift(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True)
+    chess_app.study_log_writer.flush()
+
+    with chess_app.db_write() as conn:
+        conn.execute('DELETE FROM daily_activity WHERE user_id = ?', (user_id,))
+    assert _drift() == 1
+
+    result = chess_app.app.test_cli_runner().invoke(args=['backfill-daily-activity'])
+    assert result.exit_code == 0, result.output
+    assert [row[1:] for row in _activity(user_id)] == [(1, 1, 0)]
+    assert _drift() == 0
+
+
+def test_duration_summed_as_int(make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    rows = [chess_app._study_log_params(user_id, pgn_id, 'branch_1', True, duration)
+            for duration in (2, '5', None)]
+    with chess_app.db_write() as conn:
+        chess_app.insert_study_logs(conn, rows)
+
+    with chess_app.db_read() as conn:
+        today = conn.execute("SELECT date('now')").fetchone()[0]
+    assert _activity(user_id) == [(today, 3, 3, 7)]
+    assert _drift() == 0
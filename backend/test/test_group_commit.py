@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试组提交：并发写入合并到同一事务，单个写入失败只回滚自己
+"""
+
+import threading
+
+import pytest
+
+from conftest import chess_app
+
+
+@pytest.fixture
+def committer(monkeypatch):
+    committer = chess_app.GroupCommitter(window_ms=20, max_batch=64)
+    monkeypatch.setattr(chess_app, 'group_committer', committer)
+    return committer
+
+
+def test_concurrent_updates_share_commit(committer, make_user, upload_pgn):
+    students = 8
+    clients = []
+    user_ids = []
+    for _ in range(students):
+        client, user_id = make_user()
+        clients.append(client)
+        user_ids.append(user_id)
+    pgn_id = upload_pgn(grant_to=user_ids)
+    barrier = threading.Barrier(students)
+    statuses = []
+
+    def student(client):
+        barrier.wait()
+        response = client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True
+        })
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=student, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert statuses == [200] * students
+    assert committer.stats['operations'] == students
+    assert committer.stats['groups'] < students
+    for client in clients:
+        assert client.get(f'/api/progress/current-stats/{pgn_id}').get_json()['total_attempts'] == 1
+
+
+def test_failed_operation_rolls_back_only_itself(committer):
+    barrier = threading.Barrier(2)
+    results = {}
+
+    def insert(conn):
+        conn.execute("INSERT INTO users (username, password_hash) VALUES ('group_commit_ok', 'x')")
+
+    def fail(conn):
+        conn.execute("INSERT INTO users (username, password_hash) VALUES ('group_commit_bad', 'x')")
+        raise ValueError('boom')
+
+    def worker(name, fn):
+        barrier.wait()
+        try:
+            chess_app.db_group_write(fn)
+            results[name] = 'ok'
+        except ValueError:
+            results[name] = 'error'
+
+    threads = [threading.Thread(target=worker, args=('ok', insert)),
+               threading.Thread(target=worker, args=('bad', fail))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {'ok': 'ok', 'bad': 'error'}
+    with chess_app.db_read() as conn:
+        names = {row[0] for row in conn.execute(
+            "SELECT username FROM users WHERE username LIKE 'group_commit_%'")}
+    assert names == {'group_commit_ok'}
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试后台任务：删除PGN后分块清理数据、任务进度接口、取消、进程退出后接管未完成的任务
+"""
+
+import io
+
+import pytest
+
+from conftest import SAMPLE_PGN, chess_app
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    """停掉全局任务线程，换成只在测试里手动执行、每个分块处理两行的执行器"""
+    chess_app.job_runner.close()
+    runner = chess_app.JobRunner(chunk_size=2, pause=0)
+    monkeypatch.setattr(runner, 'start', lambda: None)
+    monkeypatch.setattr(chess_app, 'job_runner', runner)
+    runner.run_pending()  # 先执行其他测试留下的任务
+    return runner
+
+
+def _practice(client, pgn_id):
+    for i in range(3):
+        client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id, 'branch_id': f'branch_{i + 1}',
+            'is_correct': True, 'is_branch_end': True
+        })
+    client.put(f'/api/progress/branch-states/{pgn_id}', json={'states': {'branch_1': 'completed'}})
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    chess_app.study_log_writer.flush()
+
+
+def _remaining(pgn_id):
+    with chess_app.db_read() as conn:
+        return {
+            table: conn.execute(f'SELECT COUNT(*) FROM {table} WHERE {column} = ?', (pgn_id,)).fetchone()[0]
+            for table, column in chess_app.PGN_PURGE_TABLES
+        }
+
+
+def _job(admin_client, job_id):
+    response = admin_client.get(f'/api/admin/jobs/{job_id}')
+    assert response.status_code == 200
+    return response.get_json()['job']
+
+
+def test_delete_pgn_purges_in_background(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+
+    response = admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+    assert response.status_code == 200
+    job_id = response.get_json()['job_id']
+
+    # PGN立即不可见，数据还等着后台任务清理
+    assert client.get('/api/progress/by-pgn').get_json()['pgn_progress'] == []
+    assert client.get(f'/api/progress/current-stats/{pgn_id}').status_code == 403
+    # 这里的日志按行存储且还没过保留期，没有事件段和压缩汇总
+    assert all(count for table, count in _remaining(pgn_id).items()
+               if table not in ('study_log_summaries', 'study_event_segments'))
+    assert _job(admin_client, job_id)['status'] == 'pending'
+
+    assert runner.run_pending() == 1
+    job = _job(admin_client, job_id)
+    assert (job['status'], job['percent'], job['params']) == ('completed', 100.0, {'pgn_id': pgn_id})
+    assert job['processed'] == job['total'] > 0
+    assert runner.stats['chunks'] >= job['total'] // runner.chunk_size
+    assert not any(_remaining(pgn_id).values())
+
+
+def test_overwrite_schedules_purge(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+    with chess_app.db_read() as conn:
+        filename = conn.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_id,)).fetchone()[0]
+
+    result = admin_client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(SAMPLE_PGN.encode('utf-8')), filename),
+        'force_overwrite': 'true'
+    }, content_type='multipart/form-data').get_json()
+    assert result['overwritten'] and result['game_id'] != pgn_id
+
+    runner.run_pending()
+    assert _job(admin_client, result['purge_job_id'])['status'] == 'completed'
+    assert not any(_remaining(pgn_id).values())
+
+
+def test_cancel_pending_and_running_jobs(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    first, second = upload_pgn(grant_to=[user_id]), upload_pgn(grant_to=[user_id])
+    _practice(client, first)
+    _practice(client, second)
+    pending_id = admin_client.delete(f'/api/admin/pgn/{first}').get_json()['job_id']
+    response = admin_client.post(f'/api/admin/jobs/{pending_id}/cancel')
+    assert response.get_json()['job']['status'] == 'cancelled'
+
+    running_id = admin_client.delete(f'/api/admin/pgn/{second}').get_json()['job_id']
+    assert runner.claim() == running_id
+    assert runner.run_chunk(running_id) is not None
+    job = admin_client.post(f'/api/admin/jobs/{running_id}/cancel').get_json()['job']
+    assert (job['status'], job['cancel_requested']) == ('running', True)
+
+    runner.run_job(running_id)
+    assert _job(admin_client, running_id)['status'] == 'cancelled'
+    assert any(_remaining(second).values())
+    assert runner.run_pending() == 0
+    assert admin_client.post('/api/admin/jobs/999999/cancel').status_code == 404
+
+
+def test_stale_job_resumed_by_other_process(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+    job_id = admin_client.delete(f'/api/admin/pgn/{pgn_id}').get_json()['job_id']
+
+    # 第一个进程处理了一个分块后退出，没有交还任务
+    crashed = chess_app.JobRunner(chunk_size=2, pause=0)
+    assert crashed.claim() == job_id
+    assert crashed.run_chunk(job_id) is not None
+    assert runner.claim() is None  # 租约未过期，不能接管
+
+    with chess_app.db_write() as conn:
+        conn.execute("UPDATE background_jobs SET heartbeat_at = datetime('now', '-1 hour') WHERE id = ?", (job_id,))
+    assert runner.run_pending() == 1
+    assert crashed.run_chunk(job_id) is None  # 已被接管，旧进程不再继续
+
+    job = _job(admin_client, job_id)
+    assert (job['status'], job['attempts']) == ('completed', 2)
+    assert not any(_remaining(pgn_id).values())
+
+    jobs = admin_client.get('/api/admin/jobs?status=completed').get_json()['jobs']
+    assert job_id in [item['id'] for item in jobs]
+    assert admin_client.get('/api/admin/jobs?status=bogus').status_code == 400
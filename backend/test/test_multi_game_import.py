@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试多局PGN导入：所有对局合并为一棵共享前缀的走法树，单局错误不影响其他对局
+"""
+
+import io
+import sys
+
+import chess
+
+from conftest import SAMPLE_PGN, branch_moves, chess_app
+
+MULTI_GAME_PGN = '''[Event "Open"]
+[White "A"]
+[Black "B"]
+
+1. e4 e5 2. Nf3 Nc6 *
+
+[Event "Open"]
+[White "C"]
+[Black "D"]
+
+1. e4 c5 2. Nf3 d6 *
+
+[Event "Broken"]
+[White "E"]
+[Black "F"]
+
+1. d4 d5 2. Zz9 Nf6 *
+
+[Event "Setup"]
+[SetUp "1"]
+[FEN "8/8/8/8/8/8/4K3/4k3 w - - 0 1"]
+
+1. Kd3 *
+
+[Event "Open"]
+[White "G"]
+[Black "H"]
+
+1. e4 e5 2. Nf3 Nf6 *
+'''
+
+
+def _parse(content):
+    return chess_app.PGNParser().parse_pgn_content(content)
+
+
+def _moves(result):
+    return [moves for _, moves in branch_moves(result)]
+
+
+def test_games_merged_with_shared_prefix():
+    result = _parse(MULTI_GAME_PGN)
+    assert result['success']
+    assert (result['total_games'], result['failed_games']) == (4, 2)
+
+    moves, children = result['tree']['moves'], chess_app.tree_children(result['tree'])
+    assert [moves[child] for child in children[0]] == ['e4', 'd4']
+    e4 = children[0][0]
+    assert [moves[child] for child in children[e4]] == ['e5', 'c5']
+    assert sorted(tuple(moves) for moves in _moves(result)) == [
+        ('d4', 'd5'),
+        ('e4', 'c5', 'Nf3', 'd6'),
+        ('e4', 'e5', 'Nf3', 'Nc6'),
+        ('e4', 'e5', 'Nf3', 'Nf6'),
+    ]
+
+    errors = {error['game']: error for error in result['game_errors']}
+    assert set(errors) == {3, 4}
+    assert errors[3]['imported'] and errors[3]['white'] == 'E'
+    assert not errors[4]['imported']
+
+
+def test_single_game_unchanged():
+    result = _parse(SAMPLE_PGN)
+    assert (result['total_games'], result['failed_games'], result['game_errors']) == (1, 0, [])
+    assert [branch['id'] for branch in result['branches']] == ['branch_1', 'branch_2']
+
+
+def test_variation_attaches_to_position_before_move():
+    result = _parse('1. e4 (1. d4 d5 (1... Nf6 2. c4) 2. c4) (1. c4) 1... e5 *')
+    assert sorted(tuple(moves) for moves in _moves(result)) == [
+        ('c4',), ('d4', 'Nf6', 'c4'), ('d4', 'd5', 'c4'), ('e4', 'e5')]
+
+
+def test_deeply_nested_variations():
+    # 每一步都开一个变体并在变体里继续，嵌套深度远超递归限制
+    depth = sys.getrecursionlimit() + 200
+    board = chess.Board()
+    parts = []
+    for _ in range(depth):
+        main, alternative = list(board.legal_moves)[:2]
+        number = f'{board.fullmove_number}.' if board.turn == chess.WHITE else f'{board.fullmove_number}...'
+        parts.append(f'{number} {board.san(main)} ({number} {board.san(alternative)}')
+        board.push(alternative)
+    result = _parse(' '.join(parts) + ')' * depth + ' *')
+
+    assert result['success'] and result['total_nodes'] == 2 * depth + 1
+    assert len(result['branches']) == depth + 1 and result['branches'][-1]['depth'] == depth
+    assert len(_moves(result)[-1]) == depth
+
+
+def test_move_codes_round_trip():
+    moves = [chess.Move.from_uci(uci) for uci in ('e2e4', 'e1g1', 'h7h8q', 'a2a1n', 'b7a8r', 'g2h1b')]
+    moves.append(chess.Move.null())
+    for move in moves:
+        code = chess_app._encode_move(move)
+        assert 0 <= code < 1 << 16 and chess_app._decode_move(code) == move
+
+
+def test_branches_reference_leaves():
+    result = _parse(SAMPLE_PGN)
+    children = chess_app.tree_children(result['tree'])
+    for branch, moves in branch_moves(result):
+        assert set(branch) == {'id', 'leaf', 'depth'}
+        leaf = int(branch['leaf'][len('node_'):]) - 1
+        assert not children[leaf] and len(moves) == branch['depth']
+        assert moves[-1] == result['tree']['moves'][leaf]
+
+
+def test_no_games_is_an_error():
+    assert _parse('just some text')['error'] in ('无法解析PGN格式', '没有找到移动记录')
+    assert _parse('[Event "x"]\n\n*\n')['error'] == '没有找到移动记录'
+
+
+def test_upload_records_total_games(admin_client):
+    response = admin_client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(MULTI_GAME_PGN.encode('utf-8')), 'multi_game_import.pgn')
+    }, content_type='multipart/form-data')
+    result = response.get_json()
+    assert response.status_code == 200 and result['total_games'] == 4
+
+    pgn_id = result['game_id']
+    with chess_app.db_read() as conn:
+        assert conn.execute('SELECT total_games FROM pgn_games WHERE id = ?', (pgn_id,)).fetchone()[0] == 4
+    metadata = admin_client.get(f'/api/pgn/{pgn_id}').get_json()['metadata']
+    assert metadata['total_games'] == 4
+
+
+def test_upload_deep_line(admin_client):
+    # 马跳出再跳回重复300次，一条1200步的主线，嵌套存储或递归渲染都会超出递归限制
+    parts = []
+    for i in range(300):
+        parts.append(f'{2 * i + 1}. Nf3 Nf6 {2 * i + 2}. Ng1 Ng8')
+    content = '[Event "Deep"]\n\n' + ' '.join(parts) + ' *\n'
+    response = admin_client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(content.encode('utf-8')), 'deep_line.pgn')
+    }, content_type='multipart/form-data')
+    result = response.get_json()
+    assert response.status_code == 200, result
+    assert result['branches'] == [{'id': 'branch_1', 'leaf': 'node_1201', 'depth': 1200}]
+    assert result['tree_html'].count('class="tree-node') == 1201
+
+    data = admin_client.get(f'/api/pgn/{result["game_id"]}').get_json()
+    assert data['metadata']['total_branches'] == 1
+    [(_, moves)] = branch_moves(data)
+    assert moves == ['Nf3', 'Nf6', 'Ng1', 'Ng8'] * 300
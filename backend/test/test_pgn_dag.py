@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试DAG模式：不同走法次序到达的同一局面共用节点，转换边带走法信息，默认tree模式不变
+"""
+
+import io
+
+import chess
+
+from conftest import branch_moves, chess_app
+
+# 第二局换了走法次序，第5步到达与第一局相同的局面，之后多走一步
+TRANSPOSED_PGN = '''[Event "Catalan"]
+
+1. d4 Nf6 2. c4 e6 3. Nf3 d5 *
+
+[Event "Reti"]
+
+1. Nf3 Nf6 2. c4 e6 3. d4 d5 4. Bg5 *
+'''
+
+
+def _parse(content, dag):
+    return chess_app.PGNParser(dag=dag).parse_pgn_content(content)
+
+
+def _branches(result):
+    return [(moves, branch.get('transposition_to')) for branch, moves in branch_moves(result)]
+
+
+def _index(node_id):
+    return int(node_id[len('node_'):]) - 1
+
+
+def _ply(tree, node):
+    ply = 0
+    while tree['parents'][node] >= 0:
+        node = tree['parents'][node]
+        ply += 1
+    return ply
+
+
+def _board(tree, node_id):
+    # 节点不存FEN，从初始局面沿路径重放
+    path = []
+    node = _index(node_id)
+    while tree['parents'][node] >= 0:
+        path.append(tree['moves'][node])
+        node = tree['parents'][node]
+    board = chess.Board()
+    for san in reversed(path):
+        board.push_san(san)
+    return board
+
+
+def test_transposition_merged_into_existing_node():
+    result = _parse(TRANSPOSED_PGN, dag=True)
+    assert result['tree_mode'] == 'dag' and result['transpositions'] == 1
+
+    tree = result['tree']
+    moves, children = tree['moves'], chess_app.tree_children(tree)
+    [(link_id, target_id)] = tree['transpositions'].items()
+    link = _index(link_id)
+    assert (moves[link], _ply(tree, link)) == ('d4', 5)  # 3. d4
+    assert children[link] == []
+
+    # 转换到第一局的3. Nf3，第二局的4. Bg5合并到它后面
+    target = _index(target_id)
+    assert moves[target] == 'Nf3'
+    d5 = children[target][0]
+    assert moves[d5] == 'd5' and [moves[child] for child in children[d5]] == ['Bg5']
+
+    assert _branches(result) == [
+        (['d4', 'Nf6', 'c4', 'e6', 'Nf3', 'd5', 'Bg5'], None),
+        (['Nf3', 'Nf6', 'c4', 'e6', 'd4'], target_id),
+    ]
+    assert result['total_nodes'] == len(moves) == 13
+
+
+def test_tree_mode_unchanged():
+    result = _parse(TRANSPOSED_PGN, dag=False)
+    assert result['tree_mode'] == 'tree' and result['transpositions'] == 0
+    tree = result['tree']
+    assert len(tree['moves']) == result['total_nodes'] == 14
+    assert tree['transpositions'] == {} and 'fens' not in tree
+    assert [branch['depth'] for branch in result['branches']] == [6, 7]
+
+
+def test_repeated_position_at_other_ply_not_merged():
+    # 马跳出再跳回，回到初始局面但步数不同，合并会成环
+    result = _parse('1. Nf3 Nf6 2. Ng1 Ng8 3. e4 *', dag=True)
+    assert result['transpositions'] == 0
+    assert _branches(result) == [(['Nf3', 'Nf6', 'Ng1', 'Ng8', 'e4'], None)]
+
+
+def test_transposition_reaches_same_position():
+    result = _parse(TRANSPOSED_PGN, dag=True)
+    tree = result['tree']
+    # 转换边和它指向的已有节点是同一局面（半回合计数沿用各自的走法次序，只比较局面）
+    [(link_id, target_id)] = tree['transpositions'].items()
+    assert _board(tree, link_id).epd() == _board(tree, target_id).epd()
+
+
+def test_parser_instance_reused():
+    # 第二次解析不能沿用第一次的局面表，否则会把走法转换到上一棵树的节点
+    parser = chess_app.PGNParser(dag=True)
+    parser.parse_pgn_content('1. e4 *\n\n1. Nf3 Nf6 2. c4 e6 3. d4 d5 *')
+    catalan = '1. d4 Nf6 2. c4 e6 3. Nf3 d5 *'
+    result = parser.parse_pgn_content(catalan)
+    assert result == _parse(catalan, dag=True)
+    assert result['transpositions'] == 0 and result['total_nodes'] == 7
+
+
+def test_upload_tree_mode(admin_client):
+    response = admin_client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(TRANSPOSED_PGN.encode('utf-8')), 'pgn_dag_mode.pgn'),
+        'tree_mode': 'dag'
+    }, content_type='multipart/form-data')
+    result = response.get_json()
+    assert response.status_code == 200, result
+    assert 'transposition' in result['tree_html']
+
+    data = admin_client.get(f'/api/pgn/{result["game_id"]}').get_json()
+    assert data['tree_mode'] == 'dag' and data['metadata']['total_branches'] == 2
+
+    response = admin_client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(TRANSPOSED_PGN.encode('utf-8')), 'pgn_bad_mode.pgn'),
+        'tree_mode': 'graph'
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
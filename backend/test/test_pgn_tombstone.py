@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试PGN软删除：删除后立即不可见、删除耗时与关联数据量无关、后台清理按速率回收记录
+"""
+
+import io
+
+import pytest
+
+from conftest import SAMPLE_PGN, chess_app
+
+
+@pytest.fixture
+def runner(monkeypatch):
+    """停掉全局任务线程，换成只在测试里手动执行的执行器"""
+    chess_app.job_runner.close()
+    runner = chess_app.JobRunner(chunk_size=2, pause=0)
+    monkeypatch.setattr(runner, 'start', lambda: None)
+    monkeypatch.setattr(chess_app, 'job_runner', runner)
+    runner.run_pending()  # 先执行其他测试留下的任务
+    return runner
+
+
+def _practice(client, pgn_id, branches=3):
+    for i in range(branches):
+        client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id, 'branch_id': f'branch_{i + 1}', 'is_correct': True
+        })
+    chess_app.study_log_writer.flush()
+
+
+def _pgn_row(pgn_id):
+    with chess_app.db_read() as conn:
+        return conn.execute('SELECT deleted_at FROM pgn_games WHERE id = ?', (pgn_id,)).fetchone()
+
+
+def test_deleted_pgn_hidden_immediately(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+
+    assert admin_client.delete(f'/api/admin/pgn/{pgn_id}').status_code == 200
+    assert _pgn_row(pgn_id)[0] is not None  # 只是打上删除标记
+
+    for c in (client, admin_client):
+        assert pgn_id not in [item['id'] for item in c.get('/api/pgn-list').get_json()['data']]
+        latest = c.get('/api/latest-pgn').get_json()
+        assert latest.get('metadata', {}).get('id') != pgn_id
+        assert c.get(f'/api/pgn/{pgn_id}').status_code == 403
+        assert c.get(f'/api/progress/current-stats/{pgn_id}').status_code == 403
+    assert client.get('/api/progress/my').get_json()['progress'] == []
+    assert pgn_id not in [item['id'] for item in admin_client.get('/api/admin/pgn-list').get_json()['pgn_list']]
+    assert admin_client.delete(f'/api/admin/pgn/{pgn_id}').status_code == 404
+
+    runner.run_pending()
+    assert _pgn_row(pgn_id) is None
+
+
+def test_delete_cost_independent_of_data(runner, admin_client, make_user, upload_pgn):
+    counts = []
+    for branches in (1, 20):
+        client, user_id = make_user()
+        pgn_id = upload_pgn(grant_to=[user_id])
+        _practice(client, pgn_id, branches)
+
+        statements = []
+        original = chess_app.db_manager
+        chess_app.db_manager = chess_app.ConnectionManager(
+            chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=statements.append)
+        try:
+            assert admin_client.delete(f'/api/admin/pgn/{pgn_id}').status_code == 200
+        finally:
+            chess_app.db_manager.close_all()
+            chess_app.db_manager = original
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_reupload_after_delete_is_new_pgn(runner, admin_client, upload_pgn):
+    pgn_id = upload_pgn()
+    with chess_app.db_read() as conn:
+        filename = conn.execute('SELECT filename FROM pgn_games WHERE id = ?', (pgn_id,)).fetchone()[0]
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+
+    result = admin_client.post('/api/parse-pgn', data={
+        'file': (io.BytesIO(SAMPLE_PGN.encode('utf-8')), filename)
+    }, content_type='multipart/form-data').get_json()
+    assert result['game_id'] != pgn_id
+    assert not result.get('overwritten')
+
+
+def test_purge_rate_limited_and_rescheduled(runner, admin_client, make_user, upload_pgn, monkeypatch):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+    job_id = admin_client.delete(f'/api/admin/pgn/{pgn_id}').get_json()['job_id']
+    admin_client.post(f'/api/admin/jobs/{job_id}/cancel')
+
+    # 被取消的清理任务可以重新创建
+    with chess_app.db_write() as conn:
+        assert len(chess_app.schedule_pgn_purges(conn)) >= 1
+        assert chess_app.schedule_pgn_purges(conn) == []
+
+    monkeypatch.setitem(chess_app.JOB_HANDLERS['purge_pgn_data'], 'rows_per_second', 100)
+    job_id = runner.claim()
+    assert runner.run_chunk(job_id) == pytest.approx(1 / 100)  # 第一个分块删除该用户的一行汇总
+    runner.run_job(job_id)
+    runner.run_pending()
+    assert _pgn_row(pgn_id) is None
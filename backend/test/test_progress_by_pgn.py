@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 /api/progress/by-pgn：查询次数不随PGN数量增长，返回字段保持不变
+"""
+
+import pytest
+
+from conftest import chess_app
+
+EXPECTED_KEYS = {
+    'pgn_id', 'filename', 'total_branches', 'practiced_branches', 'completed_branches',
+    'mastered_branches', 'completion_rate', 'mastery_rate', 'total_correct', 'total_attempts',
+    'accuracy_rate', 'avg_mastery', 'last_practice_time', 'upload_time', 'status',
+    'status_class', 'notes'
+}
+
+
+@pytest.fixture
+def statements():
+    """临时把db_manager换成记录每条执行语句的连接管理器"""
+    statements = []
+    original = chess_app.db_manager
+    chess_app.db_manager = chess_app.ConnectionManager(
+        chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=statements.append)
+    try:
+        yield statements
+    finally:
+        chess_app.db_manager.close_all()
+        chess_app.db_manager = original
+
+
+def _practice(client, pgn_id):
+    for branch_id, is_correct in (('branch_1', True), ('branch_2', False), ('branch_2', True)):
+        client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id, 'branch_id': branch_id,
+            'is_correct': is_correct, 'is_branch_end': True
+        })
+
+
+def _count_queries(client, statements):
+    statements.clear()
+    response = client.get('/api/progress/by-pgn')
+    assert response.status_code == 200
+    return len(statements), response.get_json()['pgn_progress']
+
+
+def test_query_count_independent_of_pgn_count(statements, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_ids = [upload_pgn(grant_to=[user_id]) for _ in range(5)]
+
+    _practice(client, pgn_ids[0])
+    single_count, progress = _count_queries(client, statements)
+    assert len(progress) == 1
+
+    for pgn_id in pgn_ids[1:]:
+        _practice(client, pgn_id)
+    many_count, progress = _count_queries(client, statements)
+
+    assert len(progress) == len(pgn_ids)
+    assert many_count == single_count
+    assert many_count <= 3  # 版本号查询 + 角色查询 + 汇总查询
+
+
+def test_response_shape_unchanged(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+
+    entry = client.get('/api/progress/by-pgn').get_json()['pgn_progress'][0]
+    assert set(entry) == EXPECTED_KEYS
+    assert entry['pgn_id'] == pgn_id
+    assert (entry['practiced_branches'], entry['completed_branches'], entry['mastered_branches']) == (2, 2, 1)
+    assert (entry['total_correct'], entry['total_attempts']) == (2, 3)
+    assert entry['accuracy_rate'] == 66.7
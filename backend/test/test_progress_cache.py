@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 /api/progress/current-stats 的正确率计数缓存：命中只读资源版本号、写穿透、其他worker写入后作废、失效与回填竞争
+"""
+
+import pytest
+
+from conftest import chess_app
+
+
+@pytest.fixture
+def statements():
+    """临时把db_manager换成记录每条执行语句的连接管理器"""
+    statements = []
+    original = chess_app.db_manager
+    chess_app.db_manager = chess_app.ConnectionManager(
+        chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=statements.append)
+    try:
+        yield statements
+    finally:
+        chess_app.db_manager.close_all()
+        chess_app.db_manager = original
+
+
+def _post(client, pgn_id, branch_id, is_correct):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _stats(client, pgn_id):
+    return client.get(f'/api/progress/current-stats/{pgn_id}').get_json()
+
+
+def test_hit_only_reads_resource_versions(statements, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True)
+    assert _stats(client, pgn_id)['total_attempts'] == 1
+
+    hits_before = chess_app.progress_cache.stats['hits']
+    statements.clear()
+    assert _stats(client, pgn_id)['total_attempts'] == 1
+    assert len(statements) == 1 and 'resource_versions' in statements[0]
+    assert chess_app.progress_cache.stats['hits'] == hits_before + 1
+
+
+def test_write_from_other_worker_detected(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True)
+    assert _stats(client, pgn_id)['total_attempts'] == 1
+
+    # 其他worker的写入不经过本进程缓存，只改变数据库里的资源版本号
+    with chess_app.db_write() as conn:
+        chess_app.record_progress_attempt(conn, user_id, pgn_id, 'branch_2', False, False)
+    stale_before = chess_app.progress_cache.stats['stale']
+    assert chess_app.progress_cache.get(user_id, pgn_id) is None
+    assert chess_app.progress_cache.stats['stale'] == stale_before + 1
+    assert _stats(client, pgn_id)['total_attempts'] == 2
+
+    # 之后本进程的写入照常写穿透
+    _post(client, pgn_id, 'branch_1', True)
+    assert chess_app.progress_cache.get(user_id, pgn_id) == (2, 3)
+
+
+def test_writes_update_cached_counters(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _stats(client, pgn_id)
+
+    _post(client, pgn_id, 'branch_1', True)
+    _post(client, pgn_id, 'branch_2', False)
+    client.post('/api/progress/batch', json={'updates': [
+        {'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True}
+    ]})
+
+    assert chess_app.progress_cache.get(user_id, pgn_id) == (2, 3)
+    stats = _stats(client, pgn_id)
+    assert (stats['total_correct'], stats['total_attempts'], stats['accuracy_rate']) == (2, 3, 66.7)
+
+
+def test_reset_and_revoke_invalidate(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True)
+    _stats(client, pgn_id)
+
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    assert chess_app.progress_cache.get(user_id, pgn_id) is None
+    assert _stats(client, pgn_id)['total_attempts'] == 0
+
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}/permissions/{user_id}')
+    assert client.get(f'/api/progress/current-stats/{pgn_id}').status_code == 403
+
+
+def test_fill_skipped_when_write_races():
+    cache = chess_app.ProgressCounterCache()
+    resource_version = tuple(chess_app.get_resource_versions(('user', 1), ('pgn', 1)))
+    version = cache.snapshot_version(1, 1)
+    with cache.writing(1, [(1, True)]):
+        pass
+    # 读取期间有写入提交，读到的值可能已包含该写入，不能回填
+    cache.fill(1, 1, 5, 5, version, resource_version)
+    assert cache.get(1, 1) is None
+
+    version = cache.snapshot_version(1, 1)
+    with cache.writing(1, [(1, True)]):
+        cache.fill(1, 1, 5, 5, version, resource_version)
+    assert cache.get(1, 1) is None
+    assert cache.stats['fills_skipped'] == 2
+
+    cache.fill(1, 1, 5, 5, cache.snapshot_version(1, 1), resource_version)
+    assert cache.get(1, 1) == (5, 5)
+    with pytest.raises(RuntimeError):
+        with cache.writing(1, [(1, True)]):
+            raise RuntimeError('写入失败')
+    assert cache.get(1, 1) is None
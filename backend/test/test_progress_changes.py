@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 /api/progress/changes 增量同步：游标之后的变更、重置和删除标记、分页
+"""
+
+
+def _post(client, pgn_id, branch_id, is_correct=True, is_branch_end=True):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct, 'is_branch_end': is_branch_end
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _changes(client, since, **params):
+    response = client.get('/api/progress/changes', query_string={'since': since, **params})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _sync(client, since=0, local=None):
+    """模拟客户端：按页拉取并应用到本地副本，返回(本地进度, 游标)"""
+    local = {} if local is None else local
+    while True:
+        data = _changes(client, since, limit=2)
+        for item in data['removed']:
+            for key in [key for key in local if key[0] == item['pgn_game_id']]:
+                del local[key]
+        for row in data['changes']:
+            local[(row['pgn_game_id'], row['branch_id'])] = row['total_attempts']
+        since = data['cursor']
+        if not data['has_more']:
+            return local, since
+
+
+def _my_progress(client):
+    return {(row['pgn_game_id'], row['branch_id']): row['total_attempts']
+            for row in client.get('/api/progress/my').get_json()['progress']}
+
+
+def test_only_rows_changed_since_cursor(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1')
+    _post(client, pgn_id, 'branch_2', False)
+
+    local, cursor = _sync(client)
+    assert local == _my_progress(client) == {(pgn_id, 'branch_1'): 1, (pgn_id, 'branch_2'): 1}
+    assert _changes(client, cursor) == {
+        'success': True, 'cursor': cursor, 'has_more': False, 'changes': [], 'removed': []}
+
+    _post(client, pgn_id, 'branch_2')
+    data = _changes(client, cursor)
+    assert [(row['branch_id'], row['total_attempts']) for row in data['changes']] == [('branch_2', 2)]
+    assert data['cursor'] > cursor
+
+
+def test_other_users_changes_not_returned(make_user, upload_pgn):
+    client, user_id = make_user()
+    other, other_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id, other_id])
+    _, cursor = _sync(client)
+    _post(other, pgn_id, 'branch_1')
+    assert _changes(client, cursor)['changes'] == []
+
+
+def test_reset_and_delete_tombstones(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1')
+    _post(client, pgn_id, 'branch_2', False)
+    local, cursor = _sync(client)
+
+    # 普通重置：清空本地后只剩已掌握的分支
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    data = _changes(client, cursor)
+    assert [(item['pgn_game_id'], item['reason']) for item in data['removed']] == [(pgn_id, 'reset')]
+    local, cursor = _sync(client, cursor, local)
+    assert local == _my_progress(client) == {(pgn_id, 'branch_1'): 1}
+
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+    data = _changes(client, cursor)
+    assert [(item['pgn_game_id'], item['reason']) for item in data['removed']] == [(pgn_id, 'deleted')]
+    assert data['changes'] == []
+
+
+def test_delete_tombstones_only_for_own_pgns(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    other, other_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id, other_id])
+    hidden_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1')
+    _post(client, hidden_id, 'branch_1')
+    _, cursor = _sync(other)
+
+    # 其他用户没有进度的PGN被删除，不应出现在other的删除标记里
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+    admin_client.delete(f'/api/admin/pgn/{hidden_id}')
+    assert _changes(other, cursor)['removed'] == []
+    assert _changes(other, 0)['removed'] == []
+    assert sorted(item['pgn_game_id'] for item in _changes(client, 0)['removed']) == sorted([pgn_id, hidden_id])
+
+
+def test_paging_and_validation(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    for i in range(5):
+        _post(client, pgn_id, f'branch_{i}')
+
+    first = _changes(client, 0, limit=2)
+    assert first['has_more'] and len(first['changes']) <= 2
+    local, _ = _sync(client)
+    assert local == _my_progress(client)
+
+    assert client.get('/api/progress/changes?since=-1').status_code == 400
+    assert client.get('/api/progress/changes?since=abc').status_code == 400
+    assert client.get('/api/progress/changes?limit=0').status_code == 400
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试progress_rollup汇总表：触发器在各种进度写入后与重新聚合结果一致，重建命令能修复漂移
+"""
+
+from conftest import chess_app
+
+
+def _post(client, pgn_id, branch_id, is_correct, is_branch_end=False):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id,
+        'is_correct': is_correct, 'is_branch_end': is_branch_end
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _rollup(user_id, pgn_id):
+    with chess_app.db_read() as conn:
+        return conn.execute('''
+            SELECT practiced_branches, completed_branches, mastered_branches, total_correct, total_attempts
+            FROM progress_rollup WHERE user_id = ? AND pgn_game_id = ?
+        ''', (user_id, pgn_id)).fetchone()
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _drift():
+    # 在写事务里检查漂移后回滚，不改动数据
+    try:
+        with chess_app.db_write() as conn:
+            drifted = chess_app.rebuild_progress_rollup(conn)
+            raise _Rollback
+    except _Rollback:
+        return drifted
+
+
+def test_rollup_tracks_progress_writes(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    _post(client, pgn_id, 'branch_1', True, is_branch_end=True)
+    _post(client, pgn_id, 'branch_2', True)
+    _post(client, pgn_id, 'branch_2', False, is_branch_end=True)
+    _post(client, pgn_id, 'branch_3', True, is_branch_end=True)
+    assert _rollup(user_id, pgn_id) == (3, 2, 2, 3, 4)
+
+    # 只重置未掌握的分支
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    assert _rollup(user_id, pgn_id) == (2, 2, 2, 2, 2)
+    assert _drift() == 0
+
+    progress = client.get('/api/progress/by-pgn').get_json()['pgn_progress']
+    entry = next(item for item in progress if item['pgn_id'] == pgn_id)
+    assert entry['mastered_branches'] == 2
+    assert entry['total_attempts'] == 2
+
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    assert _rollup(user_id, pgn_id) is None
+    assert _drift() == 0
+
+
+def test_admin_views_read_rollup(admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True, is_branch_end=True)
+    _post(client, pgn_id, 'branch_2', False)
+
+    users = admin_client.get(f'/api/admin/pgn/{pgn_id}/users').get_json()['user_progress']
+    assert [(u['user_id'], u['practiced_branches'], u['mastered_branches'], u['total_attempts']) for u in users] == \
+        [(user_id, 2, 1, 2)]
+
+    pgn_list = admin_client.get('/api/admin/pgn-list').get_json()['pgn_list']
+    entry = next(item for item in pgn_list if item['id'] == pgn_id)
+    assert (entry['users_count'], entry['total_attempts']) == (1, 2)
+
+    user_progress = admin_client.get(f'/api/admin/users/{user_id}/progress').get_json()['data']
+    entry = next(item for item in user_progress if item['pgn_id'] == pgn_id)
+    assert entry['has_progress'] and entry['completed_branches'] == 1 and entry['total_correct'] == 1
+
+
+def test_rebuild_command_repairs_drift(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True)
+
+    with chess_app.db_write() as conn:
+        conn.execute('UPDATE progress_rollup SET total_attempts = 99 WHERE user_id = ? AND pgn_game_id = ?',
+                     (user_id, pgn_id))
+    assert _drift() == 1
+
+    result = chess_app.app.test_cli_runner().invoke(args=['rebuild-progress-rollup'])
+    assert result.exit_code == 0, result.output
+    assert _rollup(user_id, pgn_id) == (1, 0, 0, 1, 1)
+    assert _drift() == 0
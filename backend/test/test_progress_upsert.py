@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试 /api/progress/update 的单语句UPSERT：计数累加、掌握度、完成状态与语句数
+"""
+
+from conftest import chess_app
+
+
+def _branch(client, pgn_id, branch_id):
+    branches = client.get(f'/api/progress/branches/{pgn_id}').get_json()['branches']
+    return next(branch for branch in branches if branch['branch_id'] == branch_id)
+
+
+def _post(client, pgn_id, branch_id, is_correct, is_branch_end=False):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id,
+        'branch_id': branch_id,
+        'is_correct': is_correct,
+        'is_branch_end': is_branch_end
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def test_completed_branch_stays_completed(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    _post(client, pgn_id, 'branch_1', True, is_branch_end=True)
+    _post(client, pgn_id, 'branch_1', False)
+
+    branch = _branch(client, pgn_id, 'branch_1')
+    assert branch['is_completed'] == 1
+    assert branch['correct_count'] == 1
+    assert branch['total_attempts'] == 2
+
+
+def test_branch_end_requires_correct_move(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    _post(client, pgn_id, 'branch_2', True)
+    _post(client, pgn_id, 'branch_2', False, is_branch_end=True)
+    assert _branch(client, pgn_id, 'branch_2')['is_completed'] == 0
+
+    _post(client, pgn_id, 'branch_2', True, is_branch_end=True)
+    assert _branch(client, pgn_id, 'branch_2')['is_completed'] == 1
+
+
+def test_mastery_level_computed_in_sql(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    for is_correct in (True, True, False):
+        _post(client, pgn_id, 'branch_1', is_correct)
+
+    with chess_app.db_read() as conn:
+        mastery_level = conn.execute('''
+            SELECT mastery_level FROM user_progress
+            WHERE user_id = ? AND pgn_game_id = ? AND branch_id = ?
+        ''', (user_id, pgn_id, 'branch_1')).fetchone()[0]
+    assert mastery_level == 66
+
+
+def test_single_progress_statement_per_move(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    statements = []
+
+    with chess_app.db_write() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            chess_app.record_progress_attempt(conn, user_id, pgn_id, 'branch_1', True, False)
+        finally:
+            conn.set_trace_callback(chess_app.db_manager.trace_callback)
+
+    # progress_rollup触发器每执行一次，sqlite3的trace回调都会再报告一次触发它的语句
+    progress_statements = sorted({sql for sql in statements if 'user_progress' in sql})
+    assert len(progress_statements) == 1
+    assert 'ON CONFLICT' in progress_statements[0]
+
+
+def test_batch_matches_sequential_updates(make_user, upload_pgn):
+    sequential_client, sequential_user = make_user()
+    batch_client, batch_user = make_user()
+    pgn_id = upload_pgn(grant_to=[sequential_user, batch_user])
+    moves = [
+        ('branch_1', True, False),
+        ('branch_1', False, False),
+        ('branch_1', True, True),
+        ('branch_2', True, True),
+        ('branch_2', False, False),
+    ]
+
+    for branch_id, is_correct, is_branch_end in moves:
+        _post(sequential_client, pgn_id, branch_id, is_correct, is_branch_end)
+    response = batch_client.post('/api/progress/batch', json={'updates': [
+        {'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct, 'is_branch_end': is_branch_end}
+        for branch_id, is_correct, is_branch_end in moves
+    ]})
+    result = response.get_json()
+
+    assert response.status_code == 200, result
+    assert result['applied'] == len(moves)
+    assert result['stats'][str(pgn_id)] == {'total_correct': 3, 'total_attempts': 5, 'accuracy_rate': 60.0}
+    for branch_id in ('branch_1', 'branch_2'):
+        expected = _branch(sequential_client, pgn_id, branch_id)
+        actual = _branch(batch_client, pgn_id, branch_id)
+        for key in ('is_completed', 'correct_count', 'total_attempts'):
+            assert actual[key] == expected[key]
+
+
+def test_batch_rejects_invalid_entries(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    assert client.post('/api/progress/batch', json={'updates': []}).status_code == 400
+    response = client.post('/api/progress/batch', json={'updates': [
+        {'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True},
+        {'pgn_game_id': pgn_id}
+    ]})
+    assert response.status_code == 400
+    # 整批拒绝，不会写入前面的合法条目
+    assert client.get(f'/api/progress/current-stats/{pgn_id}').get_json()['total_attempts'] == 0
+
+
+def test_batch_requires_permission(make_user, upload_pgn):
+    client, _ = make_user()
+    pgn_id = upload_pgn()
+    response = client.post('/api/progress/batch', json={'updates': [
+        {'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True}
+    ]})
+    assert response.status_code == 403
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询计划检查
+
+记录各个API实际执行的SQL，对每条语句执行EXPLAIN QUERY PLAN，
+发布前确认热点查询都走索引、不会全表扫描。
+
+直接运行本脚本会打印完整的执行计划报告：python test/test_query_plans.py
+"""
+
+import io
+import uuid
+
+import pytest
+
+from conftest import SAMPLE_PGN, chess_app, login
+
+# 管理员列表类接口本来就要遍历整张表，允许全表扫描
+ALLOWED_FULL_SCANS = {
+    'users',           # 用户列表 / 权限设置中的全部用户
+    'u',               # get_pgn_user_progress / get_pgn_permissions中的users别名
+    'pg',              # 管理员PGN列表、用户进度中的全部PGN
+    'pgn_games',       # 管理员查看最新PGN列表
+}
+
+
+def exercise_routes(admin_client, make_user, upload_pgn):
+    """依次调用所有读写进度和PGN的接口"""
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    for i in range(3):
+        client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id, 'branch_id': f'branch_{i + 1}',
+            'is_correct': True, 'is_branch_end': True
+        })
+    client.get('/api/auth/me')
+    client.get('/api/progress/my')
+    client.get('/api/progress/stats')
+    client.get(f'/api/progress/current-stats/{pgn_id}')
+    client.get('/api/progress/by-pgn')
+    client.get(f'/api/progress/branches/{pgn_id}')
+    client.get('/api/latest-pgn')
+    client.get('/api/pgn-list')
+    client.get(f'/api/pgn/{pgn_id}')
+    client.put(f'/api/progress/branch-states/{pgn_id}', json={'states': {'branch_1': 'completed'}})
+    client.get(f'/api/progress/branch-states/{pgn_id}')
+    client.post('/api/progress/reset-memory-learning', json={'pgn_game_id': pgn_id})
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    client.post('/api/progress/hard-reset-all', json={'pgn_game_id': pgn_id})
+
+    admin_client.get('/api/admin/users')
+    admin_client.get(f'/api/admin/users/{user_id}/progress')
+    admin_client.get('/api/admin/pgn-list')
+    admin_client.get(f'/api/admin/pgn/{pgn_id}/users')
+    admin_client.get(f'/api/admin/pgn/{pgn_id}/permissions')
+    admin_client.post(f'/api/admin/pgn/{pgn_id}/users/{user_id}/reset')
+    admin_client.get('/api/latest-pgn')
+    admin_client.get('/api/progress/by-pgn')
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}/permissions/{user_id}')
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+
+
+@pytest.fixture
+def recorder():
+    """临时把db_manager换成记录查询的连接管理器"""
+    recorder = chess_app.QueryPlanRecorder()
+    original = chess_app.db_manager
+    chess_app.db_manager = chess_app.ConnectionManager(
+        chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=recorder)
+    try:
+        yield recorder
+    finally:
+        chess_app.db_manager.close_all()
+        chess_app.db_manager = original
+
+
+def test_schema_version_recorded():
+    with chess_app.db_read() as conn:
+        version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    assert version == chess_app.SCHEMA_MIGRATIONS[-1][0]
+
+
+def test_migrations_are_idempotent():
+    assert chess_app.run_migrations() == []
+
+
+def test_hot_queries_use_indexes(recorder, admin_client, make_user, upload_pgn):
+    exercise_routes(admin_client, make_user, upload_pgn)
+    with chess_app.db_read() as conn:
+        plans = recorder.report(conn)
+
+    assert plans
+    offenders = []
+    for plan in plans:
+        for detail in plan['full_scans']:
+            table = detail.split()[1]
+            if table not in ALLOWED_FULL_SCANS:
+                offenders.append((plan['sql'], detail))
+    assert not offenders, offenders
+
+
+def print_report():
+    recorder = chess_app.QueryPlanRecorder()
+    chess_app.db_manager = chess_app.ConnectionManager(
+        chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=recorder)
+
+    admin_client = chess_app.app.test_client()
+    login(admin_client, 'admin', 'admin123')
+
+    def make_user():
+        username = f'user_{uuid.uuid4().hex[:10]}'
+        user_id = admin_client.post('/api/admin/users', json={
+            'username': username, 'password': 'secret123'}).get_json()['user_id']
+        client = chess_app.app.test_client()
+        login(client, username, 'secret123')
+        return client, user_id
+
+    def upload_pgn(grant_to=()):
+        response = admin_client.post('/api/parse-pgn', data={
+            'file': (io.BytesIO(SAMPLE_PGN.encode('utf-8')), f'plan_{uuid.uuid4().hex[:10]}.pgn')
+        }, content_type='multipart/form-data')
+        pgn_id = response.get_json()['game_id']
+        for user_id in grant_to:
+            admin_client.post(f'/api/admin/pgn/{pgn_id}/permissions', json={'user_id': user_id})
+        return pgn_id
+
+    exercise_routes(admin_client, make_user, upload_pgn)
+    with chess_app.db_read() as conn:
+        plans = recorder.report(conn)
+
+    print("🔍 查询计划报告")
+    print("=" * 60)
+    for plan in plans:
+        marker = '❌' if plan['full_scans'] else '✅'
+        print(f"\n{marker} {plan['sql']}")
+        for detail in plan['plan']:
+            print(f"      {detail}")
+    print("\n" + "=" * 60)
+    print(f"共 {len(plans)} 种查询，{sum(1 for p in plans if p['full_scans'])} 种包含全表扫描")
+
+
+if __name__ == '__main__':
+    print_report()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试重置纪元：重置只写纪元和汇总行，旧数据立即不可见，后台清理分批删除旧行且不影响汇总
+"""
+
+import pytest
+
+from conftest import chess_app
+
+
+@pytest.fixture
+def sweeper(monkeypatch):
+    """换成不自动启动后台线程、每次只删一行的清理器，方便观察分批清理"""
+    sweeper = chess_app.StaleProgressSweeper(chunk_size=1, pause=0)
+    monkeypatch.setattr(sweeper, 'wake', lambda: None)
+    monkeypatch.setattr(chess_app, 'progress_sweeper', sweeper)
+    return sweeper
+
+
+def _post(client, pgn_id, branch_id, is_correct, is_branch_end=False):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id,
+        'is_correct': is_correct, 'is_branch_end': is_branch_end
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _practice(client, pgn_id):
+    # branch_1 已掌握，branch_2 未掌握，branch_3 只做过一次
+    _post(client, pgn_id, 'branch_1', True, is_branch_end=True)
+    _post(client, pgn_id, 'branch_2', False, is_branch_end=True)
+    _post(client, pgn_id, 'branch_3', True)
+
+
+def _branches(client, pgn_id):
+    data = client.get(f'/api/progress/branches/{pgn_id}').get_json()
+    return {b['branch_id']: b['total_attempts'] for b in data['branches']}
+
+
+def _raw_counts(user_id, pgn_id):
+    chess_app.study_log_writer.flush()
+    with chess_app.db_read() as conn:
+        progress = conn.execute('SELECT COUNT(*) FROM user_progress WHERE user_id = ? AND pgn_game_id = ?',
+                                (user_id, pgn_id)).fetchone()[0]
+        logs = conn.execute('SELECT COUNT(*) FROM user_study_logs WHERE user_id = ? AND pgn_game_id = ?',
+                            (user_id, pgn_id)).fetchone()[0]
+    return progress, logs
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _drift():
+    # 在写事务里检查漂移后回滚，不改动数据
+    try:
+        with chess_app.db_write() as conn:
+            drifted = chess_app.rebuild_progress_rollup(conn)
+            raise _Rollback
+    except _Rollback:
+        return drifted
+
+
+def test_soft_reset_keeps_mastered_branches(sweeper, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+
+    response = client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    assert response.status_code == 200
+    assert _branches(client, pgn_id) == {'branch_1': 1}
+    assert _raw_counts(user_id, pgn_id)[0] == 3  # 旧行还在，只是不可见
+    assert _drift() == 0
+
+    # 对旧纪元的行再次练习，应当从零开始计数
+    _post(client, pgn_id, 'branch_2', True)
+    assert _branches(client, pgn_id) == {'branch_1': 1, 'branch_2': 1}
+    stats = client.get(f'/api/progress/current-stats/{pgn_id}').get_json()
+    assert (stats['total_correct'], stats['total_attempts']) == (2, 2)
+    assert _drift() == 0
+
+
+def test_hard_reset_hides_everything(sweeper, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    assert _branches(client, pgn_id) == {}
+    assert client.get(f'/api/progress/current-stats/{pgn_id}').get_json()['total_attempts'] == 0
+    progress = client.get('/api/progress/by-pgn').get_json()['pgn_progress']
+    assert all(item['pgn_id'] != pgn_id for item in progress)
+    assert client.get('/api/progress/stats').get_json()['stats']['total_attempts'] == 0
+    # 每日活动随旧日志被后台清理而扣减
+    sweeper.sweep_all()
+    assert client.get('/api/progress/stats').get_json()['daily_stats'] == []
+
+
+def test_reset_cost_independent_of_history(sweeper, make_user, upload_pgn):
+    counts = []
+    for branches in (1, 20):
+        client, user_id = make_user()
+        pgn_id = upload_pgn(grant_to=[user_id])
+        for i in range(branches):
+            _post(client, pgn_id, f'branch_{i}', True)
+        chess_app.study_log_writer.flush()
+
+        statements = []
+        original = chess_app.db_manager
+        chess_app.db_manager = chess_app.ConnectionManager(
+            chess_app.DATABASE_PATH, chess_app.DB_PRAGMAS, trace_callback=statements.append)
+        try:
+            client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+        finally:
+            chess_app.db_manager.close_all()
+            chess_app.db_manager = original
+        counts.append(len(statements))
+    assert counts[0] == counts[1]
+
+
+def test_sweeper_deletes_stale_rows_in_chunks(sweeper, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _practice(client, pgn_id)
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    assert _raw_counts(user_id, pgn_id) == (3, 3)
+
+    chunks = 0
+    while sweeper.sweep_chunk():
+        chunks += 1
+    # 两行未掌握的进度和两条对应日志，每个事务只删一行
+    assert chunks >= 4
+    assert sweeper.stats['progress_deleted'] >= 2
+    assert _raw_counts(user_id, pgn_id) == (1, 1)
+    assert _branches(client, pgn_id) == {'branch_1': 1}
+    assert _drift() == 0
+
+    # 已清理完的纪元不会再被处理
+    assert not sweeper.sweep_chunk()
+
+
+def _epoch_rows(pgn_id):
+    with chess_app.db_read() as conn:
+        return conn.execute('SELECT COUNT(*) FROM progress_epochs WHERE pgn_game_id = ?', (pgn_id,)).fetchone()[0]
+
+
+def test_reset_rejects_invalid_or_missing_pgn(sweeper, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    for route in ('/api/progress/reset', '/api/progress/hard-reset', '/api/progress/hard-reset-all'):
+        assert client.post(route, json={'pgn_game_id': 'abc'}).status_code == 400
+
+    assert client.post('/api/progress/reset', json={'pgn_game_id': 999999}).status_code == 404
+    assert _epoch_rows(999999) == 0
+
+    # 没有授权的PGN不能重置
+    pgn_id = upload_pgn()
+    assert client.post('/api/progress/reset', json={'pgn_game_id': pgn_id}).status_code == 403
+
+    # 已删除（等待清理）的PGN视为不存在
+    admin_client.post(f'/api/admin/pgn/{pgn_id}/permissions', json={'user_id': user_id})
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+    assert client.post('/api/progress/reset', json={'pgn_game_id': pgn_id}).status_code == 404
+    assert _epoch_rows(pgn_id) == 0
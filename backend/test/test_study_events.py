@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试学习日志事件段：定长记录编码、读取接口、每日活动、重置清理、压缩与PGN清理
+"""
+
+import pytest
+
+from conftest import chess_app
+
+
+@pytest.fixture
+def events(monkeypatch):
+    """切换到事件段格式，清理器不自动启动"""
+    monkeypatch.setattr(chess_app, 'STUDY_LOG_FORMAT', 'events')
+    sweeper = chess_app.StaleProgressSweeper(pause=0)
+    monkeypatch.setattr(sweeper, 'wake', lambda: None)
+    monkeypatch.setattr(chess_app, 'progress_sweeper', sweeper)
+    return sweeper
+
+
+def _post(client, pgn_id, branch_id, is_correct, duration=0, is_branch_end=False):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct,
+        'duration': duration, 'is_branch_end': is_branch_end
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def _logs(user_id):
+    chess_app.study_log_writer.flush()
+    with chess_app.db_read() as conn:
+        return list(chess_app.iter_study_logs(conn, user_id=user_id))
+
+
+def _segments(user_id):
+    chess_app.study_log_writer.flush()
+    with chess_app.db_read() as conn:
+        return conn.execute('''
+            SELECT branches, LENGTH(events), count, correct, duration FROM study_event_segments
+            WHERE user_id = ? ORDER BY id
+        ''', (user_id,)).fetchall()
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _drift():
+    # 在写事务里检查漂移后回滚，不改动数据
+    try:
+        with chess_app.db_write() as conn:
+            drifted = chess_app.rebuild_daily_activity(conn)
+            raise _Rollback
+    except _Rollback:
+        return drifted
+
+
+def test_events_stored_as_fixed_width_records(events, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True, duration=5)
+    _post(client, pgn_id, 'branch_2', False, duration=3)
+    _post(client, pgn_id, 'branch_1', True)
+
+    logs = _logs(user_id)
+    assert [(log['id'], log['branch_id'], log['result'], log['duration_seconds']) for log in logs] == [
+        (None, 'branch_1', 'correct', 5), (None, 'branch_2', 'incorrect', 3), (None, 'branch_1', 'correct', 0)]
+    assert all(log['action'] == 'practice' and log['pgn_game_id'] == pgn_id for log in logs)
+    size = chess_app.STUDY_EVENT_RECORD.size
+    assert _segments(user_id) == [('["branch_1", "branch_2"]', 3 * size, 3, 2, 8)]
+
+    daily = client.get('/api/progress/stats').get_json()['daily_stats']
+    assert [(d['count'], d['correct'], d['duration']) for d in daily] == [(3, 2, 8)]
+    assert _drift() == 0
+
+
+def test_append_does_not_rewrite_existing_records(events, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True, duration=5)
+    chess_app.study_log_writer.flush()
+
+    statements = []
+    with chess_app.db_write() as conn:
+        conn.set_trace_callback(statements.append)
+        chess_app.insert_study_logs(conn, [
+            chess_app._study_log_params(user_id, pgn_id, 'branch_2', False, 3),
+            chess_app._study_log_params(user_id, pgn_id, 'branch_1', True, 1)])
+        conn.set_trace_callback(None)
+    # 只读段头，新记录拼接在段尾，已有记录不经过Python
+    selects = [sql for sql in statements if 'study_event_segments' in sql and 'SELECT' in sql]
+    assert selects and not any('events FROM' in sql or 'base_time' in sql for sql in selects)
+
+    size = chess_app.STUDY_EVENT_RECORD.size
+    assert _segments(user_id) == [('["branch_1", "branch_2"]', 3 * size, 3, 2, 9)]
+    with chess_app.db_read() as conn:
+        assert conn.execute('SELECT typeof(events) FROM study_event_segments WHERE user_id = ?',
+                            (user_id,)).fetchone()[0] == 'blob'
+    assert [(log['branch_id'], log['result'], log['duration_seconds']) for log in _logs(user_id)] == [
+        ('branch_1', 'correct', 5), ('branch_2', 'incorrect', 3), ('branch_1', 'correct', 1)]
+    assert _drift() == 0
+
+
+def test_segments_roll_over_and_unencodable_rows(events, monkeypatch, make_user, upload_pgn):
+    monkeypatch.setattr(chess_app, 'STUDY_EVENT_SEGMENT_MAX_EVENTS', 2)
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    for i in range(5):
+        _post(client, pgn_id, f'branch_{i}', True)
+    _post(client, pgn_id, 'branch_1', True, duration=100000)  # 用时超出记录范围，按行存储
+
+    assert [count for _, _, count, _, _ in _segments(user_id)] == [2, 2, 1]
+    logs = _logs(user_id)
+    assert len(logs) == 6 and logs[0]['id'] is not None
+    assert _drift() == 0
+
+
+def test_non_integer_durations_encoded(events, make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    writer = chess_app.StudyLogWriter(enabled=True, flush_size=100, flush_interval=60)
+    # 绕过路由校验直接入队：小数和数字字符串按整数编码，无法转换的一条单独丢弃，不影响同批其他日志
+    writer.enqueue([chess_app._study_log_params(user_id, pgn_id, 'branch_1', True, duration)
+                    for duration in (2.7, '4', 'abc', 3)])
+    assert writer.flush() == 3
+    writer.close()
+    assert writer.stats['rejected'] == 1 and writer.pending() == 0
+
+    assert [(count, duration) for _, _, count, _, duration in _segments(user_id)] == [(3, 9)]
+    assert [log['duration_seconds'] for log in _logs(user_id)] == [2, 4, 3]
+    assert _drift() == 0
+
+
+def test_reset_sweeps_segment_records(events, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _post(client, pgn_id, 'branch_1', True, is_branch_end=True)
+    _post(client, pgn_id, 'branch_2', False, is_branch_end=True)
+    assert len(_segments(user_id)) == 1
+
+    # 普通重置只保留已掌握分支的记录
+    client.post('/api/progress/reset', json={'pgn_game_id': pgn_id})
+    events.sweep_all()
+    assert [log['branch_id'] for log in _logs(user_id)] == ['branch_1']
+    daily = client.get('/api/progress/stats').get_json()['daily_stats']
+    assert [d['count'] for d in daily] == [1]
+    assert _drift() == 0
+    assert events.sweep_all() == 0  # 处理过的段不会重复处理
+
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    events.sweep_all()
+    assert _segments(user_id) == []
+    assert client.get('/api/progress/stats').get_json()['daily_stats'] == []
+    assert _drift() == 0
+
+
+def test_compaction_and_purge_cover_segments(events, monkeypatch, tmp_path, admin_client, make_user, upload_pgn):
+    monkeypatch.setattr(chess_app, 'STUDY_LOG_ARCHIVE_DIR', str(tmp_path))
+    chess_app.job_runner.close()
+    runner = chess_app.JobRunner(chunk_size=2, pause=0)
+    monkeypatch.setattr(runner, 'start', lambda: None)
+    monkeypatch.setattr(chess_app, 'job_runner', runner)
+    runner.run_pending()
+
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    with chess_app.db_write() as conn:
+        chess_app.insert_study_logs(conn, [
+            (user_id, pgn_id, 'branch_1', 'practice', 'correct', 4, '2020-01-01 10:00:00'),
+            (user_id, pgn_id, 'branch_1', 'practice', 'incorrect', 1, '2020-01-01 10:00:30'),
+        ])
+    assert len(_segments(user_id)) == 1
+
+    with chess_app.db_write() as conn:
+        chess_app.enqueue_study_log_compaction(conn, 30)
+    runner.run_pending()
+    assert _segments(user_id) == []
+    with chess_app.db_read() as conn:
+        summary = conn.execute('SELECT count, correct, duration FROM study_log_summaries WHERE user_id = ?',
+                               (user_id,)).fetchone()
+    assert summary == (2, 1, 5)
+    archived = [r for r in chess_app.read_study_log_archive('2020-01-01') if r['user_id'] == user_id]
+    assert [r['created_at'] for r in archived] == ['2020-01-01 10:00:00', '2020-01-01 10:00:30']
+    assert _drift() == 0
+
+    _post(client, pgn_id, 'branch_1', True)
+    assert len(_segments(user_id)) == 1
+    admin_client.delete(f'/api/admin/pgn/{pgn_id}')
+    runner.run_pending()
+    assert _segments(user_id) == []
+    assert _drift() == 0
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试学习日志保留：过期日志归档为gzip NDJSON并压缩为每日汇总，统计不变，可从归档恢复
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import chess_app
+
+
+@pytest.fixture
+def runner(monkeypatch, tmp_path):
+    """停掉全局任务线程换成手动执行器，归档写到临时目录"""
+    monkeypatch.setattr(chess_app, 'STUDY_LOG_ARCHIVE_DIR', str(tmp_path))
+    chess_app.job_runner.close()
+    runner = chess_app.JobRunner(chunk_size=2, pause=0)
+    monkeypatch.setattr(runner, 'start', lambda: None)
+    monkeypatch.setattr(chess_app, 'job_runner', runner)
+    runner.run_pending()  # 先执行其他测试留下的任务
+    return runner
+
+
+def _days_ago(days):
+    return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _seed(user_id, pgn_id):
+    """写入20天前的三条日志和一条当天的日志"""
+    old = _days_ago(20)
+    rows = [
+        (user_id, pgn_id, 'branch_1', 'practice', 'correct', 5, old),
+        (user_id, pgn_id, 'branch_1', 'practice', 'incorrect', 3, old),
+        (user_id, pgn_id, 'branch_2', 'practice', 'correct', 2, old),
+        (user_id, pgn_id, 'branch_1', 'practice', 'correct', 1, _days_ago(0)),
+    ]
+    with chess_app.db_write() as conn:
+        chess_app.insert_study_logs(conn, rows)
+    return old[:10]
+
+
+def _counts(user_id):
+    with chess_app.db_read() as conn:
+        logs = conn.execute('SELECT COUNT(*) FROM user_study_logs WHERE user_id = ?', (user_id,)).fetchone()[0]
+        summaries = conn.execute('''
+            SELECT branch_id, day, count, correct, duration FROM study_log_summaries
+            WHERE user_id = ? ORDER BY branch_id
+        ''', (user_id,)).fetchall()
+    return logs, summaries
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _drift():
+    # 在写事务里检查漂移后回滚，不改动数据
+    try:
+        with chess_app.db_write() as conn:
+            drifted = chess_app.rebuild_daily_activity(conn)
+            raise _Rollback
+    except _Rollback:
+        return drifted
+
+
+def _compact(admin_client, runner, retention_days=10):
+    response = admin_client.post('/api/admin/study-logs/compact', json={'retention_days': retention_days})
+    assert response.status_code == 200, response.get_json()
+    runner.run_pending()
+    return response.get_json()['job_id']
+
+
+def test_compaction_archives_and_summarizes(runner, admin_client, make_user, upload_pgn, tmp_path):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    old_day = _seed(user_id, pgn_id)
+    daily_before = client.get('/api/progress/stats').get_json()['daily_stats']
+
+    job_id = _compact(admin_client, runner)
+    job = admin_client.get(f'/api/admin/jobs/{job_id}').get_json()['job']
+    assert job['status'] == 'completed' and job['processed'] >= 3
+
+    logs, summaries = _counts(user_id)
+    assert logs == 1
+    assert summaries == [('branch_1', old_day, 2, 1, 8), ('branch_2', old_day, 1, 1, 2)]
+    archived = [r for r in chess_app.read_study_log_archive(old_day) if r['user_id'] == user_id]
+    assert len(archived) == 3 and (tmp_path / f'study_logs_{old_day}.ndjson.gz').exists()
+
+    assert client.get('/api/progress/stats').get_json()['daily_stats'] == daily_before
+    assert _drift() == 0
+
+    assert admin_client.post('/api/admin/study-logs/compact', json={'retention_days': -1}).status_code == 400
+
+
+def test_restore_from_archive(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    old_day = _seed(user_id, pgn_id)
+    _compact(admin_client, runner)
+    daily_before = client.get('/api/progress/stats').get_json()['daily_stats']
+
+    result = chess_app.app.test_cli_runner().invoke(args=['restore-study-logs', old_day])
+    assert result.exit_code == 0, result.output
+    assert _counts(user_id) == (4, [])
+    assert client.get('/api/progress/stats').get_json()['daily_stats'] == daily_before
+    assert _drift() == 0
+
+    # 已恢复的日志不会重复写回
+    records = [r for r in chess_app.read_study_log_archive(old_day) if r['user_id'] == user_id]
+    with chess_app.db_write() as conn:
+        assert chess_app.restore_study_logs(conn, records) == 0
+
+
+def test_reset_clears_compacted_summaries(runner, admin_client, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    _seed(user_id, pgn_id)
+    _compact(admin_client, runner)
+
+    client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    chess_app.StaleProgressSweeper(pause=0).sweep_all()
+    assert _counts(user_id) == (0, [])
+    assert client.get('/api/progress/stats').get_json()['daily_stats'] == []
+    assert _drift() == 0
+
+
+def test_periodic_scheduling(runner, monkeypatch):
+    runner.run_pending()
+    monkeypatch.setattr(chess_app, 'STUDY_LOG_COMPACT_INTERVAL', 3600)
+    with chess_app.db_write() as conn:
+        conn.execute("UPDATE background_jobs SET created_at = datetime('now', '-2 hours') WHERE kind = 'compact_study_logs'")
+
+    job_id = chess_app.schedule_study_log_compaction()
+    assert job_id is not None
+    assert chess_app.schedule_study_log_compaction() is None  # 已有待执行的压缩任务
+    runner.run_pending()
+    assert chess_app.schedule_study_log_compaction() is None  # 距上次压缩不足间隔
+
+    monkeypatch.setattr(chess_app, 'STUDY_LOG_RETENTION_DAYS', 0)
+    monkeypatch.setattr(chess_app, 'STUDY_LOG_COMPACT_INTERVAL', 0)
+    assert chess_app.schedule_study_log_compaction() is None  # 关闭保留期后不再压缩
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试学习日志后写缓冲：批量写入、提交后入队、背压与丢弃、重置时不会把旧日志写回
+"""
+
+import time
+
+from conftest import chess_app
+
+
+def _log_count(user_id, pgn_id):
+    with chess_app.db_read() as conn:
+        return conn.execute('SELECT COUNT(*) FROM user_study_logs WHERE user_id = ? AND pgn_game_id = ?',
+                            (user_id, pgn_id)).fetchone()[0]
+
+
+def _post(client, pgn_id, branch_id, is_correct=True):
+    response = client.post('/api/progress/update', json={
+        'pgn_game_id': pgn_id, 'branch_id': branch_id, 'is_correct': is_correct
+    })
+    assert response.status_code == 200, response.get_json()
+
+
+def test_logs_written_after_flush(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    for i in range(5):
+        _post(client, pgn_id, 'branch_1', i % 2 == 0)
+    chess_app.study_log_writer.flush()
+
+    assert _log_count(user_id, pgn_id) == 5
+    with chess_app.db_read() as conn:
+        results = [row[0] for row in conn.execute('''
+            SELECT result FROM user_study_logs WHERE user_id = ? AND pgn_game_id = ? ORDER BY id
+        ''', (user_id, pgn_id))]
+    assert results == ['correct', 'incorrect', 'correct', 'incorrect', 'correct']
+
+
+class _Rollback(Exception):
+    pass
+
+
+def test_enqueue_only_after_commit(make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    writer = chess_app.StudyLogWriter(enabled=True, flush_size=100, flush_interval=60)
+    row = chess_app._study_log_params(user_id, pgn_id, 'branch_1', True)
+
+    with chess_app.db_write() as conn:
+        writer.write(conn, [row])
+        assert writer.pending() == 0
+    assert writer.pending() == 1
+
+    # 事务回滚时日志不入队
+    try:
+        with chess_app.db_write() as conn:
+            writer.write(conn, [row])
+            raise _Rollback
+    except _Rollback:
+        pass
+    assert writer.pending() == 1
+    writer.close()
+
+
+def test_group_commit_op_rollback_drops_its_logs(make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    writer = chess_app.StudyLogWriter(enabled=True, flush_size=100, flush_interval=60)
+    committer = chess_app.GroupCommitter(window_ms=1)
+    row = chess_app._study_log_params(user_id, pgn_id, 'branch_1', True)
+
+    def failing(conn):
+        writer.write(conn, [row])
+        raise _Rollback
+
+    try:
+        committer.run(failing)
+    except _Rollback:
+        pass
+    assert writer.pending() == 0
+
+    committer.run(lambda conn: writer.write(conn, [row]))
+    assert writer.pending() == 1
+    writer.close()
+
+
+def test_buffer_full_inside_write_transaction(make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    writer = chess_app.StudyLogWriter(enabled=True, flush_size=100, flush_interval=60, capacity=2,
+                                      backpressure_timeout=5)
+    row = chess_app._study_log_params(user_id, pgn_id, 'branch_1', True)
+
+    # 在写事务里把缓冲区写满再多写一条：提交后放不下的直接丢弃，不在写锁内等待
+    started = time.monotonic()
+    with chess_app.db_write() as conn:
+        writer.write(conn, [row, row])
+        writer.write(conn, [row])
+    assert time.monotonic() - started < 1
+    assert writer.pending() == 2
+    assert writer.stats['dropped'] == 1
+
+    # 背压在写事务外等待，后台线程拿得到写锁，写入后腾出空间
+    assert writer.wait_for_room(1)
+    assert writer.stats['backpressure_waits'] == 1
+    writer.close()
+    assert _log_count(user_id, pgn_id) == 2
+
+
+def test_hard_reset_removes_pending_logs(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    _post(client, pgn_id, 'branch_1')
+    _post(client, pgn_id, 'branch_2')
+    response = client.post('/api/progress/hard-reset', json={'pgn_game_id': pgn_id})
+    assert response.status_code == 200
+    chess_app.study_log_writer.flush()
+    # 重置只切换纪元，旧日志由后台清理任务删除
+    chess_app.progress_sweeper.sweep_all()
+
+    assert _log_count(user_id, pgn_id) == 0
+
+
+def test_synchronous_mode_writes_in_transaction(monkeypatch, make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    monkeypatch.setattr(chess_app.study_log_writer, 'enabled', False)
+
+    _post(client, pgn_id, 'branch_1')
+    assert _log_count(user_id, pgn_id) == 1
+
+
+def test_invalid_duration_rejected(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    for duration in ('5', -1, 1.5, True, None):
+        response = client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True, 'duration': duration
+        })
+        assert response.status_code == 400, duration
+        response = client.post('/api/progress/batch', json={'updates': [
+            {'pgn_game_id': pgn_id, 'branch_id': 'branch_1', 'is_correct': True, 'duration': 3},
+            {'pgn_game_id': pgn_id, 'branch_id': 'branch_2', 'is_correct': True, 'duration': duration}
+        ]})
+        assert response.status_code == 400, duration
+        assert '第 2 条' in response.get_json()['error']
+
+    # 被拒绝的请求不写入进度也不产生日志，之后的合法日志照常写入
+    _post(client, pgn_id, 'branch_1')
+    chess_app.study_log_writer.flush()
+    assert _log_count(user_id, pgn_id) == 1
+
+
+def test_bad_row_does_not_block_later_logs(make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    writer = chess_app.StudyLogWriter(enabled=True, flush_size=100, flush_interval=60)
+    bad = chess_app._study_log_params(user_id, pgn_id, 'branch_1', True, 'abc')
+
+    # 绕过路由校验直接入队：整批写入失败后逐条重试，只丢弃出错的一条
+    writer.enqueue([chess_app._study_log_params(user_id, pgn_id, 'branch_1', True, 2), bad])
+    writer.enqueue([chess_app._study_log_params(user_id, pgn_id, 'branch_2', False, 3)])
+    assert writer.flush() == 2
+    assert writer.pending() == 0
+    assert writer.stats['rejected'] == 1 and writer.stats['written'] == 2
+    assert _log_count(user_id, pgn_id) == 2
+
+    writer.enqueue([chess_app._study_log_params(user_id, pgn_id, 'branch_3', True, 4)])
+    assert writer.flush() == 1
+    writer.close()
+    assert _log_count(user_id, pgn_id) == 3
+    with chess_app.db_read() as conn:
+        assert conn.execute('SELECT SUM(duration) FROM daily_activity WHERE user_id = ?',
+                            (user_id,)).fetchone()[0] == 9
+
+
+def test_failed_transaction_retried_then_dropped(monkeypatch, make_user, upload_pgn):
+    _, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    writer = chess_app.StudyLogWriter(enabled=True, flush_size=100, flush_interval=60, flush_max_retries=2)
+    writer.enqueue([chess_app._study_log_params(user_id, pgn_id, 'branch_1', True)])
+
+    def busy():
+        raise chess_app.DatabaseBusyError('数据库繁忙')
+
+    # 写事务失败时放回缓冲区，连续失败达到上限后丢弃，不会无限重试
+    monkeypatch.setattr(chess_app, 'db_write', busy)
+    assert writer.flush() == 0 and writer.pending() == 1
+    assert writer.flush() == 0 and writer.pending() == 0
+    assert writer.stats['dropped'] == 1 and writer.stats['flush_errors'] == 2
+    monkeypatch.undo()
+    writer.close()
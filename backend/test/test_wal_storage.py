@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试WAL模式下读写分离：读查询不等待写锁，写事务串行且原子
+"""
+
+import threading
+
+import pytest
+
+from conftest import chess_app
+
+
+def test_journal_mode_is_wal():
+    with chess_app.db_read() as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone()[0].lower() == 'wal'
+
+
+def test_reader_not_blocked_by_open_write_transaction(make_user):
+    _, user_id = make_user()
+    writer_started = threading.Event()
+    release_writer = threading.Event()
+
+    def writer():
+        with chess_app.db_write() as conn:
+            conn.execute('UPDATE users SET login_count = login_count + 100 WHERE id = ?', (user_id,))
+            writer_started.set()
+            release_writer.wait(5)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        assert writer_started.wait(5)
+        # 写事务未提交时读查询立即返回旧快照
+        with chess_app.db_read() as conn:
+            count = conn.execute('SELECT login_count FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+        assert count < 100
+    finally:
+        release_writer.set()
+        thread.join()
+
+    with chess_app.db_read() as conn:
+        count = conn.execute('SELECT login_count FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+    assert count >= 100
+
+
+def test_write_rolled_back_on_exception(make_user):
+    _, user_id = make_user()
+    with pytest.raises(RuntimeError):
+        with chess_app.db_write() as conn:
+            conn.execute('UPDATE users SET email = ? WHERE id = ?', ('rollback@test', user_id))
+            raise RuntimeError('boom')
+
+    with chess_app.db_read() as conn:
+        email = conn.execute('SELECT email FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+    assert email != 'rollback@test'
+
+
+def test_concurrent_progress_updates_are_not_lost(make_user, upload_pgn):
+    client, user_id = make_user()
+    pgn_id = upload_pgn(grant_to=[user_id])
+    moves_per_thread = 20
+
+    def student():
+        local_client = chess_app.app.test_client()
+        with client.session_transaction() as source, local_client.session_transaction() as target:
+            target.update(source)
+        for _ in range(moves_per_thread):
+            local_client.post('/api/progress/update', json={
+                'pgn_game_id': pgn_id,
+                'branch_id': 'branch_1',
+                'is_correct': True
+            })
+
+    threads = [threading.Thread(target=student) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = client.get(f'/api/progress/current-stats/{pgn_id}').get_json()
+    assert stats['total_attempts'] == 4 * moves_per_thread
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试跨进程写入协调：数据库被其他连接/进程锁住时退避重试，超时报DatabaseBusyError
+"""
+
+import multiprocessing
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import chess_app, login
+
+
+def _hold_write_lock(seconds, started):
+    conn = sqlite3.connect(chess_app.DATABASE_PATH, isolation_level=None)
+    conn.execute('BEGIN IMMEDIATE')
+    started.set()
+    threading.Event().wait(seconds)
+    conn.rollback()
+    conn.close()
+
+
+def test_write_retries_while_other_connection_holds_lock():
+    started = threading.Event()
+    holder = threading.Thread(target=_hold_write_lock, args=(0.3, started))
+    holder.start()
+    started.wait(5)
+    retries_before = chess_app.write_metrics.snapshot()['busy_retries']
+    try:
+        with chess_app.db_write() as conn:
+            conn.execute('SELECT 1')
+    finally:
+        holder.join()
+    assert chess_app.write_metrics.snapshot()['busy_retries'] > retries_before
+
+
+def test_write_times_out_with_busy_error(monkeypatch):
+    monkeypatch.setattr(chess_app, 'DB_WRITE_TIMEOUT', 100)
+    started = threading.Event()
+    holder = threading.Thread(target=_hold_write_lock, args=(0.5, started))
+    holder.start()
+    started.wait(5)
+    try:
+        with pytest.raises(chess_app.DatabaseBusyError):
+            with chess_app.db_write():
+                pass
+    finally:
+        holder.join()
+    assert chess_app.write_metrics.snapshot()['timeouts'] >= 1
+
+
+def _student_process(pgn_id, username, moves, results):
+    client = chess_app.app.test_client()
+    login(client, username, 'secret123')
+    errors = 0
+    for i in range(moves):
+        response = client.post('/api/progress/update', json={
+            'pgn_game_id': pgn_id,
+            'branch_id': f'branch_{i % 3 + 1}',
+            'is_correct': True
+        })
+        if response.status_code != 200:
+            errors += 1
+    results.put(errors)
+
+
+def test_multi_process_writers_do_not_fail(admin_client, make_user, upload_pgn):
+    workers = 4
+    moves = 25
+    client, user_id = make_user()
+    username = client.get('/api/auth/me').get_json()['user']['username']
+    pgn_id = upload_pgn(grant_to=[user_id])
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=_student_process, args=(pgn_id, username, moves, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    errors = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=60)
+
+    assert errors == [0] * workers
+    stats = client.get(f'/api/progress/current-stats/{pgn_id}').get_json()
+    assert stats['total_attempts'] == workers * moves
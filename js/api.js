@@ -251,7 +251,7 @@ class ChessAPI {
                 
                 // 恢复棋谱数据到全局变量
                 if (parsedData.pgnData && parsedData.pgnData.branches) {
-                    window.pgnParser = parsedData.pgnData;
+                    window.pgnParser = materializeBranches(parsedData.pgnData);
                     console.log('已恢复棋谱数据到window.pgnParser，分支数量:', parsedData.pgnData.branches.length);
                     
                     // 如果有棋盘实例，加载用户进度
@@ -485,7 +485,7 @@ class ChessAPI {
                 
                 // 恢复棋谱数据到全局变量
                 if (data.branches && data.branches.length > 0) {
-                    window.pgnParser = data;
+                    window.pgnParser = materializeBranches(data);
                     console.log('✅ 已恢复服务端棋谱数据到window.pgnParser，分支数量:', data.branches.length);
                     
                     // 如果有棋盘实例，加载用户进度
@@ -551,5 +551,60 @@ class ChessAPI {
     }
 }
 
+// 服务端返回的分支只有叶子节点ID和深度，走法列表从共享的走法树上还原：
+// 第一次访问branch.moves时沿父节点链走回根节点，结果缓存在分支上。
+// 走法树按列存放（moves[i]、parents[i]对应node_<i+1>）；旧数据的走法树是带children的嵌套结构。
+// moves不可枚举，保存到本地存储时不会把每个分支的走法再写一遍；旧数据自带moves，原样保留
+function materializeBranches(pgnData) {
+    if (!pgnData || !pgnData.tree || !Array.isArray(pgnData.branches)) {
+        return pgnData;
+    }
+
+    let nodes = null; // 节点ID -> {move, parentId}，第一次还原时才建立
+    const indexTree = () => {
+        nodes = new Map();
+        const tree = pgnData.tree;
+        if (Array.isArray(tree.parents)) {
+            tree.parents.forEach((parent, i) => {
+                nodes.set(`node_${i + 1}`, { move: tree.moves[i], parentId: parent >= 0 ? `node_${parent + 1}` : null });
+            });
+            return;
+        }
+        const stack = [[tree, null]];
+        while (stack.length > 0) {
+            const [node, parentId] = stack.pop();
+            nodes.set(node.id, { move: node.move, parentId });
+            for (const child of node.children) {
+                stack.push([child, node.id]);
+            }
+        }
+    };
+
+    for (const branch of pgnData.branches) {
+        if (branch.moves || !branch.leaf) {
+            continue;
+        }
+        Object.defineProperty(branch, 'moves', {
+            configurable: true,
+            enumerable: false,
+            get() {
+                if (!nodes) {
+                    indexTree();
+                }
+                const moves = new Array(branch.depth);
+                let id = branch.leaf;
+                for (let i = branch.depth - 1; i >= 0; i--) {
+                    const entry = nodes.get(id);
+                    moves[i] = entry.move;
+                    id = entry.parentId;
+                }
+                Object.defineProperty(branch, 'moves', { value: moves, configurable: true, enumerable: false });
+                return moves;
+            }
+        });
+    }
+    return pgnData;
+}
+
 // 创建全局实例
 window.chessAPI = new ChessAPI(); 
\ No newline at end of file
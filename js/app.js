@@ -469,7 +469,7 @@ async function loadPGNById(pgnId) {
         }
         
         // 存储解析结果
-        window.pgnParser = pgnData;
+        window.pgnParser = materializeBranches(pgnData);
         
         // 重置棋盘状态
         window.chessBoard.completedBranches.clear();
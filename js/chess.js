@@ -1391,6 +1391,9 @@ class ChessBoard {
         // 从持久化存储恢复记忆学习的分支状态
         this.restoreBranchStatesFromStorage();
         
+        // 与后端同步分支状态（一次读取整个PGN，本地独有的状态一次批量上传）
+        await this.syncBranchStatesWithBackend();
+        
         // 重置正确率统计
         this.correctMoves = 0;
         this.totalMoves = 0;
@@ -3641,6 +3644,72 @@ class ChessBoard {
         }
     }
 
+    // 与后端同步整个PGN的记忆学习分支状态
+    async syncBranchStatesWithBackend() {
+        if (!window.chessAPI || !window.chessAPI.isBackendAvailable || !window.pgnParser?.metadata?.id) {
+            return;
+        }
+        
+        const pgnId = window.pgnParser.metadata.id;
+        const storageKey = `memory_learning_${pgnId}`;
+        
+        try {
+            const response = await fetch(`${window.chessAPI.baseURL}/progress/branch-states/${pgnId}?mode=memory_learning`, {
+                credentials: 'include'
+            });
+            if (!response.ok) {
+                console.warn('获取后端分支状态HTTP错误:', response.status);
+                return;
+            }
+            
+            const result = await response.json();
+            const serverStates = result.states || {};
+            
+            let localStates = {};
+            try {
+                localStates = JSON.parse(localStorage.getItem(storageKey) || '{}');
+            } catch (e) {
+                localStates = {};
+            }
+            
+            // 后端已有的状态以后端为准
+            for (const branchId in serverStates) {
+                const status = serverStates[branchId].status;
+                this.memoryCompletedBranches.delete(branchId);
+                this.memoryPausedBranches.delete(branchId);
+                if (status === 'completed') {
+                    this.memoryCompletedBranches.add(branchId);
+                } else if (status === 'paused') {
+                    this.memoryPausedBranches.add(branchId);
+                }
+                localStates[branchId] = { status: status, timestamp: Date.now(), mode: 'memory_learning' };
+            }
+            localStorage.setItem(storageKey, JSON.stringify(localStates));
+            
+            // 只存在于本地的状态（离线时保存的）一次批量上传
+            const pendingStates = {};
+            for (const branchId in localStates) {
+                if (!(branchId in serverStates) && localStates[branchId].mode === 'memory_learning') {
+                    pendingStates[branchId] = localStates[branchId].status;
+                }
+            }
+            if (Object.keys(pendingStates).length > 0) {
+                await fetch(`${window.chessAPI.baseURL}/progress/branch-states/${pgnId}`, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Type': 'application/json'
+                    },
+                    credentials: 'include',
+                    body: JSON.stringify({ mode: 'memory_learning', states: pendingStates })
+                });
+            }
+            
+            console.log('分支状态已与后端同步，后端:', Object.keys(serverStates).length, '本地上传:', Object.keys(pendingStates).length);
+        } catch (error) {
+            console.error('同步后端分支状态失败:', error);
+        }
+    }
+
     // 保存分支状态到本地存储
     saveBranchStateToLocalStorage(branchId, status) {
         try {
@@ -26,6 +26,18 @@ document.addEventListener('DOMContentLoaded', function() {
                     childrenContainer.classList.add('expanded');
                 }
             }
+        } else if (e.target.classList.contains('transposition-link')) {
+            // 转换边：定位并高亮转换到的已有局面节点
+            e.preventDefault();
+            e.stopPropagation();
+            
+            const target = document.querySelector(`.tree-node[data-node-id="${e.target.dataset.target}"]`);
+            if (target) {
+                const content = target.querySelector(':scope > .node-wrapper > .node-content');
+                content.scrollIntoView({ behavior: 'smooth', block: 'center', inline: 'center' });
+                content.classList.add('highlighted');
+                setTimeout(() => content.classList.remove('highlighted'), 1500);
+            }
         }
     });
 }); 
\ No newline at end of file